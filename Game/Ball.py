@@ -20,14 +20,31 @@ class Ball(pygame.Rect):
         super().__init__(x, y, width, height)
         self.add_score = add_score
         self.color = color
-        self.speed_x = speed_x
+        self.speed_x = speed_x  # Pixels per second
         self.speed_y = speed_y
+        # The rect only holds whole pixels, the simulation moves the ball in fractions of a pixel
+        self.position = [float(x), float(y)]
+        self.previous_position = list(self.position)  # Position before the last simulation tick
         if not skip_reset:
             self.reset()
 
-    def move(self):
-        self.x += self.speed_x
-        self.y += self.speed_y
+    def set_position(self, x: float, y: float):
+        """
+        Move the ball without interpolating from its previous position (e.g. a reset or a received state).
+        """
+        self.position = [float(x), float(y)]
+        self.previous_position = list(self.position)
+        self.x = round(x)
+        self.y = round(y)
+
+    def save_previous(self):
+        self.previous_position = list(self.position)
+
+    def move(self, dt: float):
+        self.position[0] += self.speed_x * dt
+        self.position[1] += self.speed_y * dt
+        self.x = round(self.position[0])
+        self.y = round(self.position[1])
 
     def collision_ceiling(self):
         if self.y <= 0 or self.y + self.height >= HEIGHT:
@@ -44,13 +61,15 @@ class Ball(pygame.Rect):
             self.speed_x *= -1.05
 
     def reset(self):
-        self.x = WIDTH // 2 - BALL_SIZE // 2
-        self.y = HEIGHT // 2 - BALL_SIZE // 2
+        self.set_position(WIDTH // 2 - BALL_SIZE // 2, HEIGHT // 2 - BALL_SIZE // 2)
         self.speed_x = BALL_SPEED_X if self.speed_x < 0 else -BALL_SPEED_X
         self.speed_y = BALL_SPEED_Y if self.speed_y < 0 else -BALL_SPEED_Y
 
-    def update(self, paddles: list):
-        self.move()
+    def update(self, paddles: list, dt: float = 1 / TICK_RATE):
+        """
+        Advance the ball by dt seconds.
+        """
+        self.move(dt)
         self.collision_ceiling()
         for paddle in paddles:
             self.collision_paddle(paddle)
@@ -64,16 +83,27 @@ class Ball(pygame.Rect):
                 self.add_score(0)  # Player scores
 
     def update_from_dict(self, data: dict):
-        self.x = data['x']
-        self.y = data['y']
-        self.width = data['width']
-        self.height = data['height']
-        self.speed_x = data['speed_x']
-        self.speed_y = data['speed_y']
-        self.color = tuple(data['color'])
+        # Data may be a delta only containing the fields that changed
+        if 'x' in data or 'y' in data:
+            self.set_position(data.get('x', self.position[0]), data.get('y', self.position[1]))
+        if 'width' in data:
+            self.width = data['width']
+        if 'height' in data:
+            self.height = data['height']
+        if 'speed_x' in data:
+            self.speed_x = data['speed_x']
+        if 'speed_y' in data:
+            self.speed_y = data['speed_y']
+        if 'color' in data:
+            self.color = tuple(data['color'])
 
-    def draw(self, screen):
-        pygame.draw.ellipse(screen, self.color, self)
+    def draw(self, screen, alpha: float = 1.0):
+        """
+        Draw the ball between its previous and current simulation position, alpha being the fraction in between.
+        """
+        x = self.previous_position[0] + (self.position[0] - self.previous_position[0]) * alpha
+        y = self.previous_position[1] + (self.position[1] - self.previous_position[1]) * alpha
+        pygame.draw.ellipse(screen, self.color, pygame.Rect(round(x), round(y), self.width, self.height))
 
     @staticmethod
     def from_dict(data: dict) -> 'Ball':
@@ -90,8 +120,8 @@ class Ball(pygame.Rect):
 
     def to_dict(self) -> dict:
         return {
-            'x': self.x,
-            'y': self.y,
+            'x': round(self.position[0], 1),
+            'y': round(self.position[1], 1),
             'width': self.width,
             'height': self.height,
             'speed_x': self.speed_x,
@@ -8,6 +8,8 @@ class GameState:
     paddle: 'Paddle'
     ball: 'Ball' = None  # Ball can be None for non-owners
     score: list = None
+    inputs: list = None  # Unacknowledged [sequence, direction] paddle inputs of a non-leader
+    acks: dict = None    # Leader only: peer_id -> [last applied input sequence, paddle y]
 
     def to_dict(self) -> dict:
         """
@@ -19,6 +21,10 @@ class GameState:
         if self.ball is not None:
             data['ball'] = self.ball.to_dict()
             data['score'] = self.score
+        if self.inputs is not None:
+            data['inputs'] = self.inputs
+        if self.acks is not None:
+            data['acks'] = self.acks
         return data
 
     def to_json(self) -> str:
@@ -35,4 +41,4 @@ class GameState:
         paddle = Paddle.from_dict(data['paddle'])
         ball = Ball.from_dict(data['ball']) if 'ball' in data else None
         score = data.get('score', None)
-        return GameState(paddle=paddle, ball=ball, score=score)
\ No newline at end of file
+        return GameState(paddle=paddle, ball=ball, score=score, inputs=data.get('inputs'), acks=data.get('acks'))
\ No newline at end of file
@@ -6,30 +6,53 @@ class Paddle(pygame.Rect):
     def __init__(self, x, y, width=PADDLE_WIDTH, height=PADDLE_HEIGHT,
                  speed=PADDLE_SPEED, color=(randint(100, 255), randint(100, 255), randint(100, 255))):
         super().__init__(x, y, width, height)
-        self.speed = speed
+        self.speed = speed  # Pixels per second
         self.color = color
+        # The rect only holds whole pixels, the simulation moves the paddle in fractions of a pixel
+        self.position_y = float(y)
+        self.previous_y = self.position_y  # Position before the last simulation tick, for interpolated drawing
 
-    def move(self, direction: str):
-        if direction == "up" and self.top > 0:
-            self.y -= self.speed
-        if direction == "down" and self.bottom < HEIGHT:
-            self.y += self.speed
+    def set_y(self, y: float):
+        self.position_y = float(y)
+        self.previous_y = self.position_y
+        self.y = round(self.position_y)
+
+    def save_previous(self):
+        self.previous_y = self.position_y
+
+    def move(self, direction: str, dt: float = 1 / TICK_RATE):
+        if direction == "up":
+            self.position_y = max(0.0, self.position_y - self.speed * dt)
+        if direction == "down":
+            self.position_y = min(float(HEIGHT - self.height), self.position_y + self.speed * dt)
+        self.y = round(self.position_y)
 
     def update_from_dict(self, data: dict):
-        self.x = data['x']
-        self.y = data['y']
-        self.width = data['width']
-        self.height = data['height']
-        self.speed = data['speed']
-        self.color = tuple(data['color'])
+        # Data may be a delta only containing the fields that changed
+        if 'x' in data:
+            self.x = data['x']
+        if 'y' in data:
+            self.set_y(data['y'])
+        if 'width' in data:
+            self.width = data['width']
+        if 'height' in data:
+            self.height = data['height']
+        if 'speed' in data:
+            self.speed = data['speed']
+        if 'color' in data:
+            self.color = tuple(data['color'])
 
-    def draw(self, screen):
-        pygame.draw.rect(screen, self.color, self)
+    def draw(self, screen, alpha: float = 1.0):
+        """
+        Draw the paddle between its previous and current simulation position, alpha being the fraction in between.
+        """
+        y = self.previous_y + (self.position_y - self.previous_y) * alpha
+        pygame.draw.rect(screen, self.color, pygame.Rect(self.x, round(y), self.width, self.height))
 
     def to_dict(self):
         return {
             'x': self.x,
-            'y': self.y,
+            'y': round(self.position_y, 1),
             'width': self.width,
             'height': self.height,
             'speed': self.speed,
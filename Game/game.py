@@ -8,6 +8,9 @@ from Middleware.peer import Peer
 import json 
 from Middleware.message import Message
 from Game.GameState import GameState
+from Game.snapshot import SnapshotEncoder, SnapshotDecoder
+from Game.interpolation import SnapshotInterpolator
+from Game.prediction import InputPredictor, InputAuthority
 import time
 
 class Pong:
@@ -20,6 +23,20 @@ class Pong:
         self.score = [0, 0]
         self.name = name
 
+        # Delta encoding of the game_state messages
+        self.snapshot_encoder = SnapshotEncoder()
+        self.snapshot_decoder = SnapshotDecoder(on_keyframe_missing=self.request_keyframe_from)
+        self.keyframe_requested = False  # Set when a peer missed our last keyframe, e.g. to conflation
+        self.known_peer_ids = {entry.id for entry in self.peer.get_peers()}
+
+        # Remote paddles and the ball are drawn from a buffer of their snapshots, slightly in the past
+        self.interpolator = SnapshotInterpolator(self.peer.logging_service)
+
+        # Non-leaders predict their paddle and reconcile it with the leader, which applies their inputs
+        self.input_predictor = InputPredictor()
+        self.input_authority = InputAuthority()
+        self.predicted_leader_id = None  # Leader the pending inputs were sent to
+
         # Determine leadership status
         self.is_leader = self.peer.is_leader
 
@@ -28,6 +45,7 @@ class Pong:
         pygame.display.set_caption("Multiplayer Pong")
         self.clock = pygame.time.Clock()
         self.running = True
+        self.input_direction = None  # Paddle direction held down, applied on every simulation tick
 
         # Initialize your paddle    
         self.paddle = Paddle(
@@ -47,7 +65,10 @@ class Pong:
         else:
             self.ball = None  # Non-leaders don't own the ball
 
-        self.peer.on_message_received = self.on_message_received
+        # game_state is delivered by peer.drain_latest on the game loop, side messages are cheap enough to run inline
+        self.peer.register_handler("game_state", self.handle_game_state_message)
+        self.peer.register_handler("side", self.handle_side_message)
+        self.peer.register_handler("keyframe_request", self.handle_keyframe_request_message)
 
     def organize_peers(self):
         print("Organizing peers")
@@ -55,7 +76,7 @@ class Pong:
         Organize the peers in the game.
         """
         self.paddle.x = WIDTH - PADDLE_WIDTH - 10
-        for i, peer in enumerate(self.peer.peers):
+        for i, entry in enumerate(self.peer.get_peers()):
             if i % 2 == 0:
                 side_message = Message(
                     id=str(self.peer.id),
@@ -68,82 +89,157 @@ class Pong:
                     type="side",
                     data={"side": "right"}
                 )
-            self.peer.send_private_message(peer[1], side_message)
+            self.peer.control.send(entry.id, side_message)
         self.is_peers_organized = True
 
-    def on_message_received(self, message: Message):
+    def handle_game_state_message(self, message: Message):
         """
-        Callback for handling incoming messages from peers.
-        Expects 'game_state' type messages containing game state data.
+        Handle 'game_state' messages containing the (delta encoded) game state of a peer.
         """
-        msg_type = message.type
-        if msg_type == "game_state":
-            game_state_data = message.data.get("game_state")
-            sender_id = message.id
+        game_state_data = message.data.get("game_state")
+        sender_id = message.id
 
-            self.game_state_received.add(sender_id)
+        self.game_state_received.add(sender_id)
 
-            if game_state_data:
-                self.apply_game_state(game_state_data, sender_id)
+        if game_state_data is not None:
+            changes = self.snapshot_decoder.decode(sender_id, message.data)
+            if changes:
+                self.apply_game_state(changes, sender_id)
+            if changes is not None:
+                # Unchanged snapshots are buffered too, so a resting paddle doesn't look like a starved buffer
+                self.buffer_snapshot(message, sender_id)
 
-            if self.is_leader and len(self.game_state_received) == len(self.peer.peers) and not self.is_peers_organized:
-                self.organize_peers()
+        if self.is_leader and len(self.game_state_received) == len(self.peer.peers) and not self.is_peers_organized:
+            self.organize_peers()
 
-        elif msg_type == "side":
-            print("Received side message")
-            side = message.data.get("side")
-            if side:
-                if side == "left":
-                    self.paddle.x = 10
-                elif side == "right":
-                    self.paddle.x = WIDTH - PADDLE_WIDTH - 10
+    def handle_side_message(self, message: Message):
+        """
+        Handle 'side' messages from the leader assigning this peer's paddle to a side.
+        """
+        print("Received side message")
+        side = message.data.get("side")
+        if side:
+            if side == "left":
+                self.paddle.x = 10
+            elif side == "right":
+                self.paddle.x = WIDTH - PADDLE_WIDTH - 10
+
+    def request_keyframe_from(self, sender_id: str):
+        """
+        Ask a peer for a keyframe, its deltas refer to one that never reached this peer.
+        """
+        self.peer.control.send(sender_id, Message(id=str(self.peer.id), type="keyframe_request", data={}))
 
-    def apply_game_state(self, game_state_data: dict, sender_id: str):
+    def handle_keyframe_request_message(self, message: Message):
         """
-        Apply the received game state to update local game objects.
+        Handle 'keyframe_request' messages, the next game state is sent as a keyframe.
         """
-        try:
-            # Create a GameState instance from the received data
-            game_state = GameState.from_dict(game_state_data)
-            paddle_data = game_state.paddle.to_dict()
-            ball_data = game_state.ball.to_dict() if game_state.ball else None
-            score = game_state.score
+        self.keyframe_requested = True
 
-            #if ball_data:
-            #    print(f'BALL DATA: {ball_data["x"]}')
+    def apply_game_state(self, changes: dict, sender_id: str):
+        """
+        Apply the fields of the sender's game state that changed to the local game objects, in place.
+        """
+        try:
+            full_state = self.snapshot_decoder.get_state(sender_id)
+            paddle_data = changes.get('paddle')
+            ball_data = changes.get('ball')
+            score = changes.get('score')
 
             if score is not None:
-                self.score = score
+                self.score = list(score)
 
             # Update or create the sender's paddle
             peer_name = self.get_peer_name_by_id(sender_id)
             if peer_name not in self.paddles:
-                paddle = Paddle.from_dict(paddle_data)
-                self.paddles[peer_name] = paddle
-            else:
-                paddle = self.paddles[peer_name]
-                paddle.update_from_dict(paddle_data)
+                self.paddles[peer_name] = Paddle.from_dict(full_state['paddle'])
+            elif paddle_data:
+                if self.is_leader and self.input_authority.is_tracking(sender_id):
+                    # The leader moves this paddle from the sender's inputs, ignore the position it predicted
+                    paddle_data = {key: value for key, value in paddle_data.items() if key != 'y'}
+                self.paddles[peer_name].update_from_dict(paddle_data)
+
+            if self.is_leader and 'inputs' in changes:
+                self.input_authority.apply(sender_id, self.paddles[peer_name], full_state['inputs'])
+
+            # Reconcile the predicted paddle with the position the leader computed from our inputs
+            acks = changes.get('acks')
+            if acks and str(self.peer.id) in acks and str(self.peer.leader_id) == sender_id and not self.is_leader:
+                acknowledged_sequence, authoritative_y = full_state['acks'][str(self.peer.id)]
+                self.input_predictor.reconcile(self.paddle, acknowledged_sequence, authoritative_y)
 
             # Update the ball only if the sender is the leader and this peer is not the leader
             if ball_data and self.peer.leader_id == sender_id and not self.is_leader:
                 if self.ball is None:
                     self.ball = Ball(add_score=self.add_score)  # Initialize if not present
+                    ball_data = full_state['ball']
                 self.ball.update_from_dict(ball_data)
         except json.JSONDecodeError:
             print("Received invalid game state JSON.")
         except Exception as e:
             print(f"Error applying game state: {e}")
 
+    def buffer_snapshot(self, message: Message, sender_id: str):
+        """
+        Add the positions of the sender's paddle and, from the leader, the ball to the interpolation buffers.
+        """
+        if message.send_timestamp is not None:
+            sender_time = message.send_timestamp.timestamp()
+        else:
+            sender_time = message.data.get("seq", 0) / SEND_RATE  # Sent at a fixed rate
+        full_state = self.snapshot_decoder.get_state(sender_id)
+        if 'paddle' in full_state and not (self.is_leader and self.input_authority.is_tracking(sender_id)):
+            self.interpolator.add(sender_id, 'paddle', sender_time, full_state['paddle'])
+        if 'ball' in full_state and self.peer.leader_id == sender_id and not self.is_leader:
+            self.interpolator.add(sender_id, 'ball', sender_time, full_state['ball'])
+
+    def apply_interpolation(self):
+        """
+        Move the remote paddles and the ball to their interpolated positions before drawing.
+        """
+        for sender_id, entity in list(self.interpolator.buffers):
+            position = self.interpolator.sample(sender_id, entity)
+            if position is None:
+                continue
+            if entity == 'paddle':
+                if self.is_leader and self.input_authority.is_tracking(sender_id):
+                    continue  # Moved by the leader from the sender's inputs
+                paddle = self.paddles.get(self.get_peer_name_by_id(sender_id))
+                if paddle is not None:
+                    paddle.x = round(position['x'])
+                    paddle.set_y(position['y'])
+            elif entity == 'ball' and self.ball is not None and not self.is_leader:
+                self.ball.set_position(position['x'], position['y'])
+
+    def predict_input(self, direction: str):
+        """
+        Record an input applied to the local paddle, to be sent to the leader until it is acknowledged.
+        """
+        leader_id = str(self.peer.leader_id) if self.peer.leader_id else None
+        if leader_id != self.predicted_leader_id:
+            # A new leader starts from our reported position, inputs meant for the old one are void
+            self.input_predictor.reset()
+            self.predicted_leader_id = leader_id
+        if leader_id is not None:
+            self.input_predictor.record(direction)
+
+    def get_paddles_by_peer_id(self) -> dict:
+        paddles = {}
+        for entry in self.peer.get_peers():
+            paddle = self.paddles.get(f"player{entry.slot + 1}")
+            if paddle is not None:
+                paddles[entry.id] = paddle
+        return paddles
+
     def get_peer_name_by_id(self, peer_id: str) -> str:
         """
         Map a peer ID to a human-readable peer name.
-        Customize this method based on how you manage peer identities.
+        Names follow the peer's player slot, which it keeps while connected, player1 is the local player.
         """
-        # Placeholder implementation: Assign names based on peer order
-        for index, (address, pid) in enumerate(self.peer.get_peers(), start=2):
-            if pid == peer_id:
-                return f"player{index}"
-        return "unknown"
+        entry = self.peer.get_peer_by_id(peer_id)
+        if entry is None:
+            return "unknown"
+        return f"player{entry.slot + 1}"
 
     def handle_events(self):
         """
@@ -155,9 +251,11 @@ class Pong:
 
         keys = pygame.key.get_pressed()
         if keys[pygame.K_UP]:
-            self.paddle.move("up")
-        if keys[pygame.K_DOWN]:
-            self.paddle.move("down")
+            self.input_direction = "up"
+        elif keys[pygame.K_DOWN]:
+            self.input_direction = "down"
+        else:
+            self.input_direction = None
 
     def add_score(self, player: int):
         """
@@ -169,7 +267,14 @@ class Pong:
     def run(self):
         """
         Main game loop.
+        The simulation advances in fixed ticks of 1 / TICK_RATE seconds, as many as the elapsed real time allows,
+        game state is sent at SEND_RATE and every frame is drawn between the last two simulation states.
         """
+        tick_dt = 1 / TICK_RATE
+        send_interval = 1 / SEND_RATE
+        accumulator = 0.0
+        send_accumulator = 0.0
+        previous_time = time.perf_counter()
         last_time = time.time()
         while self.running:
             current_time = time.time()
@@ -177,46 +282,90 @@ class Pong:
             if delta >= 1.0:
                 self.peer.logging_service.add_fps_sample(self.clock.get_fps())
                 last_time = current_time
+
+            now = time.perf_counter()
+            # After a long stall (e.g. the window being dragged) drop the missed time instead of catching up on it
+            frame_time = min(now - previous_time, MAX_FRAME_TIME)
+            previous_time = now
+            accumulator += frame_time
+            send_accumulator += frame_time
+
             self.handle_events()
-            self._update()
-            self._draw()
+            self.peer.drain_latest()  # Apply the newest game state of every peer
 
-            # Prepare and send game state
-            if self.is_leader:
-                game_state = GameState(self.paddle, self.ball, self.score)
-            else:
-                game_state = GameState(self.paddle)
-            
-            # Create a Message instance for game_state
-            game_state_message = Message(
-                id=str(self.peer.id),
-                type="game_state",
-                data={
-                    "game_state": game_state.to_dict()
-                }
-            )
-            self.peer.send_public_message(game_state_message)
+            while accumulator >= tick_dt:
+                self._update(tick_dt)
+                accumulator -= tick_dt
+
+            if send_accumulator >= send_interval:
+                # At most one send per frame, a frame rate below SEND_RATE can't produce new state any faster
+                send_accumulator = min(send_accumulator - send_interval, send_interval)
+                self.send_game_state()
 
-            self.clock.tick(60)  # Maintain 60 FPS
+            self._draw(accumulator / tick_dt)
+
+            self.clock.tick(RENDER_FPS)
 
         self.quit()
 
-    def _update(self):
+    def send_game_state(self):
+        """
+        Send the game state owned by this peer, the ball and the score only if it is the leader.
+        """
+        if self.is_leader:
+            acks = self.input_authority.acknowledgements(self.get_paddles_by_peer_id())
+            game_state = GameState(self.paddle, self.ball, self.score, acks=acks)
+        else:
+            game_state = GameState(self.paddle, inputs=self.input_predictor.unacknowledged())
+
+        # Send a keyframe right away when a peer joins, so it doesn't wait for the next one
+        if len(self.peer.peers) != self.known_peer_count:
+            self.known_peer_ids = {entry.id for entry in self.peer.get_peers()}
+            self.snapshot_encoder.request_keyframe()
+
+        # Create a Message instance for game_state, only holding the fields changed since the last keyframe
+        game_state_message = Message(
+            id=str(self.peer.id),
+            type="game_state",
+            data=self.snapshot_encoder.encode(game_state.to_dict())
+        )
+        self.peer.send_state_message(game_state_message)
+
+    def forget_peers(self, peer_ids: set):
         """
-        Update game objects.
+        Drop what is kept about peers the Peer removed, so a peer rejoining with the same ID starts over.
+        Runs on the game loop, which owns the snapshot state, rather than in Peer.remove_peer.
         """
+        for peer_id in peer_ids:
+            self.snapshot_decoder.forget(peer_id)
+            self.interpolator.forget(peer_id)
+            self.input_authority.forget(peer_id)
+
+    def _update(self, dt: float):
+        """
+        Advance the locally simulated game objects by one tick of dt seconds.
+        """
+        self.paddle.save_previous()
+        if self.input_direction:
+            self.paddle.move(self.input_direction, dt)
+            if not self.is_leader:
+                self.predict_input(self.input_direction)
         if self.is_leader and self.ball:
-            self.ball.update(list(self.paddles.values()))
+            self.ball.save_previous()
+            self.ball.update(list(self.paddles.values()), dt)
 
-    def _draw(self):
+    def _draw(self, alpha: float = 1.0):
         """
         Render the game state to the screen.
+
+        :param alpha: Fraction of a simulation tick elapsed since the last one, to interpolate positions.
         """
+        self.apply_interpolation()
         self.screen.fill(BLACK)
         for paddle in self.paddles.values():
-            paddle.draw(self.screen)
+            paddle.draw(self.screen, alpha)
         if self.ball:
-            self.ball.draw(self.screen)
+            self.ball.draw(self.screen, alpha)
         pygame.draw.aaline(self.screen, WHITE, (WIDTH // 2, 0), (WIDTH // 2, HEIGHT))
 
         # Render the score
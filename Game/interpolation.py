@@ -0,0 +1,113 @@
+import time
+from collections import deque
+from properties import INTERPOLATION_DELAY, MAX_EXTRAPOLATION, SNAPSHOT_BUFFER_SIZE
+
+'''
+Snapshot Interpolation
+    - Remote entities (other peers' paddles, the leader's ball) are drawn INTERPOLATION_DELAY seconds in the past,
+      between the two buffered snapshots around that time, so network jitter and bursts don't show as stutter
+    - Snapshots are ordered on the sender's timeline (its send timestamps). The sender's clock is mapped to the
+      local clock with the smallest (receive time - send time) seen recently, so clock offsets cancel out
+    - When the buffer runs dry the last movement is extrapolated for up to MAX_EXTRAPOLATION seconds,
+      after that the entity holds its last position
+    - Buffer depth and extrapolated/starved samples are reported to the LoggingService to size the delay
+'''
+
+POSITION_FIELDS = ('x', 'y')
+
+class SnapshotBuffer:
+    def __init__(self, capacity: int = SNAPSHOT_BUFFER_SIZE):
+        self.snapshots = deque(maxlen=capacity)  # (sender time, {x, y}), ordered by sender time
+        self.offsets = deque(maxlen=capacity)    # local receive time - sender time
+
+    def add(self, sender_time: float, local_time: float, position: dict) -> bool:
+        """
+        Buffer a snapshot, snapshots older than the newest one are dropped.
+        """
+        if self.snapshots and sender_time <= self.snapshots[-1][0]:
+            return False
+        self.snapshots.append((sender_time, position))
+        self.offsets.append(local_time - sender_time)
+        return True
+
+    def sample(self, local_time: float, delay: float, max_extrapolation: float):
+        """
+        Return the position at local_time - delay.
+
+        :return: Tuple of (position, buffer depth, extrapolated, starved), position is None if the buffer is empty.
+                 The depth is the number of snapshots newer than the sampled time.
+        """
+        if not self.snapshots:
+            return None, 0, False, False
+
+        render_time = local_time - min(self.offsets) - delay
+        newest_time, newest = self.snapshots[-1]
+        if render_time >= newest_time:
+            if len(self.snapshots) < 2:
+                return newest, 0, False, True
+            previous_time, previous = self.snapshots[-2]
+            ahead = render_time - newest_time
+            starved = ahead > max_extrapolation
+            fraction = min(ahead, max_extrapolation) / (newest_time - previous_time)
+            return lerp(previous, newest, 1 + fraction), 0, not starved, starved
+
+        # Walk back from the newest snapshot, the sampled time is usually close to it
+        depth = 1
+        for index in range(len(self.snapshots) - 2, -1, -1):
+            start_time, start = self.snapshots[index]
+            if start_time <= render_time:
+                end_time, end = self.snapshots[index + 1]
+                fraction = (render_time - start_time) / (end_time - start_time)
+                return lerp(start, end, fraction), depth, False, False
+            depth += 1
+        # Older than anything buffered, e.g. right after joining
+        return self.snapshots[0][1], depth, False, False
+
+def lerp(start: dict, end: dict, fraction: float) -> dict:
+    return {key: start[key] + (end[key] - start[key]) * fraction for key in POSITION_FIELDS}
+
+class SnapshotInterpolator:
+    def __init__(self, logging_service=None, delay: float = INTERPOLATION_DELAY,
+                 max_extrapolation: float = MAX_EXTRAPOLATION):
+        """
+        Initialize the SnapshotInterpolator.
+
+        :param logging_service: LoggingService receiving the buffer depth and extrapolation samples.
+        :param delay: Seconds remote entities are drawn in the past.
+        :param max_extrapolation: Seconds an entity keeps moving after its last snapshot.
+        """
+        self.logging_service = logging_service
+        self.delay = delay
+        self.max_extrapolation = max_extrapolation
+        self.buffers = {}  # (sender_id, entity) -> SnapshotBuffer
+
+    def add(self, sender_id: str, entity: str, sender_time: float, state: dict):
+        """
+        Buffer the position of an entity from a sender's snapshot.
+
+        :param entity: Name of the entity in the game state, e.g. "paddle" or "ball".
+        :param sender_time: Send time of the snapshot on the sender's clock, in seconds.
+        :param state: Full state of the entity, only its position is buffered.
+        """
+        if not all(key in state for key in POSITION_FIELDS):
+            return
+        buffer = self.buffers.get((sender_id, entity))
+        if buffer is None:
+            buffer = self.buffers[(sender_id, entity)] = SnapshotBuffer()
+        buffer.add(sender_time, time.perf_counter(), {key: state[key] for key in POSITION_FIELDS})
+
+    def sample(self, sender_id: str, entity: str):
+        """
+        Return the interpolated {x, y} position of an entity to draw now, None if nothing is buffered.
+        """
+        buffer = self.buffers.get((sender_id, entity))
+        if buffer is None:
+            return None
+        position, depth, extrapolated, starved = buffer.sample(time.perf_counter(), self.delay, self.max_extrapolation)
+        if position is not None and self.logging_service is not None:
+            self.logging_service.add_interpolation_sample(depth, extrapolated, starved)
+        return position
+
+    def forget(self, sender_id: str):
+        for key in [key for key in self.buffers if key[0] == sender_id]:
+            del self.buffers[key]
@@ -0,0 +1,93 @@
+from collections import deque
+from properties import INPUT_BUFFER_SIZE
+from Game.Paddle import Paddle
+
+'''
+Client-Side Prediction and Server Reconciliation
+    - Non-leaders number every simulation tick with paddle input and move their paddle right away (prediction)
+    - Every game_state message carries all inputs the leader hasn't acknowledged yet, so inputs dropped by
+      conflation or lost messages are resent with the next snapshot
+    - The leader applies each input once, in order, to its own copy of the peer's paddle, which the ball collides with.
+      Its game_state messages acknowledge the last applied input per peer, with the resulting paddle position
+    - On an acknowledgement the peer resets its paddle to the leader's position and replays the inputs
+      the leader hasn't applied yet on top of it (reconciliation)
+    - Inputs are [sequence, direction] pairs, every input is one simulation tick of 1 / TICK_RATE seconds
+'''
+
+class InputPredictor:
+    def __init__(self, capacity: int = INPUT_BUFFER_SIZE):
+        """
+        Initialize the InputPredictor of the local paddle.
+
+        :param capacity: Most unacknowledged inputs kept, older ones are dropped if the leader stops acknowledging.
+        """
+        self.sequence = 0
+        self.pending = deque(maxlen=capacity)  # [sequence, direction] not acknowledged by the leader
+
+    def record(self, direction: str) -> int:
+        """
+        Record the input of one simulation tick, after it has been applied to the local paddle.
+        """
+        self.sequence += 1
+        self.pending.append([self.sequence, direction])
+        return self.sequence
+
+    def unacknowledged(self) -> list:
+        return [list(paddle_input) for paddle_input in self.pending]
+
+    def reconcile(self, paddle: 'Paddle', acknowledged_sequence: int, authoritative_y: float):
+        """
+        Reset the paddle to the leader's position after the acknowledged input and replay the newer inputs.
+        """
+        while self.pending and self.pending[0][0] <= acknowledged_sequence:
+            self.pending.popleft()
+        previous_y = paddle.previous_y
+        paddle.set_y(authoritative_y)
+        for _, direction in self.pending:
+            paddle.move(direction)
+        paddle.previous_y = previous_y  # Keep drawing from where the paddle was, instead of snapping
+
+    def reset(self):
+        """
+        Forget the pending inputs, e.g. when the leader changes.
+        """
+        self.pending.clear()
+
+class InputAuthority:
+    def __init__(self):
+        self.last_applied = {}  # peer_id -> sequence of the last input applied to the peer's paddle
+
+    def is_tracking(self, peer_id: str) -> bool:
+        return peer_id in self.last_applied
+
+    def apply(self, peer_id: str, paddle: 'Paddle', inputs: list):
+        """
+        Apply the inputs of a peer that haven't been applied yet, in order.
+        The first inputs seen from a peer are not applied, its reported paddle position already includes them.
+        """
+        if not inputs:
+            return
+        last_applied = self.last_applied.get(peer_id)
+        if last_applied is None:
+            self.last_applied[peer_id] = max(sequence for sequence, _ in inputs)
+            return
+        for sequence, direction in sorted(inputs):
+            if sequence > last_applied:
+                paddle.move(direction)
+                last_applied = sequence
+        self.last_applied[peer_id] = last_applied
+
+    def acknowledgements(self, paddles: dict) -> dict:
+        """
+        Return {peer_id: [last applied input, paddle y]} for the game_state message of the leader.
+
+        :param paddles: peer_id -> the leader's copy of that peer's paddle.
+        """
+        return {
+            peer_id: [sequence, round(paddles[peer_id].position_y, 1)]
+            for peer_id, sequence in self.last_applied.items()
+            if peer_id in paddles
+        }
+
+    def forget(self, peer_id: str):
+        self.last_applied.pop(peer_id, None)
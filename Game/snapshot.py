@@ -0,0 +1,154 @@
+import copy
+from properties import KEYFRAME_INTERVAL
+
+'''
+Snapshot Delta Encoding
+    - Game state is sent as a full keyframe every KEYFRAME_INTERVAL snapshots, so late joiners can resync
+    - In between, only the fields that differ from the last keyframe are sent
+    - Deltas are relative to the keyframe (the shared PUB baseline) rather than to the previous snapshot,
+      so a lost delta never corrupts a receiver's state, a lost keyframe only delays it
+    - Fields removed since the keyframe are listed under the REMOVED key of their dictionary
+    - Conflation on the receiver can replace a keyframe with the next delta before it is decoded,
+      the decoder then reports the missing keyframe once so the game can ask the sender for a new one
+'''
+
+REMOVED = "__removed__"  # Key of the list of fields a delta removes from its dictionary
+
+def diff_state(baseline: dict, state: dict) -> dict:
+    """
+    Return the (nested) fields of state that differ from baseline.
+    """
+    delta = {}
+    for key, value in state.items():
+        base_value = baseline.get(key)
+        if isinstance(value, dict) and isinstance(base_value, dict):
+            nested_delta = diff_state(base_value, value)
+            if nested_delta:
+                delta[key] = nested_delta
+        elif value != base_value:
+            delta[key] = value
+    removed = [key for key in baseline if key not in state]
+    if removed:
+        delta[REMOVED] = removed
+    return delta
+
+def merge_state(baseline: dict, delta: dict) -> dict:
+    """
+    Return a new state with the (nested) fields of delta applied on top of baseline.
+    """
+    merged = dict(baseline)
+    for key, value in delta.items():
+        if key == REMOVED:
+            for removed_key in value:
+                merged.pop(removed_key, None)
+            continue
+        base_value = baseline.get(key)
+        if isinstance(value, dict) and isinstance(base_value, dict):
+            merged[key] = merge_state(base_value, value)
+        else:
+            merged[key] = value
+    return merged
+
+class SnapshotEncoder:
+    def __init__(self, keyframe_interval: int = KEYFRAME_INTERVAL):
+        """
+        Initialize the SnapshotEncoder.
+
+        :param keyframe_interval: Number of snapshots between two full keyframes.
+        """
+        self.keyframe_interval = keyframe_interval
+        self.sequence = 0
+        self.baseline = None
+        self.baseline_sequence = None
+
+    def request_keyframe(self):
+        """
+        Make the next snapshot a full keyframe, e.g. when a new peer joins.
+        """
+        self.baseline = None
+
+    def encode(self, state: dict) -> dict:
+        """
+        Encode a game state dictionary into the data of a game_state message.
+
+        :param state: Full game state, as returned by GameState.to_dict.
+        :return: Dictionary with the sequence number, the keyframe it is based on and the (delta) game state.
+        """
+        self.sequence += 1
+        if (self.baseline is None
+                or self.sequence - self.baseline_sequence >= self.keyframe_interval
+                or state.keys() != self.baseline.keys()):
+            # The state is copied since some fields (e.g. the score) are shared with the game
+            self.baseline = copy.deepcopy(state)
+            self.baseline_sequence = self.sequence
+            return {"seq": self.sequence, "base": self.sequence, "game_state": state}
+
+        return {
+            "seq": self.sequence,
+            "base": self.baseline_sequence,
+            "game_state": diff_state(self.baseline, state)
+        }
+
+class SnapshotDecoder:
+    def __init__(self, on_keyframe_missing: callable = None):
+        """
+        Initialize the SnapshotDecoder.
+
+        :param on_keyframe_missing: Called with the sender ID once per keyframe that deltas arrive for
+                                    but that was never decoded, e.g. to request a new keyframe.
+        """
+        self.on_keyframe_missing = on_keyframe_missing
+        self.baselines = {}  # sender_id -> (keyframe sequence, keyframe state)
+        self.states = {}     # sender_id -> last resolved state
+        self.sequences = {}  # sender_id -> last applied sequence
+        self.missing_bases = {}  # sender_id -> keyframe sequence last reported missing
+
+    def decode(self, sender_id: str, data: dict):
+        """
+        Resolve the data of a game_state message against the sender's keyframe.
+
+        :param sender_id: ID of the sending peer.
+        :param data: Data of the game_state message.
+        :return: The fields that changed since the previous snapshot of the sender,
+                 or None if the snapshot can't be resolved yet (keyframe missing) or is stale.
+        """
+        payload = data.get("game_state")
+        sequence = data.get("seq")
+        if payload is None:
+            return None
+
+        if sequence is None:
+            # Sender doesn't delta encode, every snapshot is a full state
+            state = payload
+        else:
+            if sequence <= self.sequences.get(sender_id, 0):
+                return None
+            base = data.get("base")
+            if base == sequence:
+                self.baselines[sender_id] = (sequence, payload)
+                state = payload
+            else:
+                baseline = self.baselines.get(sender_id)
+                if baseline is None or baseline[0] != base:
+                    if self.on_keyframe_missing is not None and self.missing_bases.get(sender_id) != base:
+                        self.missing_bases[sender_id] = base
+                        self.on_keyframe_missing(sender_id)
+                    return None  # Wait for the next keyframe
+                state = merge_state(baseline[1], payload)
+            self.sequences[sender_id] = sequence
+
+        previous_state = self.states.get(sender_id, {})
+        self.states[sender_id] = state
+        return diff_state(previous_state, state)
+
+    def get_state(self, sender_id: str) -> dict:
+        """
+        Return the last resolved full state of a sender.
+        """
+        return self.states.get(sender_id, {})
+
+    def forget(self, sender_id: str):
+        self.baselines.pop(sender_id, None)
+        self.states.pop(sender_id, None)
+        self.sequences.pop(sender_id, None)
+        self.missing_bases.pop(sender_id, None)
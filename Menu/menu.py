@@ -45,12 +45,7 @@ def menu() -> Peer:
 
         # Display each peer's information
         for index, peer_i in enumerate(peers):
-            peer_id, peer_ip, peer_port = "N/A", "N/A", "N/A"
-            if len(peer_i) == 2:
-                peer_id = peer_i[1]
-                peer_ip, peer_port = peer_i[0].split(":")
-
-            peer_info = f"Peer {index + 1}: ID: {peer_id}, IP: {peer_ip}, Port: {peer_port}"
+            peer_info = f"Peer {index + 1}: ID: {peer_i.id}, IP: {peer_i.ip}, Port: {peer_i.port}"
             peer_surface = font.render(peer_info, True, WHITE)
             screen.blit(peer_surface, (50, 200 + index * 30))
 
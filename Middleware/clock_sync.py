@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import deque
+from properties import CLOCK_SYNC_INTERVAL, CLOCK_SYNC_SAMPLES, CLOCK_SYNC_SMOOTHING
+from Middleware.peer import Peer
+from Middleware.message import Message
+
+'''
+Clock Synchronization Service
+    - Estimates the offset of this peer's clock to the elected leader's clock, Cristian/NTP style,
+      over the peer's own ZeroMQ sockets, so no external time server is needed
+    - Every CLOCK_SYNC_INTERVAL seconds a non-leader sends a clock_ping with its send time t0, the leader
+      answers with a clock_pong holding t0, its receive time t1 and its send time t2, received at t3:
+        round trip = (t3 - t0) - (t2 - t1), offset = ((t1 - t0) + (t2 - t3)) / 2
+    - Of the last CLOCK_SYNC_SAMPLES exchanges only the one with the smallest round trip is used, it has the
+      least queuing delay and the smallest error; the offset moves towards it by CLOCK_SYNC_SMOOTHING
+    - SyncedClock reads a monotonic clock anchored to the wall clock once, so system clock steps don't
+      show up in timestamps, plus the estimated offset. The leader answers with its own synced clock,
+      a new leader keeps the timeline of the previous one
+'''
+
+class SyncedClock:
+    def __init__(self):
+        self.wall_anchor = time.time()
+        self.monotonic_anchor = time.monotonic()
+        self.offset = 0.0  # Seconds to add to the local clock to get the leader's clock
+        self.synchronized = False
+
+    def local_time(self) -> float:
+        return self.wall_anchor + (time.monotonic() - self.monotonic_anchor)
+
+    def now(self) -> float:
+        """
+        Return the current time on the leader's clock, in seconds since the epoch.
+        """
+        return self.local_time() + self.offset
+
+class ClockSyncService:
+    def __init__(self, peer: 'Peer'):
+        """
+        Initialize the ClockSyncService.
+
+        :param peer: Instance of the Peer class.
+        """
+        self.peer = peer
+        self.clock = SyncedClock()
+        self.samples = deque(maxlen=CLOCK_SYNC_SAMPLES)  # (round trip, offset)
+        self.reference_id = None  # Leader the samples were taken against
+        self.lock = threading.Lock()
+
+        # Answered inline on the receiving thread, queuing would add to the measured round trip
+        self.peer.register_handler("clock_ping", self.handle_clock_ping)
+        self.peer.register_handler("clock_pong", self.handle_clock_pong)
+        self.sync_timer = self.peer.runtime.call_every(CLOCK_SYNC_INTERVAL, self.send_clock_ping)
+
+    def send_clock_ping(self):
+        """
+        Send a clock_ping to the leader, called every CLOCK_SYNC_INTERVAL seconds.
+        """
+        leader_id = self.peer.leader_id
+        if leader_id is None or self.peer.is_leader:
+            return
+        with self.lock:
+            if str(leader_id) != self.reference_id:
+                # Samples against the old leader don't apply, the offset is kept until new samples arrive
+                self.samples.clear()
+                self.reference_id = str(leader_id)
+        ping_message = Message(
+            id=str(self.peer.id),
+            type="clock_ping",
+            data={"t0": self.clock.local_time()}
+        )
+        self.peer.send_private_message(str(leader_id), ping_message)
+
+    def handle_clock_ping(self, message: Message):
+        receive_time = self.clock.now()
+        pong_message = Message(
+            id=str(self.peer.id),
+            type="clock_pong",
+            data={"t0": message.data.get("t0"), "t1": receive_time}
+        )
+        pong_message.data["t2"] = self.clock.now()
+        self.peer.send_private_message(message.id, pong_message)
+
+    def handle_clock_pong(self, message: Message):
+        t3 = self.clock.local_time()
+        t0, t1, t2 = message.data.get("t0"), message.data.get("t1"), message.data.get("t2")
+        if None in (t0, t1, t2) or message.id != self.reference_id:
+            return  # Malformed, or answered by a previous leader
+
+        round_trip = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        with self.lock:
+            self.samples.append((round_trip, offset))
+            best_offset = min(self.samples)[1]
+            if self.clock.synchronized:
+                self.clock.offset += CLOCK_SYNC_SMOOTHING * (best_offset - self.clock.offset)
+            else:
+                self.clock.offset = best_offset
+                self.clock.synchronized = True
+
+    def shutdown(self):
+        self.sync_timer.cancel()
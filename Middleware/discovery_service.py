@@ -2,35 +2,92 @@ import threading
 import time
 import json
 import socket
-from Middleware.utils import get_broadcast_address
-from properties import UDP_BROADCAST_PORT, PRESENCE_BROADCAST_INTERVAL
+import asyncio
+import struct
+from Middleware.utils import get_broadcast_address, get_interface
+from properties import UDP_BROADCAST_PORT, PRESENCE_BROADCAST_INTERVAL, PRESENCE_BACKOFF, PRESENCE_MAX_INTERVAL
+from properties import DISCOVERY_MODE, MULTICAST_GROUP, MULTICAST_TTL, MULTICAST_INTERFACE
+from properties import PEER_EXPIRY_TIMEOUT, PEER_EXPIRY_CHECK
 from properties import KEY
 from Middleware.peer import Peer
 from Middleware.message import Message 
 
-UDP_BROADCAST_IP = get_broadcast_address()
-
 '''
 UDP Discovery Service
     - Create message with id, ip, port
     - Encrypt message with XOR encryption
-    - Broadcast encrypted message over UDP
+    - Broadcast encrypted message over UDP, to the broadcast address of the peer's subnet (computed from the
+      netmask of the interface holding the peer's ip) or, in multicast mode, to MULTICAST_GROUP
     - Listen for UDP messages
     - Decrypt message with XOR encryption
     - Parse message and call on_peer_found callback
+    - With the asyncio runtime, listening is an asyncio datagram endpoint
+    - The XOR cipher works on the whole datagram as one integer instead of byte by byte
+    - The encrypted presence packet is built once and only rebuilt when the peer's ip, port or codecs change.
+      Every peer broadcasts the same bytes each interval, so datagrams already handled are recognized
+      by their bytes without decrypting and parsing them again
+    - Presence is broadcast every PRESENCE_BROADCAST_INTERVAL seconds after joining, the interval grows by
+      PRESENCE_BACKOFF per broadcast up to PRESENCE_MAX_INTERVAL once the group is stable.
+      Finding a new peer re-announces right away and starts over with the short interval,
+      so the new peer learns about everyone without waiting for their long intervals
+    - Peers nothing was received from (presence or any message) for PEER_EXPIRY_TIMEOUT seconds are removed
+      from the peer, which disconnects them and tells the leader service
+    - Multicast mode only reaches the hosts that joined the group, within MULTICAST_TTL router hops.
+      The interface (name or address, default: the one holding the peer's ip) is found with psutil.
+      Loopback works if it has multicast enabled (ip link set lo multicast on):
+      DiscoveryService(peer, mode="multicast", interface="lo") with Peer(ip="127.0.0.1")
 '''
 
+BROADCAST = "broadcast"
+MULTICAST = "multicast"
+
+KNOWN_PACKETS_LIMIT = 1024  # Presence packets remembered, the cache is cleared when it grows beyond
+
+def xor_cipher(data: bytes, key: bytes) -> bytes:
+    """
+    XOR data with the key repeated over its length, encrypting and decrypting alike.
+    """
+    length = len(data)
+    key_stream = key * (length // len(key) + 1)
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(key_stream[:length], 'big')).to_bytes(length, 'big')
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, discovery_service: 'DiscoveryService'):
+        self.discovery_service = discovery_service
+
+    def datagram_received(self, data: bytes, addr):
+        self.discovery_service.handle_datagram(data)
+
 class DiscoveryService:
-    def __init__(self, peer: 'Peer'):
+    def __init__(self, peer: 'Peer', mode: str = DISCOVERY_MODE, group: str = MULTICAST_GROUP,
+                 ttl: int = MULTICAST_TTL, interface: str = MULTICAST_INTERFACE):
         """
         Initialize the DiscoveryService with XOR encryption.
+        Use functools.partial(DiscoveryService, mode="multicast", ...) as Peer(discovery=...) to override the defaults.
 
         :param peer: Instance of the Peer class.
+        :param mode: "broadcast" or "multicast".
+        :param group: Multicast group address.
+        :param ttl: Router hops multicast presence travels.
+        :param interface: Name or IPv4 address of the multicast interface, None for the one holding the peer's ip.
         """
         if not isinstance(KEY, bytes) or len(KEY) != 4:
             raise ValueError("Key must be a 4-byte (32-bit) bytes object.")
+        if mode not in (BROADCAST, MULTICAST):
+            raise ValueError(f"Unknown discovery mode: {mode}. Expected '{BROADCAST}' or '{MULTICAST}'.")
         
         self.peer = peer
+        self.mode = mode
+        self.group = group
+        self.ttl = ttl
+        self.interface = interface
+        self.presence_packet = None  # Encrypted presence message of this peer
+        self.presence_fields = None  # (ip, port, codecs) the presence packet was built from
+        self.known_packets = {}  # Encrypted presence packet -> sender id, for packets already handled
+        self.broadcast_lock = threading.Lock()
+        self.broadcast_interval = PRESENCE_BROADCAST_INTERVAL  # Wait after the next broadcast
+        self.broadcast_generation = 0  # Incremented when the next broadcast is rescheduled
+        self.last_broadcast = 0.0
         self.setup_udp_discovery()
         self.start_discovery()
 
@@ -41,12 +98,11 @@ class DiscoveryService:
         :param data: Data to encrypt/decrypt.
         :return: Encrypted/decrypted data.
         """
-        return bytes([b ^ KEY[i % len(KEY)] for i, b in enumerate(data)])
+        return xor_cipher(data, KEY)
 
     def setup_udp_discovery(self):
         # Setup UDP socket for broadcasting
         self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         self.udp_socket.settimeout(0.2)  # Non-blocking with timeout
 
         # Setup UDP socket for listening
@@ -55,85 +111,260 @@ class DiscoveryService:
         self.udp_listener.bind(('', UDP_BROADCAST_PORT))
         self.udp_listener.settimeout(0.2)  # Non-blocking with timeout
 
+        if self.mode == MULTICAST:
+            self.setup_multicast()
+        else:
+            self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            self.destination = (get_broadcast_address(self.peer.ip), UDP_BROADCAST_PORT)
+
+    def setup_multicast(self):
+        interface = get_interface(self.interface, self.peer.ip)
+        if interface is None:
+            raise ValueError(f"No IPv4 interface {self.interface or self.peer.ip} for multicast discovery.")
+        interface_address = socket.inet_aton(interface[1])
+
+        # Send through the interface, to peers on this host too
+        self.udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface_address)
+        self.udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, struct.pack('b', self.ttl))
+        self.udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+
+        # Join the group on the interface
+        membership = struct.pack('4s4s', socket.inet_aton(self.group), interface_address)
+        self.udp_listener.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self.destination = (self.group, UDP_BROADCAST_PORT)
+        print(f"DiscoveryService: Node {self.peer.id} joined multicast group {self.group} on {interface[0]}.")
+
     def listen_udp(self):
         while not self.discovery_stop_event.is_set():
             try:
                 encrypted_data, addr = self.udp_listener.recvfrom(4096)  # Increased buffer size if needed
-                decrypted_data = self._xor_cipher(encrypted_data)
-                message_str = decrypted_data.decode('utf-8')
-                message = Message.from_json(message_str)
-                
-                if message is None:
-                    continue  # Skip processing if message couldn't be decoded
-
-                msg_type = message.type
-                if msg_type == "presence":
-                    sender_id = message.id
-                    sender_ip = message.data.get("ip")
-                    sender_port = message.data.get("port")
-                    if sender_id and sender_ip and sender_port:
-                        if sender_id != str(self.peer.id):
-                            self.peer.add_peer(sender_ip, sender_port, sender_id)
-                            print(f"DiscoveryService: Found peer {sender_id} at {sender_ip}:{sender_port}")
+                self.handle_datagram(encrypted_data)
             except socket.timeout:
                 continue
-            except UnicodeDecodeError:
-                print("Failed to decode decrypted UDP message. Possible wrong key.")
-            except json.JSONDecodeError:
-                print("Received invalid JSON message over UDP.")
             except Exception as e:
                 print(f"Error in UDP listener: {e}")
 
-    def broadcast_presence(self, interval=1):
-        while not self.discovery_stop_event.is_set():
-            # Create a Message instance for presence
+    def handle_datagram(self, encrypted_data: bytes):
+        # Our own broadcast and presence packets of known peers are skipped without decrypting
+        if encrypted_data == self.presence_packet:
+            return
+        sender_id = self.known_packets.get(encrypted_data)
+        if sender_id is not None and self.peer.mark_seen(sender_id):
+            return
+        try:
+            decrypted_data = self._xor_cipher(encrypted_data)
+            message_str = decrypted_data.decode('utf-8')
+            message = Message.from_json(message_str)
+
+            if message is None:
+                return  # Skip processing if message couldn't be decoded
+
+            msg_type = message.type
+            if msg_type == "presence":
+                sender_id = message.id
+                sender_ip = message.data.get("ip")
+                sender_port = message.data.get("port")
+                sender_codecs = message.data.get("codecs")
+                # The ID becomes a PeerTable key, uuid_to_number raises a TypeError for IDs that aren't str
+                if isinstance(sender_id, str) and sender_id and sender_ip and sender_port:
+                    if sender_id != str(self.peer.id):
+                        known = self.peer.get_peer_by_id(sender_id) is not None
+                        self.peer.add_peer(sender_ip, sender_port, sender_id, sender_codecs)
+                        print(f"DiscoveryService: Found peer {sender_id} at {sender_ip}:{sender_port}")
+                        self.remember_packet(encrypted_data, sender_id)
+                        if not known and self.peer.get_peer_by_id(sender_id) is not None:
+                            self.announce()
+        except UnicodeDecodeError:
+            print("Failed to decode decrypted UDP message. Possible wrong key.")
+        except json.JSONDecodeError:
+            print("Received invalid JSON message over UDP.")
+        except Exception as e:
+            print(f"Error in UDP listener: {e}")
+
+    def schedule_broadcast(self, delay: float):
+        # Called with broadcast_lock held, a broadcast already scheduled is superseded
+        self.broadcast_generation += 1
+        if self.broadcast_timer is not None:
+            self.broadcast_timer.cancel()
+        self.broadcast_timer = self.peer.runtime.call_later(delay, self.broadcast_presence, self.broadcast_generation)
+
+    def broadcast_presence(self, generation: int):
+        """
+        Broadcast presence and schedule the next broadcast, backing off towards PRESENCE_MAX_INTERVAL.
+        """
+        with self.broadcast_lock:
+            if self.discovery_stop_event.is_set() or generation != self.broadcast_generation:
+                return
+            self.broadcast_presence_once()
+            self.last_broadcast = time.time()
+            self.schedule_broadcast(self.broadcast_interval)
+            self.broadcast_interval = min(self.broadcast_interval * PRESENCE_BACKOFF, PRESENCE_MAX_INTERVAL)
+
+    def announce(self):
+        """
+        Broadcast presence right away and return to the short interval, called when a new peer appears.
+        Broadcasts stay at least PRESENCE_BROADCAST_INTERVAL apart when several peers appear at once.
+        """
+        with self.broadcast_lock:
+            if self.discovery_stop_event.is_set():
+                return
+            self.broadcast_interval = PRESENCE_BROADCAST_INTERVAL
+            self.schedule_broadcast(max(0.0, self.last_broadcast + PRESENCE_BROADCAST_INTERVAL - time.time()))
+
+    def expire_peers(self):
+        """
+        Remove the peers that went silent for PEER_EXPIRY_TIMEOUT seconds, called every PEER_EXPIRY_CHECK seconds.
+        A removed peer is added again by its next presence broadcast.
+        """
+        for peer_id in self.peer.expired_peers(PEER_EXPIRY_TIMEOUT):
+            print(f"DiscoveryService: Peer {peer_id} expired after {PEER_EXPIRY_TIMEOUT}s without messages")
+            self.peer.remove_peer(peer_id)
+
+    def remember_packet(self, encrypted_data: bytes, sender_id: str):
+        if len(self.known_packets) >= KNOWN_PACKETS_LIMIT:
+            self.known_packets.clear()  # Peers that left keep their packets here otherwise
+        self.known_packets[encrypted_data] = sender_id
+
+    def get_presence_packet(self) -> bytes:
+        """
+        Return the encrypted presence message, rebuilt only if the peer's ip, port or codecs changed.
+        """
+        presence_fields = (self.peer.ip, self.peer.bind_port, tuple(self.peer.supported_codecs))
+        if presence_fields != self.presence_fields:
             presence_message = Message(
                 id=str(self.peer.id),
                 type="presence",
                 data={
                     "ip": self.peer.ip,
-                    "port": self.peer.bind_port
+                    "port": self.peer.bind_port,
+                    "codecs": self.peer.supported_codecs
                 }
             )
-            serialized_message = presence_message.to_json()
-            message_bytes = serialized_message.encode('utf-8')
-            encrypted_message = self._xor_cipher(message_bytes)
-            # Broadcast over UDP
-            try:
-                self.udp_socket.sendto(encrypted_message, (UDP_BROADCAST_IP, UDP_BROADCAST_PORT))
-                print(f"DiscoveryService: Node {self.peer.id} broadcasted encrypted presence via UDP.")
-            except Exception as e:
-                print(f"Error broadcasting presence: {e}")
-            time.sleep(interval)
+            self.presence_packet = self._xor_cipher(presence_message.to_json().encode('utf-8'))
+            self.presence_fields = presence_fields
+        return self.presence_packet
+
+    def broadcast_presence_once(self):
+        # Broadcast over UDP
+        try:
+            self.udp_socket.sendto(self.get_presence_packet(), self.destination)
+            print(f"DiscoveryService: Node {self.peer.id} broadcasted encrypted presence via UDP.")
+        except Exception as e:
+            print(f"Error broadcasting presence: {e}")
 
     def stop_discovery(self):
         # Stop UDP listener thread
         self.discovery_stop_event.set()
+
+        # Stop the broadcast and expiry timers and the asyncio endpoint
+        with self.broadcast_lock:
+            if self.broadcast_timer is not None:
+                self.broadcast_timer.cancel()
+        self.expiry_timer.cancel()
+        if self.listener_transport is not None:
+            self.peer.runtime.call_soon(self.listener_transport.close)
         if hasattr(self, 'udp_listener_thread') and self.udp_listener_thread.is_alive():
             self.udp_listener_thread.join()
             print(f"DiscoveryService: Node {self.peer.id} UDP listener thread stopped.")
 
-        # Stop UDP broadcast thread
-        if hasattr(self, 'discovery_thread') and self.discovery_thread.is_alive():
-            self.discovery_thread.join()
-            print(f"DiscoveryService: Node {self.peer.id} UDP broadcast thread stopped.")
-
     def start_discovery(self):
         # Initialize the stop event
         self.discovery_stop_event = threading.Event()
+        self.broadcast_timer = None
+        self.listener_transport = None
+
+        if self.peer.runtime.is_async:
+            self.start_discovery_async()
+        else:
+            # Start UDP listener thread
+            self.udp_listener_thread = threading.Thread(target=self.listen_udp, daemon=True)
+            self.udp_listener_thread.start()
+            print(f"DiscoveryService: Node {self.peer.id} UDP listener thread started.")
+
+        # Broadcasting and expiry are timers of the peer's runtime
+        with self.broadcast_lock:
+            self.schedule_broadcast(0)
+        self.expiry_timer = self.peer.runtime.call_every(PEER_EXPIRY_CHECK, self.expire_peers)
+        print(f"DiscoveryService: Node {self.peer.id} UDP broadcast timer started.")
+
+    def start_discovery_async(self):
+        runtime = self.peer.runtime
+        self.udp_listener.setblocking(False)
+        self.udp_socket.setblocking(False)
 
-        # Start UDP listener thread
-        self.udp_listener_thread = threading.Thread(target=self.listen_udp, daemon=True)
-        self.udp_listener_thread.start()
-        print(f"DiscoveryService: Node {self.peer.id} UDP listener thread started.")
+        async def create_endpoint():
+            transport, _ = await runtime.loop.create_datagram_endpoint(
+                lambda: DiscoveryProtocol(self), sock=self.udp_listener)
+            return transport
 
-        # Start UDP broadcast thread
-        self.discovery_thread = threading.Thread(target=self.broadcast_presence, args=(PRESENCE_BROADCAST_INTERVAL,), daemon=True)
-        self.discovery_thread.start()
-        print(f"DiscoveryService: Node {self.peer.id} UDP broadcast thread started.")
+        self.listener_transport = runtime.run_coroutine(create_endpoint()).result()
+        print(f"DiscoveryService: Node {self.peer.id} UDP listener endpoint started.")
 
     def kill(self):
         self.stop_discovery()
         self.udp_socket.close()
         self.udp_listener.close()
         print(f"DiscoveryService: Node {self.peer.id} discovery service stopped.")
+
+'''
+In-Memory Discovery
+    - Replaces UDP broadcasting for peers that run in the same process, e.g. in Simulation/harness.py
+    - Peers register with a shared InMemoryRegistry and are connected to every other registered peer
+    - The registry can be pre-filled with a roster of peers running in other processes
+    - A peer that stops is removed from the other peers in process right away, peers don't expire otherwise
+'''
+
+class InMemoryRegistry:
+    def __init__(self, roster: list = None):
+        """
+        Initialize the InMemoryRegistry.
+
+        :param roster: Optional list of (peer_id, ip, port, codecs) tuples of peers outside this process.
+        """
+        self.lock = threading.Lock()
+        self.entries = {str(peer_id): (ip, port, codecs) for peer_id, ip, port, codecs in (roster or [])}
+        self.services = []
+
+    def register(self, service: 'InMemoryDiscovery'):
+        peer = service.peer
+        entry = (peer.ip, peer.bind_port, peer.supported_codecs)
+        with self.lock:
+            self.entries[str(peer.id)] = entry
+            others = [s for s in self.services if s.peer is not peer]
+            self.services.append(service)
+            known_entries = list(self.entries.items())
+
+        # Connect the new peer to everyone known, and everyone in process to the new peer
+        for peer_id, (ip, port, codecs) in known_entries:
+            if peer_id != str(peer.id):
+                peer.add_peer(ip, port, peer_id, codecs)
+        for other in others:
+            other.peer.add_peer(entry[0], entry[1], str(peer.id), entry[2])
+
+    def unregister(self, service: 'InMemoryDiscovery'):
+        peer_id = str(service.peer.id)
+        with self.lock:
+            if service in self.services:
+                self.services.remove(service)
+            self.entries.pop(peer_id, None)
+            others = list(self.services)
+        for other in others:
+            other.peer.remove_peer(peer_id)
+
+class InMemoryDiscovery:
+    def __init__(self, peer: 'Peer', registry: InMemoryRegistry):
+        """
+        Initialize the InMemoryDiscovery, use functools.partial(InMemoryDiscovery, registry=...) as Peer(discovery=...).
+
+        :param peer: Instance of the Peer class.
+        :param registry: Registry shared by the peers that should find each other.
+        """
+        self.peer = peer
+        self.registry = registry
+        self.registry.register(self)
+
+    def stop_discovery(self):
+        self.registry.unregister(self)
+
+    def kill(self):
+        self.stop_discovery()
@@ -0,0 +1,203 @@
+import threading
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from Middleware.message import Message
+from properties import HANDLER_POOL_SIZE
+
+'''
+Message Dispatcher
+    - Routes received messages to the handler registered for their type with a single dict lookup
+    - Each handler runs on the executor it was registered with:
+        - inline: on the receiving thread, for cheap handlers
+        - queue: on a dedicated thread per named queue, handlers sharing a queue keep their relative order.
+          With the asyncio runtime, each queue is a single worker executor the event loop hands the handlers to,
+          so a slow queued handler never holds up the loop receiving for every peer of the process
+        - pool: on a shared thread pool, without ordering guarantees
+    - Messages without a registered handler go to a fallback callback
+    - After shutdown, messages still dispatched (e.g. by a receiver finishing its last message) are dropped
+    - Keeps latency counters per handler, from dispatch until the handler returns
+'''
+
+INLINE = "inline"
+QUEUE = "queue"
+POOL = "pool"
+
+STOP = None  # Put on a handler queue to end its thread
+
+class HandlerStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.total_run_time = 0.0
+
+    def record(self, latency: float, run_time: float, failed: bool):
+        with self.lock:
+            self.count += 1
+            self.errors += failed
+            self.total_latency += latency
+            self.total_run_time += run_time
+            if latency > self.max_latency:
+                self.max_latency = latency
+
+    def collect(self) -> dict:
+        """
+        Return the counters of the current interval (latencies in milliseconds) and start a new one.
+        """
+        with self.lock:
+            count = self.count
+            stats = {
+                "count": count,
+                "errors": self.errors,
+                "mean_latency_ms": self.total_latency / count * 1000 if count else 0.0,
+                "max_latency_ms": self.max_latency * 1000,
+                "mean_run_time_ms": self.total_run_time / count * 1000 if count else 0.0
+            }
+            self.reset()
+            return stats
+
+class Handler:
+    def __init__(self, function: callable, executor: str, queue_name: str):
+        self.function = function
+        self.executor = executor
+        self.queue_name = queue_name
+        self.stats = HandlerStats()
+
+    def run(self, message: Message, dispatched_at: float):
+        start = time.perf_counter()
+        failed = False
+        try:
+            self.function(message)
+        except Exception as e:
+            failed = True
+            print(f"Error in handler for {message.type} messages: {e}")
+        end = time.perf_counter()
+        self.stats.record(end - dispatched_at, end - start, failed)
+
+class MessageDispatcher:
+    def __init__(self, fallback: callable = None, pool_size: int = HANDLER_POOL_SIZE, runtime=None):
+        """
+        Initialize the MessageDispatcher.
+
+        :param fallback: Called with messages that have no registered handler.
+        :param pool_size: Number of threads of the shared pool executor, created on first use.
+        :param runtime: Runtime of the Peer, queued handlers are handed to executors by its event loop if it is
+                        asynchronous.
+        """
+        self.fallback = fallback
+        self.runtime = runtime
+        self.pool_size = pool_size
+        self.handlers = {}  # message type -> Handler
+        self.queues = {}    # queue name -> queue.Queue of (Handler, Message, dispatch time)
+        self.queue_threads = []
+        self.queue_executors = {}  # queue name -> single worker ThreadPoolExecutor, with the asyncio runtime
+        self.pool = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def register(self, msg_type: str, function: callable, executor: str = INLINE, queue_name: str = None):
+        """
+        Register the handler for a message type, replacing any previous one.
+
+        :param msg_type: Message type to handle.
+        :param function: Called with the Message.
+        :param executor: INLINE, QUEUE or POOL.
+        :param queue_name: Queue to use with the QUEUE executor, defaults to the message type.
+        """
+        if executor not in (INLINE, QUEUE, POOL):
+            raise ValueError(f"Unknown executor: {executor}")
+
+        queue_name = queue_name or msg_type
+        with self.lock:
+            if executor == QUEUE and self.uses_event_loop() and queue_name not in self.queue_executors:
+                self.queue_executors[queue_name] = ThreadPoolExecutor(max_workers=1,
+                                                                      thread_name_prefix=f"queue-{queue_name}")
+            elif executor == QUEUE and not self.uses_event_loop() and queue_name not in self.queues:
+                handler_queue = queue.Queue()
+                self.queues[queue_name] = handler_queue
+                queue_thread = threading.Thread(target=self.run_queue, args=(handler_queue,), daemon=True)
+                queue_thread.start()
+                self.queue_threads.append(queue_thread)
+            if executor == POOL and self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="handler")
+            self.handlers[msg_type] = Handler(function, executor, queue_name)
+
+    def unregister(self, msg_type: str):
+        with self.lock:
+            self.handlers.pop(msg_type, None)
+
+    def dispatch(self, message: Message):
+        if self.closed:
+            return
+        handler = self.handlers.get(message.type)
+        if handler is None:
+            if self.fallback:
+                self.fallback(message)
+            return
+
+        dispatched_at = time.perf_counter()
+        if handler.executor == INLINE:
+            handler.run(message, dispatched_at)
+        elif handler.executor == QUEUE and not self.uses_event_loop():
+            self.queues[handler.queue_name].put((handler, message, dispatched_at))
+        else:
+            try:
+                if handler.executor == QUEUE:
+                    self.run_in_queue_executor(handler, message, dispatched_at)
+                else:
+                    self.pool.submit(handler.run, message, dispatched_at)
+            except RuntimeError:
+                # The executor was shut down between the closed check and the submit
+                if not self.closed:
+                    raise
+
+    def uses_event_loop(self) -> bool:
+        return self.runtime is not None and self.runtime.is_async
+
+    def run_in_queue_executor(self, handler: Handler, message: Message, dispatched_at: float):
+        queue_executor = self.queue_executors[handler.queue_name]
+        if self.runtime.in_runtime_thread():
+            self.runtime.loop.run_in_executor(queue_executor, handler.run, message, dispatched_at)
+        else:
+            queue_executor.submit(handler.run, message, dispatched_at)
+
+    def run_queue(self, handler_queue: queue.Queue):
+        while True:
+            item = handler_queue.get()
+            if item is STOP:
+                return
+            handler, message, dispatched_at = item
+            handler.run(message, dispatched_at)
+
+    def collect_stats(self) -> dict:
+        """
+        Return the latency counters of every handler for the current interval, keyed by message type.
+        """
+        with self.lock:
+            handlers = list(self.handlers.items())
+        return {msg_type: handler.stats.collect() for msg_type, handler in handlers}
+
+    def shutdown(self):
+        """
+        Stop the queue threads and executors once they have run the handlers already queued, and the pool.
+        """
+        with self.lock:
+            self.closed = True
+            queues = list(self.queues.values())
+            queue_threads, self.queue_threads = self.queue_threads, []
+            queue_executors = list(self.queue_executors.values())
+        for handler_queue in queues:
+            handler_queue.put(STOP)
+        for queue_thread in queue_threads:
+            if queue_thread is not threading.current_thread():  # Shut down from one of its own handlers
+                queue_thread.join()
+        for queue_executor in queue_executors:
+            queue_executor.shutdown(wait=False)  # Its thread ends after the handlers already queued
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
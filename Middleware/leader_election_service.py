@@ -1,14 +1,9 @@
 import threading
 import time
-import queue
 from Middleware.peer import Peer
-import threading
-import time
-import queue
-from properties import ELECTION_TIMEOUT, ELECTION_TIMEOUT_CHECK, HEARTBEAT_INTERVAL
+from properties import ELECTION_TIMEOUT, ELECTION_ANSWER_TIMEOUT, COORDINATOR_TIMEOUT, HEARTBEAT_INTERVAL
 from Middleware.utils import uuid_to_number
 from Middleware.message import Message
-import uuid
 
 '''
 Bully Algorithm Leader Selection Service
@@ -16,6 +11,20 @@ Bully Algorithm Leader Selection Service
     - Handles leader election messages (ELECTION, ANSWER, COORDINATOR)
     - Monitors leader heartbeats and initiates new elections if needed
     - Sends heartbeats if the node is the leader
+    - Event driven: every heartbeat moves the leader deadline, a single timer fires at the deadline instead of
+      polling, and every election step (waiting for ANSWER, then for COORDINATOR) is one timer of the
+      peer's runtime. Timers of an election that was superseded are ignored
+    - The peers above this one are found with a bisect over the peer table, sorted by UUID integer
+    - At most one heartbeat timer runs, it is stopped as soon as this node follows another leader
+    - A COORDINATOR or heartbeat is only followed if it comes from a known peer at least as high as the current
+      leader, late messages of an expired leader are ignored. A lower peer claiming leadership is answered
+      with a COORDINATOR by the leader, so it steps down, and ignored by higher peers running an election.
+      A peer that joins follows the leader it finds, even if it is lower
+    - Reports leader changes to the peer's topology service, which moves the star relay to the new leader
+    - ELECTION, ANSWER and COORDINATOR messages go over the peer's reliable control channel,
+      so a peer whose subscription isn't connected yet still gets them
+    - The peer reports peers that expired; if the leader is gone an election starts right away
+      instead of waiting for the heartbeat timeout
 '''
 
 class LeaderSelectionService:
@@ -26,35 +35,74 @@ class LeaderSelectionService:
         :param peer: Instance of the Peer class.
         """
         self.peer = peer
+        self.number = uuid_to_number(self.peer.id)  # Compared with PeerEntry.number of the other peers
+        self.lock = threading.RLock()
+        self.stopped = False
         self.election_in_progress = False
+        self.answered = False  # A higher peer answered the running election
+        self.election_generation = 0  # Incremented when an election starts or ends, older timeouts are ignored
+        self.election_timer = None
+        self.heartbeat_timer = None  # Timer sending heartbeats while this node is the leader
         self.heartbeat_last_received = time.time()
-        self.lock = threading.RLock()  # Changed from threading.Lock to threading.RLock
+        self.leader_deadline = self.heartbeat_last_received + ELECTION_TIMEOUT
 
-        # Initialize the message queue to handle Message instances
-        self.receive_leader_message_queue = queue.Queue()
+        # Fires at the leader deadline, which heartbeats keep moving
+        self.monitor_timer = self.peer.runtime.call_later(ELECTION_TIMEOUT, self.monitor_heartbeat)
 
-        # Start heartbeat monitoring thread
-        self.heartbeat_thread = threading.Thread(target=self.monitor_heartbeat, daemon=True)
-        self.heartbeat_thread.start()
-
-        # Start handling leader election messages
-        self.leader_thread = threading.Thread(target=self.handle_leader_messages, daemon=True)
-        self.leader_thread.start()
+        # Handle leader election messages in order on their own queue, so slow game handlers can't delay them
+        self.peer.register_handler("election", self.handle_election_message, executor="queue", queue_name="leader")
+        self.peer.register_handler("answer", self.handle_answer_message, executor="queue", queue_name="leader")
+        self.peer.register_handler("coordinator", self.handle_coordinator_message, executor="queue", queue_name="leader")
+        self.peer.register_handler("heartbeat", self.handle_heartbeat_message, executor="queue", queue_name="leader")
 
     def monitor_heartbeat(self):
         """
-        Monitor the heartbeat from the leader. If heartbeats are not received within the timeout,
-        initiate a new election.
+        Called at the leader deadline. If no heartbeat moved it in the meantime, initiate a new election.
+        """
+        with self.lock:
+            if self.stopped:
+                return
+            now = time.time()
+            if self.peer.is_leader or now < self.leader_deadline:
+                wait = ELECTION_TIMEOUT if self.peer.is_leader else self.leader_deadline - now
+                self.monitor_timer = self.peer.runtime.call_later(wait, self.monitor_heartbeat)
+                return
+            print(f"Node: {str(self.peer.id)[:10]} detected leader timeout. Initiating election.")
+            self.peer.leader_id = None
+            self.leader_deadline = now + ELECTION_TIMEOUT
+            self.monitor_timer = self.peer.runtime.call_later(ELECTION_TIMEOUT, self.monitor_heartbeat)
+        self.initiate_election()
+
+    def leader_number(self):
+        """
+        UUID integer of the current leader, None if there is none.
         """
-        while True:
-            time.sleep(ELECTION_TIMEOUT_CHECK)
-            with self.lock:
-                if self.peer.is_leader:
-                    continue  # Leader doesn't need to monitor heartbeats
-                elapsed = time.time() - self.heartbeat_last_received
-                if elapsed > ELECTION_TIMEOUT:
-                    print(f"Node: {str(self.peer.id)[:10]} detected leader timeout. Initiating election.")
-                    self.initiate_election()
+        leader_id = self.peer.leader_id
+        if leader_id is None:
+            return None
+        if self.peer.is_leader:
+            return self.number
+        entry = self.peer.get_peer_by_id(leader_id)
+        return entry.number if entry is not None else uuid_to_number(leader_id)
+
+    def outranked_by_leader(self, sender_id: str) -> bool:
+        """
+        True if the sender of a COORDINATOR or heartbeat shouldn't be followed: it is unknown, e.g. it already
+        expired and this is a late message, it is lower than the current leader, or lower than this peer while
+        this peer runs an election, which it will win. Called with the lock held.
+        """
+        entry = self.peer.get_peer_by_id(sender_id)
+        if entry is None:
+            print(f"Node: {str(self.peer.id)[:10]} ignores leader claim of unknown peer {sender_id}.")
+            return True
+        current = self.leader_number()
+        if current is None:
+            return self.election_in_progress and entry.number < self.number
+        if entry.number >= current:
+            return False
+        if self.peer.is_leader:
+            self.send_coordinator(sender_id)  # A lower peer thinks it leads, make it step down
+        return True
 
     def initiate_election(self):
         """
@@ -62,20 +110,22 @@ class LeaderSelectionService:
         to all peers with higher IDs.
         """
         with self.lock:
+            if self.stopped:
+                return
             if self.election_in_progress:
                 print(f"Node: {str(self.peer.id)[:10]} election already in progress. Aborting new initiation.")
                 return  # Avoid multiple simultaneous elections
-            self.election_in_progress = True
+            higher_peers = self.peer.peers.higher_than(self.number)
+            if higher_peers:
+                self.election_in_progress = True
+                self.answered = False
+                self.election_generation += 1
+                self.election_timer = self.peer.runtime.call_later(
+                    ELECTION_ANSWER_TIMEOUT, self.handle_answer_timeout, self.election_generation)
 
-        higher_peers = [
-            peer for peer in self.peer.peers
-            if uuid_to_number(uuid.UUID(peer[1])) > uuid_to_number(self.peer.id)
-        ]
         if not higher_peers:
             # No higher peers, declare self as leader
             self.declare_leader()
-            with self.lock:
-                self.election_in_progress = False
             return
 
         # Send ELECTION message to all higher peers
@@ -84,91 +134,129 @@ class LeaderSelectionService:
             type="election",
             data={}
         )
-        for peer_info in higher_peers:
-            self.peer.send_private_message(peer_info[1], election_message)
+        for entry in higher_peers:
+            self.peer.control.send(entry.id, election_message)
+
+    def handle_answer_timeout(self, generation: int):
+        """
+        Called ELECTION_ANSWER_TIMEOUT seconds after sending ELECTION messages.
+        Without an ANSWER no higher peer is alive, otherwise wait for the COORDINATOR of one of them.
+        """
+        with self.lock:
+            if generation != self.election_generation or not self.election_in_progress:
+                return
+            if self.answered:
+                self.election_timer = self.peer.runtime.call_later(
+                    COORDINATOR_TIMEOUT, self.handle_coordinator_timeout, generation)
+                return
+        self.declare_leader()
 
-        # Wait for ANSWER messages
-        def wait_for_responses():
-            time.sleep(ELECTION_TIMEOUT_CHECK)
-            with self.lock:
-                if self.peer.leader_id is None: 
-                    self.declare_leader()
-                self.election_in_progress = False
+    def handle_coordinator_timeout(self, generation: int):
+        """
+        Called COORDINATOR_TIMEOUT seconds after an ANSWER without a COORDINATOR following, start over.
+        """
+        with self.lock:
+            if generation != self.election_generation or not self.election_in_progress:
+                return
+            print(f"Node: {str(self.peer.id)[:10]} got no COORDINATOR after an ANSWER. Restarting election.")
+            self.election_in_progress = False
+        self.initiate_election()
 
-        wait_thread = threading.Thread(target=wait_for_responses, daemon=True)
-        wait_thread.start()
+    def end_election(self):
+        # Called with the lock held, pending election timeouts are void
+        self.election_in_progress = False
+        self.election_generation += 1
+        if self.election_timer is not None:
+            self.election_timer.cancel()
+            self.election_timer = None
 
     def declare_leader(self):
         """
         Declare self as the leader and notify all peers by sending COORDINATOR messages.
         Also starts sending heartbeats.
         """
-        self.peer.is_leader = True
-        self.peer.leader_id = self.peer.id
+        with self.lock:
+            if self.stopped:
+                return
+            self.end_election()
+            self.peer.is_leader = True
+            self.peer.leader_id = str(self.peer.id)
         print(f"Node: {str(self.peer.id)[:10]} is declaring itself as the leader.")
+        self.peer.topology.on_leader_changed(str(self.peer.id))
+        # Broadcast COORDINATOR message to all peers
+        for entry in self.peer.get_peers():
+            self.send_coordinator(entry.id)
+        # Start sending heartbeats
+        self.start_heartbeats()
+
+    def send_coordinator(self, peer_id: str):
         coordinator_message = Message(
             id=str(self.peer.id),
             type="coordinator",
             data={}
         )
-        # Broadcast COORDINATOR message to all peers
-        for peer_info in self.peer.peers:
-            self.peer.send_private_message(peer_info[1], coordinator_message)
-        # Start sending heartbeats
-        heartbeat_thread = threading.Thread(target=self.send_heartbeats, daemon=True)
-        heartbeat_thread.start()
-
-    def send_heartbeats(self):
-        """
-        If the node is the leader, periodically send heartbeat messages to all peers.
-        """
-        while self.peer.is_leader:
-            heartbeat_message = Message(
-                id=str(self.peer.id),
-                type="heartbeat",
-                data={}
-            )
-            self.peer.send_public_message(heartbeat_message)
-            print(f"Node: {str(self.peer.id)[:10]} sending heartbeat.")
-            time.sleep(HEARTBEAT_INTERVAL)
-
-    def handle_leader_messages(self):
-        """
-        Continuously process incoming leader election messages from the queue.
-        """
-        while True:
-            try:
-                message: Message = self.receive_leader_message_queue.get(timeout=1)
-                msg_type = message.type
-                msg_id = message.id
-                if msg_type == "election":
-                    self.handle_election_message(message)
-                elif msg_type == "answer":
-                    self.handle_answer_message(message)
-                elif msg_type == "coordinator":
-                    self.handle_coordinator_message(message)
-                elif msg_type == "heartbeat":
-                    self.handle_heartbeat_message(message)
-            except queue.Empty:
-                continue
+        self.peer.control.send(peer_id, coordinator_message)
+
+    def follow_leader(self, leader_id: str):
+        """
+        Follow another peer as the leader, stopping our heartbeats and any running election.
+        """
+        with self.lock:
+            self.end_election()
+            self.peer.leader_id = leader_id
+            self.peer.is_leader = False
+            self.stop_heartbeats()
+            self.heartbeat_last_received = time.time()
+            self.leader_deadline = self.heartbeat_last_received + ELECTION_TIMEOUT
+        self.peer.topology.on_leader_changed(leader_id)
+
+    def start_heartbeats(self):
+        with self.lock:
+            if self.heartbeat_timer is not None or self.stopped:
+                return  # Already sending heartbeats
+            self.heartbeat_timer = self.peer.runtime.call_every(HEARTBEAT_INTERVAL, self.send_heartbeat)
+        self.send_heartbeat()
+
+    def stop_heartbeats(self):
+        with self.lock:
+            if self.heartbeat_timer is not None:
+                self.heartbeat_timer.cancel()
+                self.heartbeat_timer = None
+
+    def send_heartbeat(self):
+        """
+        If the node is the leader, send a heartbeat message to all peers, called every HEARTBEAT_INTERVAL seconds.
+        """
+        if not self.peer.is_leader:
+            self.stop_heartbeats()
+            return
+        heartbeat_message = Message(
+            id=str(self.peer.id),
+            type="heartbeat",
+            data={}
+        )
+        self.peer.send_public_message(heartbeat_message)
+        print(f"Node: {str(self.peer.id)[:10]} sending heartbeat.")
 
     def handle_election_message(self, message: Message):
         """
         Handle incoming ELECTION messages by sending an ANSWER and initiating own election.
-        
+        The leader answers with a COORDINATOR instead of starting an election.
+
         :param message: Message instance containing the ELECTION message.
         """
         sender_id = message.id
-        print(f"Node: {str(self.peer.id)[:10]}received ELECTION message from {sender_id}.")
+        print(f"Node: {str(self.peer.id)[:10]} received ELECTION message from {sender_id}.")
         # Send ANSWER message back
         answer_message = Message(
             id=str(self.peer.id),
             type="answer",
             data={}
         )
-        sender_peer = self.peer.get_peer_by_id(sender_id)
-        if sender_peer:
-            self.peer.send_private_message(sender_peer[1], answer_message)
+        self.peer.control.send(sender_id, answer_message)
+        if self.peer.is_leader:
+            self.send_coordinator(sender_id)
+            return
         # Initiate own election if not already in progress
         self.initiate_election()
 
@@ -182,7 +270,8 @@ class LeaderSelectionService:
         print(f"Node: {str(self.peer.id)[:10]} received ANSWER message from {sender_id}.")
         # A higher peer is alive, wait for coordinator message
         with self.lock:
-            self.peer.leader_id = sender_id  # Tentatively accept the higher peer as leader
+            if self.election_in_progress:
+                self.answered = True
 
     def handle_coordinator_message(self, message: Message):
         """
@@ -193,16 +282,10 @@ class LeaderSelectionService:
         sender_id = message.id
         print(f"Node: {str(self.peer.id)[:10]} received COORDINATOR message from {sender_id}.")
         with self.lock:
-            self.peer.leader_id = sender_id
-            self.peer.is_leader = (self.peer.id == uuid.UUID(sender_id))
-            if self.peer.is_leader:
-                print(f"Node: {str(self.peer.id)[:10]} is confirmed as the leader.")
-                # Start sending heartbeats if not already
-                heartbeat_thread = threading.Thread(target=self.send_heartbeats, daemon=True)
-                heartbeat_thread.start()
-            else:
-                print(f"Node: {str(self.peer.id)[:10]} recognizes {sender_id} as the leader.")
-        self.heartbeat_last_received = time.time()
+            if self.outranked_by_leader(sender_id):
+                return
+        self.follow_leader(sender_id)
+        print(f"Node: {str(self.peer.id)[:10]} recognizes {sender_id} as the leader.")
 
     def handle_heartbeat_message(self, message: Message):
         """
@@ -211,17 +294,44 @@ class LeaderSelectionService:
         :param message: Message instance containing the HEARTBEAT message.
         """
         sender_id = message.id
-        # Update the last heartbeat time
         with self.lock:
-            if self.peer.leader_id != sender_id:
-                self.peer.leader_id = sender_id
-                print(f"Node: {str(self.peer.id)[:10]} updated leader to {sender_id} based on heartbeat.")
-            self.heartbeat_last_received = time.time()
+            if self.peer.leader_id == sender_id:
+                # Moves the deadline, the monitor timer picks it up when it fires
+                self.heartbeat_last_received = time.time()
+                self.leader_deadline = self.heartbeat_last_received + ELECTION_TIMEOUT
+                known_leader = True
+            else:
+                known_leader = False
+        if known_leader:
+            # Retries switching the star topology if the leader wasn't discovered yet at its COORDINATOR
+            self.peer.topology.on_leader_changed(sender_id)
+            return
+        with self.lock:
+            if self.outranked_by_leader(sender_id):
+                return
+        self.follow_leader(sender_id)
+        print(f"Node: {str(self.peer.id)[:10]} updated leader to {sender_id} based on heartbeat.")
+
+    def on_peer_removed(self, peer_id: str):
+        """
+        Called by the peer when a peer expired. Start an election if it was the leader.
+
+        :param peer_id: ID of the removed peer.
+        """
+        with self.lock:
+            if self.peer.leader_id != peer_id:
+                return
+            print(f"Node: {str(self.peer.id)[:10]} lost leader {peer_id}. Initiating election.")
+            self.peer.leader_id = None
+        self.initiate_election()
 
     def shutdown(self):
         """
         Cleanly shut down the LeaderSelectionService.
         """
-        # No explicit shutdown logic required as threads are daemons
+        with self.lock:
+            self.stopped = True
+            self.monitor_timer.cancel()
+            self.end_election()
+            self.stop_heartbeats()
         print(f"LeaderSelectionService for Node: {str(self.peer.id)[:10]} is shutting down.")
-
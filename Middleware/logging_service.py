@@ -1,221 +1,485 @@
 from Middleware.peer import Peer
 import threading
-import queue
 import time
+from collections import deque
 from Middleware.message import Message
+from Middleware.clock_sync import SyncedClock
+from Middleware.metrics import ShardedCounter, ShardedHistogram, SequenceTracker, histogram_percentile, bucket_lower_bound, bucket_upper_bound
+from Middleware.metric_store import open_metric_ring, record_values, csv_line
 import psutil
 import statistics
+import random
 import os
-from properties import LOGS_DIR, LOG_RATE
-import requests
-from datetime import datetime, timedelta
+from properties import LOGS_DIR, LOG_RATE, LOG_INTERVALS, TRANSMISSION_SAMPLE_RATE, METRIC_RING_CAPACITY, METRIC_CSV_EXPORT
+from properties import SEQUENCE_WINDOW
+from datetime import datetime
+
+TIMESTAMP_FIELD = ("timestamp", "float", "{}")
+
+class LogAggregator:
+    """
+    Single thread writing the rows of all metrics. Every metric registers a snapshot function
+    returning its rows (tuples) for the elapsed interval and the fields of a row. Rows go to the binary
+    ring file logs/<name>.ring (see Middleware/metric_store.py) and, with METRIC_CSV_EXPORT,
+    to logs/<name>.log. Metrics due at the same time are snapshot with the same timestamp
+    and the CSV files are flushed once per wakeup.
+    """
+    def __init__(self):
+        self.metrics = {}  # name -> [interval, snapshot function, next due time, fields]
+        self.metric_rings = {}  # name -> MetricRing of logs/<name>.ring
+        self.metric_files = {}  # name -> file of logs/<name>.log, if exported as CSV
+        self.aggregator_stop = threading.Event()
+        self.aggregator_thread = None
+
+    def register_metric(self, name: str, snapshot: callable, fields: tuple):
+        """
+        :param name: Name of the metric, rows are written to logs/<name>.ring and logs/<name>.log.
+        :param snapshot: Called with the shared timestamp, returns the rows of the elapsed interval.
+        :param fields: (name, field type, CSV format) per value of a row, see Middleware/metric_store.py.
+        """
+        self.metrics[name] = [LOG_INTERVALS.get(name, LOG_RATE), snapshot, None, fields]
+
+    def metric_interval(self, name: str) -> float:
+        return self.metrics[name][0]
+
+    def start_aggregator(self):
+        start = time.time()
+        for name, metric in self.metrics.items():
+            metric[2] = start + metric[0]
+            self.metric_rings[name] = open_metric_ring(LOGS_DIR, name, metric[3], METRIC_RING_CAPACITY)
+            if METRIC_CSV_EXPORT:
+                self.metric_files[name] = open(f"{LOGS_DIR}/{name}.log", "a")  # Flushed once per wakeup
+        self.aggregator_thread = threading.Thread(target=self.run_aggregator, daemon=True)
+        self.aggregator_thread.start()
+
+    def run_aggregator(self):
+        while True:
+            next_due = min(metric[2] for metric in self.metrics.values())
+            if self.aggregator_stop.wait(max(0.0, next_due - time.time())):
+                break
+            self.aggregate(time.time())
+
+        # Write what was collected since the last rows, the last row covers a partial interval
+        self.aggregate(time.time(), due_only=False)
+        for ring in self.metric_rings.values():
+            ring.close()
+        for metric_file in self.metric_files.values():
+            metric_file.close()
+
+    def aggregate(self, timestamp: float, due_only: bool = True):
+        written_files = []
+        for name, metric in self.metrics.items():
+            if due_only and metric[2] > timestamp:
+                continue
+            # Advance on the fixed schedule, so metrics with the same interval keep sharing timestamps
+            while metric[2] <= timestamp:
+                metric[2] += metric[0]
+            try:
+                rows = metric[1](timestamp)
+            except Exception as e:
+                print(f"Error collecting {name} metrics: {e}")
+                continue
+            if not rows:
+                continue
+            fields = metric[3]
+            ring = self.metric_rings[name]
+            for row in rows:
+                ring.append(record_values(fields, row))
+            metric_file = self.metric_files.get(name)
+            if metric_file is not None:
+                metric_file.write("".join(csv_line(fields, row) for row in rows))
+                written_files.append(metric_file)
+        for metric_file in written_files:
+            metric_file.flush()
+
+    def stop_aggregator(self):
+        self.aggregator_stop.set()
+        if self.aggregator_thread is not None:
+            self.aggregator_thread.join(timeout=5)
 
 class LogTransmissionTimes:
+    PERCENTILES = (0.5, 0.9, 0.99, 0.999)
+    # Percentiles and max in ms
+    TRANSMISSION_HISTOGRAM_FIELDS = (TIMESTAMP_FIELD, ("type", "name", "{}"), ("count", "int", "{}"),
+                                     ("p50", "float", "{:.3f}"), ("p90", "float", "{:.3f}"),
+                                     ("p99", "float", "{:.3f}"), ("p999", "float", "{:.3f}"),
+                                     ("max", "float", "{:.3f}"))
+    # One row per non-empty bucket of a histogram row, with its timestamp and type. The lowest value
+    # of the bucket is in us, so histograms can be merged without knowing the bucket layout
+    TRANSMISSION_BUCKETS_FIELDS = (TIMESTAMP_FIELD, ("type", "name", "{}"), ("lower_bound", "int", "{}"),
+                                   ("count", "int", "{}"))
+    TRANSMISSION_TIMES_FIELDS = (("transmission_time", "float", "{}"),)
+
     def __init__(self):
-        self.transmission_times = queue.Queue()
-        self.transmission_lock = threading.Lock()
-        logging_thread = threading.Thread(target=self.log_transmission_times, daemon=True)
-        logging_thread.start()
-
-    def log_transmission_times(self):
-        with open(f"{LOGS_DIR}/transmission_times.log", "a", buffering=1) as f:
-            while True:
-                try:
-                    transmission_time = self.transmission_times.get(timeout=LOG_RATE)
-                    f.write(f"{transmission_time}\n")
-                except queue.Empty:
-                    continue
+        # Latencies in microseconds per message type, in log-bucketed histograms recorded without a lock
+        self.transmission_histograms = {}  # message type -> ShardedHistogram
+        self.transmission_histograms_lock = threading.Lock()  # Only taken the first time a type is seen
+        self.register_metric("transmission_histogram", self.snapshot_transmission_histogram,
+                             self.TRANSMISSION_HISTOGRAM_FIELDS)
+        self.transmission_bucket_rows = []  # Bucket rows of the histogram rows not written yet
+        self.register_metric("transmission_buckets", self.snapshot_transmission_buckets,
+                             self.TRANSMISSION_BUCKETS_FIELDS)
+
+        # Optional raw samples of a fraction of the messages, in the original one value per line format
+        self.transmission_sample_rate = TRANSMISSION_SAMPLE_RATE
+        self.transmission_times = deque()  # deque.append is atomic, receiving threads never wait
+        if self.transmission_sample_rate > 0:
+            self.register_metric("transmission_times", self.snapshot_transmission_times,
+                                 self.TRANSMISSION_TIMES_FIELDS)
+
+    def record_transmission_time(self, msg_type: str, transmission_time: float):
+        histogram = self.transmission_histograms.get(msg_type)
+        if histogram is None:
+            with self.transmission_histograms_lock:
+                histogram = self.transmission_histograms.setdefault(msg_type, ShardedHistogram())
+        histogram.record(max(0, int(transmission_time * 1e6)))
+        if self.transmission_sample_rate > 0 and random.random() < self.transmission_sample_rate:
+            self.transmission_times.append(transmission_time)
+
+    def snapshot_transmission_histogram(self, timestamp: float) -> list:
+        # One row per message type: count, p50, p90, p99, p99.9 and max in ms. Its non-empty buckets
+        # go to the transmission_buckets metric, so histograms of rows can be merged later
+        rows = []
+        for msg_type, histogram in list(self.transmission_histograms.items()):
+            counts = histogram.collect()
+            if not counts:
+                continue
+            total = sum(counts.values())
+            percentiles = [histogram_percentile(counts, fraction) / 1000 for fraction in self.PERCENTILES]
+            max_ms = bucket_upper_bound(max(counts)) / 1000
+            rows.append((timestamp, msg_type, total, *percentiles, max_ms))
+            self.transmission_bucket_rows.extend((timestamp, msg_type, bucket_lower_bound(index), counts[index])
+                                                 for index in sorted(counts))
+            print(f"Transmission {msg_type} - Count: {total}, p50: {percentiles[0]:.2f} ms, "
+                  f"p99: {percentiles[2]:.2f} ms, Max: {max_ms:.2f} ms")
+        return rows
+
+    def snapshot_transmission_buckets(self, timestamp: float) -> list:
+        # Registered after the histogram, so a wakeup writing histogram rows also writes their buckets
+        rows, self.transmission_bucket_rows = self.transmission_bucket_rows, []
+        return rows
+
+    def snapshot_transmission_times(self, timestamp: float) -> list:
+        rows = []
+        while self.transmission_times:
+            rows.append((self.transmission_times.popleft(),))
+        return rows
 
 class LogDropoutRate:
+    DROPOUT_RATE_FIELDS = (TIMESTAMP_FIELD, ("sent", "int", "{}"), ("received", "int", "{}"))
+    # One row per sender and stream, named "<first 8 characters of the sender id>/<stream>"
+    STREAM_LOSS_FIELDS = (TIMESTAMP_FIELD, ("stream", "name", "{}"), ("received", "int", "{}"),
+                          ("lost", "int", "{}"), ("duplicates", "int", "{}"), ("reordered", "int", "{}"),
+                          ("loss_rate", "float", "{:.4f}"), ("reorder_rate", "float", "{:.4f}"))
+
     def __init__(self):
-        self.sent_messages = []
-        self.received_messages = []
-        self.dropout_lock = threading.Lock()
-        dropout_logging_thread = threading.Thread(target=self.log_dropout_rate, daemon=True)
-        dropout_logging_thread.start()
-
-    def log_dropout_rate(self):
-        with open(f"{LOGS_DIR}/dropout_rate.log", "a", buffering=1) as f:
-            while True:
-                time.sleep(LOG_RATE//10)
-                with self.dropout_lock:
-                    sent = len(self.sent_messages)
-                    received = len(self.received_messages)
-                    f.write(f"{time.time()},{sent},{received}\n")
-                    print(f"Sent: {sent}, Received: {received}")
-                    self.sent_messages.clear()
-                    self.received_messages.clear()
-
-    def increment_sent_message(self, msg_id):
-        with self.dropout_lock:
-            self.sent_messages.append(msg_id)
-
-    def increment_received_message(self, msg_id):
-        with self.dropout_lock:
-            self.received_messages.append(msg_id)
+        self.sent_messages = ShardedCounter()
+        self.received_messages = ShardedCounter()
+        self.register_metric("dropout_rate", self.snapshot_dropout_rate, self.DROPOUT_RATE_FIELDS)
+
+        # Sent and received counts only compare with two peers, sequence numbers give the loss per sender
+        self.sequence_trackers = {}  # (sender id, stream) -> SequenceTracker
+        self.conflated_sequences = {}  # (sender id, stream) -> ShardedCounter of messages dropped by conflation
+        self.reported_losses = {}  # (sender id, stream) -> messages reported lost so far
+        self.sequence_trackers_lock = threading.Lock()  # Only taken the first time a stream is seen
+        self.register_metric("stream_loss", self.snapshot_stream_loss, self.STREAM_LOSS_FIELDS)
+
+    def snapshot_dropout_rate(self, timestamp: float) -> list:
+        sent = self.sent_messages.collect()
+        received = self.received_messages.collect()
+        print(f"Sent: {sent}, Received: {received}")
+        return [(timestamp, sent, received)]
+
+    def snapshot_stream_loss(self, timestamp: float) -> list:
+        # Conflation skips sequence numbers on purpose, they don't count as lost. A message is conflated
+        # before the gap it leaves shows up, so the totals are compared, not the counts of the interval
+        rows = []
+        worst = None
+        for key, tracker in list(self.sequence_trackers.items()):
+            received, _, duplicates, reordered = tracker.collect()
+            conflated_counter = self.conflated_sequences.get(key)
+            conflated = conflated_counter.value() if conflated_counter is not None else 0
+            lost_total = max(0, tracker.collected[1] - conflated)
+            lost = max(0, lost_total - self.reported_losses.get(key, 0))
+            self.reported_losses[key] = lost_total
+            if not received and not lost:
+                continue
+            loss_rate = lost / (received + lost)
+            reorder_rate = reordered / received if received else 0.0
+            rows.append((timestamp, f"{key[0][:8]}/{key[1]}", received, lost, duplicates, reordered,
+                         loss_rate, reorder_rate))
+            if worst is None or loss_rate > worst[1]:
+                worst = (rows[-1][1], loss_rate, reorder_rate)
+        if worst is not None:
+            print(f"Stream loss - Worst: {worst[0]}, Loss: {worst[1]:.2%}, Reordered: {worst[2]:.2%}")
+        return rows
+
+    def record_sequence(self, sender_id: str, stream: str, sequence: int):
+        key = (sender_id, stream)
+        tracker = self.sequence_trackers.get(key)
+        if tracker is None:
+            with self.sequence_trackers_lock:
+                tracker = self.sequence_trackers.setdefault(key, SequenceTracker(SEQUENCE_WINDOW))
+        tracker.record(sequence)
+
+    def add_conflated_sequence(self, sender_id: str, stream: str):
+        counter = self.conflated_sequences.get((sender_id, stream))
+        if counter is None:
+            with self.sequence_trackers_lock:
+                counter = self.conflated_sequences.setdefault((sender_id, stream), ShardedCounter())
+        counter.increment()
+
+    def increment_sent_message(self):
+        self.sent_messages.increment()
+
+    def increment_received_message(self):
+        self.received_messages.increment()
 
 class LogRealTimeViolations:
+    REAL_TIME_VIOLATIONS_FIELDS = (TIMESTAMP_FIELD, ("violations_per_minute", "float", "{:.2f}"))
+
     def __init__(self):
         self.max_allowed_latency = 0.1 
-        self.real_time_violations = 0  
-        self.real_time_lock = threading.Lock() 
-
-        real_time_logging_thread = threading.Thread(target=self.log_real_time_constraints, daemon=True)
-        real_time_logging_thread.start()
-
-    def log_real_time_constraints(self):
-        with open(f"{LOGS_DIR}/real-time_violations.log", "a", buffering=1) as f:
-            while True:
-                time.sleep(LOG_RATE)
-                with self.real_time_lock:
-                    violations = self.real_time_violations
-                    violations_per_minute = violations * (60 / LOG_RATE)
-                    log_entry = f"{time.time()},{violations_per_minute:.2f}\n"
-                    f.write(log_entry)
-                    print(f"Real-Time Violations: {violations_per_minute:.2f} per minute")
-                    self.real_time_violations = 0
+        self.real_time_violations = ShardedCounter()
+        self.register_metric("real-time_violations", self.snapshot_real_time_violations,
+                             self.REAL_TIME_VIOLATIONS_FIELDS)
+
+    def snapshot_real_time_violations(self, timestamp: float) -> list:
+        violations = self.real_time_violations.collect()
+        violations_per_minute = violations * (60 / self.metric_interval("real-time_violations"))
+        print(f"Real-Time Violations: {violations_per_minute:.2f} per minute")
+        return [(timestamp, violations_per_minute)]
 
     def increment_real_time_violations(self):
-        with self.real_time_lock:
-            self.real_time_violations += 1
+        self.real_time_violations.increment()
 
 class LogThroughput:
+    THROUGHPUT_FIELDS = (TIMESTAMP_FIELD, ("sent", "int", "{}"), ("received", "int", "{}"))
+
     def __init__(self):
-        self.throughput_sent = 0
-        self.throughput_received = 0
-        self.throughput_lock = threading.Lock()
-        throughput_logging_thread = threading.Thread(target=self.log_throughput, daemon=True)
-        throughput_logging_thread.start()
-
-    def log_throughput(self): 
-        with open(f"{LOGS_DIR}/throughput.log", "a", buffering=1) as f:
-            while True:
-                time.sleep(LOG_RATE)  
-                with self.throughput_lock:
-                    sent = self.throughput_sent
-                    received = self.throughput_received
-                    f.write(f"{time.time()},{sent},{received}\n")
-                    print(f"Throughput - Sent: {sent//LOG_RATE}/s, Received: {received//LOG_RATE}/s")
-                    self.throughput_sent = 0
-                    self.throughput_received = 0
+        self.throughput_sent = ShardedCounter()
+        self.throughput_received = ShardedCounter()
+        self.register_metric("throughput", self.snapshot_throughput, self.THROUGHPUT_FIELDS)
+
+    def snapshot_throughput(self, timestamp: float) -> list:
+        sent = self.throughput_sent.collect()
+        received = self.throughput_received.collect()
+        interval = self.metric_interval("throughput")
+        print(f"Throughput - Sent: {sent / interval:.0f}/s, Received: {received / interval:.0f}/s")
+        return [(timestamp, sent, received)]
     
     def increment_sent_throughput(self):
-        with self.throughput_lock:
-            self.throughput_sent += 1
+        self.throughput_sent.increment()
     
     def increment_received_throughput(self):
-        with self.throughput_lock:
-            self.throughput_received += 1
+        self.throughput_received.increment()
 
 class LogBandwidth:
+    CONFLATED_TYPE = "(conflated)"  # Conflated messages are dropped before being decoded, their type is unknown
+    BANDWIDTH_FIELDS = (TIMESTAMP_FIELD, ("sent_bandwidth", "float", "{:.2f}"),
+                        ("received_bandwidth", "float", "{:.2f}"))  # MB per minute
+    BANDWIDTH_BY_TYPE_FIELDS = (TIMESTAMP_FIELD, ("type", "name", "{}"), ("sent", "int", "{}"),
+                                ("received", "int", "{}"))  # Bytes
+
     def __init__(self):
-        self.bytes_sent = 0
-        self.bytes_received = 0
-        self.bandwidth_lock = threading.Lock()
-        bandwidth_logging_thread = threading.Thread(target=self.log_bandwidth, daemon=True)
-        bandwidth_logging_thread.start()
-
-    def log_bandwidth(self):
-        with open(f"{LOGS_DIR}/bandwidth.log", "a", buffering=1) as f:
-            while True:
-                time.sleep(LOG_RATE)
-                with self.bandwidth_lock:
-                    sent = self.bytes_sent
-                    received = self.bytes_received
-
-                    # Calculate MB per minute
-                    sent_bandwidth = (sent * (60 / LOG_RATE)) / (1024 * 1024)
-                    received_bandwidth = (received * (60 / LOG_RATE)) / (1024 * 1024)
-
-                    f.write(f"{time.time()},{sent_bandwidth:.2f},{received_bandwidth:.2f}\n")
-                    print(f"Bandwidth - Sent: {sent_bandwidth:.2f} MB/min, Received: {received_bandwidth:.2f} MB/min")
-
-                    # Reset counters
-                    self.bytes_sent = 0
-                    self.bytes_received = 0
-
-    def add_bytes_sent(self, byte_count):
-        with self.bandwidth_lock:
-            self.bytes_sent += byte_count
-
-    def add_bytes_received(self, byte_count):
-        with self.bandwidth_lock:
-            self.bytes_received += byte_count
+        self.bytes_sent = ShardedCounter()
+        self.bytes_received = ShardedCounter()
+        self.bytes_by_type = {}  # message type -> (bytes sent, bytes received)
+        self.bytes_by_type_lock = threading.Lock()  # Only taken the first time a type is seen
+        self.register_metric("bandwidth", self.snapshot_bandwidth, self.BANDWIDTH_FIELDS)
+        self.register_metric("bandwidth_by_type", self.snapshot_bandwidth_by_type, self.BANDWIDTH_BY_TYPE_FIELDS)
+
+    def snapshot_bandwidth(self, timestamp: float) -> list:
+        sent = self.bytes_sent.collect()
+        received = self.bytes_received.collect()
+
+        # Calculate MB per minute
+        interval = self.metric_interval("bandwidth")
+        sent_bandwidth = (sent * (60 / interval)) / (1024 * 1024)
+        received_bandwidth = (received * (60 / interval)) / (1024 * 1024)
+
+        print(f"Bandwidth - Sent: {sent_bandwidth:.2f} MB/min, Received: {received_bandwidth:.2f} MB/min")
+        return [(timestamp, sent_bandwidth, received_bandwidth)]
+
+    def snapshot_bandwidth_by_type(self, timestamp: float) -> list:
+        # Bytes per message type, most expensive first
+        type_bytes = [(msg_type, counters[0].collect(), counters[1].collect())
+                      for msg_type, counters in list(self.bytes_by_type.items())]
+        type_bytes.sort(key=lambda row: row[1] + row[2], reverse=True)
+        if type_bytes and type_bytes[0][1] + type_bytes[0][2]:
+            print(f"Bandwidth - Most bytes: {type_bytes[0][0]}")
+        return [(timestamp, msg_type, type_sent, type_received)
+                for msg_type, type_sent, type_received in type_bytes if type_sent or type_received]
+
+    def get_type_counters(self, msg_type: str) -> tuple:
+        counters = self.bytes_by_type.get(msg_type)
+        if counters is None:
+            with self.bytes_by_type_lock:
+                counters = self.bytes_by_type.setdefault(msg_type, (ShardedCounter(), ShardedCounter()))
+        return counters
+
+    def add_bytes_sent(self, byte_count, msg_type: str = None):
+        self.bytes_sent.increment(byte_count)
+        if msg_type is not None:
+            self.get_type_counters(msg_type)[0].increment(byte_count)
+
+    def add_bytes_received(self, byte_count, msg_type: str = None):
+        self.bytes_received.increment(byte_count)
+        if msg_type is not None:
+            self.get_type_counters(msg_type)[1].increment(byte_count)
+
 class LogErrorRate:
+    ERRORS_FIELDS = (TIMESTAMP_FIELD, ("errors", "int", "{}"))
+
     def __init__(self):
-        self.error_count = 0
-        self.error_lock = threading.Lock()
-        error_logging_thread = threading.Thread(target=self.log_errors, daemon=True)
-        error_logging_thread.start()
-
-    def log_errors(self):
-        with open(f"{LOGS_DIR}/errors.log", "a", buffering=1) as f:
-            while True:
-                time.sleep(LOG_RATE)  
-                with self.error_lock:
-                    errors = self.error_count
-                    f.write(f"{time.time()},{errors}\n")
-                    print(f"Errors in the last minute: {errors}")
-                    self.error_count = 0
+        self.error_count = ShardedCounter()
+        self.register_metric("errors", self.snapshot_errors, self.ERRORS_FIELDS)
+
+    def snapshot_errors(self, timestamp: float) -> list:
+        errors = self.error_count.collect()
+        print(f"Errors in the last minute: {errors}")
+        return [(timestamp, errors)]
     
     def increment_error_count(self):
-        with self.error_lock:
-            self.error_count += 1
+        self.error_count.increment()
 
 class LogResourceUtilization:
+    RESOURCES_FIELDS = (TIMESTAMP_FIELD, ("cpu_percent", "float", "{}"), ("memory_mb", "float", "{}"))
+
     def __init__(self):
-        resource_logging_thread = threading.Thread(target=self.log_resources, daemon=True)
-        resource_logging_thread.start()
-
-    def log_resources(self):
-        with open(f"{LOGS_DIR}/resources.log", "a", buffering=1) as f:
-            while True:
-                time.sleep(LOG_RATE)  
-                process = psutil.Process()
-                cpu_percent = process.cpu_percent(interval=1)  # CPU usage over the last second
-                memory_info = process.memory_info()
-                memory_usage_mb = memory_info.rss / (1024 * 1024)  # Resident Set Size in MB
-                f.write(f"{time.time()},{cpu_percent},{memory_usage_mb}\n")
-                print(f"Resource Usage - CPU: {cpu_percent}%, Memory: {memory_usage_mb:.2f} MB")
+        self.process = psutil.Process()
+        self.process.cpu_percent(interval=None)  # Start measuring, the first call always returns 0
+        self.register_metric("resources", self.snapshot_resources, self.RESOURCES_FIELDS)
+
+    def snapshot_resources(self, timestamp: float) -> list:
+        cpu_percent = self.process.cpu_percent(interval=None)  # CPU usage since the previous snapshot
+        memory_info = self.process.memory_info()
+        memory_usage_mb = memory_info.rss / (1024 * 1024)  # Resident Set Size in MB
+        print(f"Resource Usage - CPU: {cpu_percent}%, Memory: {memory_usage_mb:.2f} MB")
+        return [(timestamp, cpu_percent, memory_usage_mb)]
 
 class LogFPS:
+    FPS_FIELDS = (TIMESTAMP_FIELD, ("avg_fps", "float", "{}"), ("min_fps", "float", "{}"), ("max_fps", "float", "{}"))
+
     def __init__(self):
         self.fps_samples = []
         self.fps_lock = threading.Lock()
-        fps_logging_thread = threading.Thread(target=self.log_fps, daemon=True)
-        fps_logging_thread.start()
-
-    def log_fps(self):
-        with open(f"{LOGS_DIR}/fps.log", "a", buffering=1) as f:
-            while True:
-                time.sleep(LOG_RATE)  
-                with self.fps_lock:
-                    if self.fps_samples:
-                        avg_fps = statistics.mean(self.fps_samples)
-                        min_fps = min(self.fps_samples)
-                        max_fps = max(self.fps_samples)
-                        f.write(f"{time.time()},{avg_fps},{min_fps},{max_fps}\n")
-                        print(f"FPS - Avg: {avg_fps:.2f}, Min: {min_fps:.2f}, Max: {max_fps:.2f}")
-                        self.fps_samples.clear()
+        self.register_metric("fps", self.snapshot_fps, self.FPS_FIELDS)
+
+    def snapshot_fps(self, timestamp: float) -> list:
+        with self.fps_lock:
+            fps_samples = self.fps_samples
+            self.fps_samples = []
+        if not fps_samples:
+            return []
+        avg_fps = statistics.mean(fps_samples)
+        min_fps = min(fps_samples)
+        max_fps = max(fps_samples)
+        print(f"FPS - Avg: {avg_fps:.2f}, Min: {min_fps:.2f}, Max: {max_fps:.2f}")
+        return [(timestamp, avg_fps, min_fps, max_fps)]
     
     def add_fps_sample(self, fps: float):
         with self.fps_lock:
             self.fps_samples.append(fps)
 
+class LogConflation:
+    CONFLATION_FIELDS = (TIMESTAMP_FIELD, ("conflated", "int", "{}"))
+
+    def __init__(self):
+        self.conflated_count = ShardedCounter()
+        self.register_metric("conflation", self.snapshot_conflation, self.CONFLATION_FIELDS)
+
+    def snapshot_conflation(self, timestamp: float) -> list:
+        conflated = self.conflated_count.collect()
+        print(f"Conflated: {conflated} stale state messages skipped")
+        return [(timestamp, conflated)]
+
+    def increment_conflated_count(self):
+        self.conflated_count.increment()
+
+class LogHandlerLatency:
+    HANDLER_LATENCY_FIELDS = (TIMESTAMP_FIELD, ("type", "name", "{}"), ("count", "int", "{}"), ("errors", "int", "{}"),
+                              ("mean_latency_ms", "float", "{:.3f}"), ("max_latency_ms", "float", "{:.3f}"),
+                              ("mean_run_time_ms", "float", "{:.3f}"))
+
+    def __init__(self):
+        self.handler_stats_sources = []
+        self.register_metric("handler_latency", self.snapshot_handler_latency, self.HANDLER_LATENCY_FIELDS)
+
+    def snapshot_handler_latency(self, timestamp: float) -> list:
+        rows = []
+        for collect_stats in list(self.handler_stats_sources):
+            for msg_type, stats in collect_stats().items():
+                if not stats["count"]:
+                    continue
+                rows.append((timestamp, msg_type, stats['count'], stats['errors'],
+                             stats['mean_latency_ms'], stats['max_latency_ms'], stats['mean_run_time_ms']))
+                print(f"Handler {msg_type} - Count: {stats['count']}, Mean latency: {stats['mean_latency_ms']:.2f} ms, Max latency: {stats['max_latency_ms']:.2f} ms")
+        return rows
+
+    def track_handler_stats(self, collect_stats: callable):
+        # collect_stats returns {msg_type: stats} for the current interval, e.g. MessageDispatcher.collect_stats
+        self.handler_stats_sources.append(collect_stats)
+
+class LogInterpolation:
+    INTERPOLATION_FIELDS = (TIMESTAMP_FIELD, ("samples", "int", "{}"), ("mean_depth", "float", "{:.2f}"),
+                            ("min_depth", "int", "{}"), ("extrapolated", "int", "{}"), ("starved", "int", "{}"))
+
+    def __init__(self):
+        self.interpolation_samples = 0
+        self.interpolation_depth_total = 0
+        self.interpolation_depth_min = None
+        self.extrapolated_count = 0
+        self.starved_count = 0
+        self.interpolation_lock = threading.Lock()
+        self.register_metric("interpolation", self.snapshot_interpolation, self.INTERPOLATION_FIELDS)
+
+    def snapshot_interpolation(self, timestamp: float) -> list:
+        with self.interpolation_lock:
+            samples = self.interpolation_samples
+            depth_total = self.interpolation_depth_total
+            depth_min = self.interpolation_depth_min
+            extrapolated = self.extrapolated_count
+            starved = self.starved_count
+            self.interpolation_samples = 0
+            self.interpolation_depth_total = 0
+            self.interpolation_depth_min = None
+            self.extrapolated_count = 0
+            self.starved_count = 0
+        if not samples:
+            return []
+        mean_depth = depth_total / samples
+        print(f"Interpolation - Mean buffer depth: {mean_depth:.2f}, Min: {depth_min}, "
+              f"Extrapolated: {extrapolated}/{samples}, Starved: {starved}/{samples}")
+        return [(timestamp, samples, mean_depth, depth_min, extrapolated, starved)]
+
+    def add_interpolation_sample(self, buffer_depth: int, extrapolated: bool, starved: bool):
+        # buffer_depth: snapshots buffered ahead of the drawn time, extrapolated/starved: the buffer ran dry
+        with self.interpolation_lock:
+            self.interpolation_samples += 1
+            self.interpolation_depth_total += buffer_depth
+            if self.interpolation_depth_min is None or buffer_depth < self.interpolation_depth_min:
+                self.interpolation_depth_min = buffer_depth
+            self.extrapolated_count += extrapolated
+            self.starved_count += starved
+
 class LoggingService(
-    LogTransmissionTimes,   # Time taken for a message to be sent and received
-    LogDropoutRate,         # Rate of messages sent but not received
+    LogAggregator,          # Single thread snapshotting all metrics below and writing their rows
+    LogTransmissionTimes,   # Time taken for a message to be sent and received, as a histogram per message type
+    LogDropoutRate,         # Rate of messages sent but not received, in total and per sender stream
     LogRealTimeViolations,  # Messages that violate real-time constraints (under stress)
     LogThroughput,          # Number of messages sent and received per second
-    LogBandwidth,           # Amount of data sent and received per minute
+    LogBandwidth,           # Amount of data sent and received per minute, in total and per message type
     LogErrorRate,           # Number of errors in message handling per minute
     LogResourceUtilization, # CPU and memory usage of the process 
-    LogFPS):                # Frames per second of the game
-
-    TIME_SYNC_INTERVAL = 300  # Time sync interval in seconds (5 minutes)
+    LogFPS,                 # Frames per second of the game
+    LogConflation,          # Stale state messages replaced by a newer one before being handled
+    LogHandlerLatency,      # Latency of the message handlers registered with the Peer
+    LogInterpolation):      # Snapshot buffer depth and extrapolation of remote entities
 
     def __init__(self):
         os.makedirs(LOGS_DIR, exist_ok=True)
+        LogAggregator.__init__(self)
         LogTransmissionTimes.__init__(self)
         LogDropoutRate.__init__(self)
         LogRealTimeViolations.__init__(self)
@@ -224,65 +488,60 @@ class LoggingService(
         LogErrorRate.__init__(self)
         LogResourceUtilization.__init__(self)
         LogFPS.__init__(self)
+        LogConflation.__init__(self)
+        LogHandlerLatency.__init__(self)
+        LogInterpolation.__init__(self)
+        self.start_aggregator()
 
-        self.time_offset = timedelta(0)
-        self.last_sync_time = None
-        self.time_sync_thread = threading.Thread(target=self.synchronize_time_periodically, daemon=True)
-        self.time_sync_thread.start()
-        
-        # Initial synchronization
-        self.synchronize_time()
-
-    def synchronize_time(self):
-        external_time = self.get_time_timeapi_io()
-        if external_time:
-            self.time_offset = external_time - datetime.utcnow()
-            self.last_sync_time = datetime.utcnow()
-
-    def synchronize_time_periodically(self):
-        while True:
-            self.synchronize_time()
-            time.sleep(self.TIME_SYNC_INTERVAL)
+        # Unsynchronized until the Peer attaches the clock of its ClockSyncService
+        self.clock = SyncedClock()
+
+    def attach_clock(self, clock: SyncedClock):
+        self.clock = clock
 
     def get_adjusted_time(self):
-        # Use the offset to calculate the approximate current time
-        return datetime.utcnow() + self.time_offset
+        # Current time on the leader's clock, read from the monotonic clock, so it never steps backwards
+        return datetime.fromtimestamp(self.clock.now())
 
-    def on_message_sent(self, message: Message):
+    def stamp_send_time(self, message: Message):
+        # Called before the message is serialized, so the timestamp goes out on the wire
         message.send_timestamp = self.get_adjusted_time()
-        self.increment_sent_message(message.id)
+
+    def on_message_sent(self, message: Message, message_size: int):
+        # message_size: bytes the Peer put on the wire, topic frame included
+        self.increment_sent_message()
         self.increment_sent_throughput() 
-        serialized_message = message.to_json()
-        message_size = len(serialized_message.encode('utf-8'))
-        self.add_bytes_sent(message_size)
+        self.add_bytes_sent(message_size, message.type)
 
-    def on_message_received(self, message: Message):
+    def on_message_received(self, message: Message, message_size: int, topic: bytes = None):
+        # topic: frame the message arrived on, its part before the first ':' names the sender's stream
         message.receive_timestamp = self.get_adjusted_time()
-        self.increment_received_message(message.id)
+        self.increment_received_message()
         self.increment_received_throughput()
+        if message.seq is not None and topic is not None:
+            self.record_sequence(str(message.id), topic.split(b':', 1)[0].decode('utf-8'), message.seq)
 
         if message.send_timestamp:
             transmission_time = (message.receive_timestamp - message.send_timestamp).total_seconds()
-            self.transmission_times.put(transmission_time)
+            self.record_transmission_time(message.type, transmission_time)
             if transmission_time > self.max_allowed_latency:
                 self.increment_real_time_violations()
 
-        serialized_message = message.to_json()
-        message_size = len(serialized_message.encode('utf-8'))
-        self.add_bytes_received(message_size)
-
-    def get_time_timeapi_io(self, timezone='UTC'):
-        url = f'https://timeapi.io/api/Time/current/zone?timeZone={timezone}'
-        try:
-            response = requests.get(url)
-            data = response.json()
-            hour = data['hour']
-            minute = data['minute']
-            second = data['seconds']
-            millisecond = data['milliSeconds']
-            current_time = datetime.utcnow().replace(hour=hour, minute=minute, second=second, microsecond=millisecond*1000)
-            return current_time
-
-        except Exception as e:
-            print(f"Error fetching time: {e}")
-            return None
+        self.add_bytes_received(message_size, message.type)
+
+    def on_message_conflated(self, message_size: int, topic: bytes = None):
+        # The message was received but replaced by a newer one from the same sender before being handled.
+        # topic: "<stream>:<sender id>" of the conflated stream, None if it isn't a stream we receive
+        self.increment_conflated_count()
+        if topic is not None:
+            stream, _, sender_id = topic.decode('utf-8').partition(':')
+            self.add_conflated_sequence(sender_id, stream)
+        self.increment_received_message()
+        self.increment_received_throughput()
+        self.add_bytes_received(message_size, self.CONFLATED_TYPE)
+
+    def kill(self):
+        """
+        Stop the aggregator thread after writing the rows collected so far.
+        """
+        self.stop_aggregator()
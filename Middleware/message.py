@@ -1,4 +1,5 @@
 import json
+import struct
 from dataclasses import dataclass, field, asdict
 import uuid
 from datetime import datetime
@@ -8,9 +9,10 @@ class Message:
     id: str
     type: str
     data: dict
-    msg_id: str = field(default_factory=lambda: str(uuid.uuid4())) 
+    msg_id: str = field(default_factory=lambda: str(uuid.uuid4()))
     send_timestamp: float = None   # Using float to store UNIX timestamp
     receive_timestamp: float = None
+    seq: int = None  # Per sender and stream (public, state, private per receiver), set by the Peer when sending
 
     def to_json(self):
         # Convert datetime fields to UNIX timestamp (seconds since the epoch)
@@ -19,14 +21,14 @@ class Message:
             data_dict['send_timestamp'] = self.send_timestamp.timestamp()  # Convert to UNIX timestamp
         if isinstance(self.receive_timestamp, datetime):
             data_dict['receive_timestamp'] = self.receive_timestamp.timestamp()  # Convert to UNIX timestamp
-        
+
         return json.dumps(data_dict)
 
     @staticmethod
     def from_json(json_str: str):
         try:
             data = json.loads(json_str)
-            
+
             # Convert timestamps back to datetime objects if they exist
             send_timestamp = data.get('send_timestamp')
             if send_timestamp is not None:
@@ -42,8 +44,167 @@ class Message:
                 data=data.get("data", {}),
                 msg_id=data.get("msg_id"),
                 send_timestamp=send_timestamp,
-                receive_timestamp=receive_timestamp
+                receive_timestamp=receive_timestamp,
+                seq=data.get("seq")
             )
         except json.JSONDecodeError:
             print("Failed to decode JSON to Message.")
             return None
+
+'''
+Wire Codecs
+    - JsonCodec: the original Message.to_json / Message.from_json encoding
+    - BinaryCodec: fixed-layout struct header, raw 16-byte UUIDs, float64 epoch timestamps
+      and a type enum, followed by the compact JSON encoded data payload
+    - Peers advertise the codecs they support and negotiate one per peer,
+      JSON is always available as the fallback
+'''
+
+# Append only, the position in the tuple is the type code sent on the wire (0 = inline type string)
+MESSAGE_TYPES = ("presence", "election", "answer", "coordinator", "heartbeat", "game_state", "side",
+                 "clock_ping", "clock_pong", "control", "control_ack")
+MESSAGE_TYPE_CODES = {msg_type: code for code, msg_type in enumerate(MESSAGE_TYPES, start=1)}
+
+def _to_epoch(timestamp):
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    return timestamp
+
+def _from_epoch(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp)
+
+def _uuid_to_bytes(value) -> bytes:
+    # Cheaper than uuid.UUID(value).bytes, raises ValueError for anything that isn't a UUID
+    raw = bytes.fromhex(str(value).replace('-', ''))
+    if len(raw) != 16:
+        raise ValueError(f"Not a UUID: {value}")
+    return raw
+
+def _bytes_to_uuid(raw: bytes) -> str:
+    # Same format as str(uuid.UUID(bytes=raw)) without building the UUID object
+    h = raw.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, message: Message) -> bytes:
+        return message.to_json().encode('utf-8')
+
+    def decode(self, payload) -> Message:
+        # Decoded here, json.loads would detect the encoding of bytes first and we always send UTF-8
+        return Message.from_json(str(payload, 'utf-8'))
+
+class BinaryCodec:
+    """
+    Header layout (network byte order):
+        magic (B), version (B), type code (B), flags (B),
+        id (16s), msg_id (16s), send_timestamp (d), receive_timestamp (d), seq (Q), data length (I)
+    A type code of 0 is followed by a length prefixed (B) type string.
+    """
+    name = "binary"
+    MAGIC = 0xB1
+    VERSION = 2
+    HEADER = struct.Struct("!BBBB16s16sddQI")
+    TYPE_LENGTH = struct.Struct("!B")
+
+    FLAG_SEND_TIMESTAMP = 0x01
+    FLAG_RECEIVE_TIMESTAMP = 0x02
+    FLAG_SEQ = 0x04
+
+    def encode(self, message: Message) -> bytes:
+        flags = 0
+        send_timestamp = _to_epoch(message.send_timestamp)
+        receive_timestamp = _to_epoch(message.receive_timestamp)
+        if send_timestamp is not None:
+            flags |= self.FLAG_SEND_TIMESTAMP
+        if receive_timestamp is not None:
+            flags |= self.FLAG_RECEIVE_TIMESTAMP
+        if message.seq is not None:
+            flags |= self.FLAG_SEQ
+
+        type_code = MESSAGE_TYPE_CODES.get(message.type, 0)
+        data = json.dumps(message.data, separators=(',', ':')).encode('utf-8')
+        header = self.HEADER.pack(
+            self.MAGIC,
+            self.VERSION,
+            type_code,
+            flags,
+            _uuid_to_bytes(message.id),  # Raises ValueError for non UUID ids, caller falls back to JSON
+            _uuid_to_bytes(message.msg_id),
+            send_timestamp or 0.0,
+            receive_timestamp or 0.0,
+            message.seq or 0,
+            len(data)
+        )
+        if type_code == 0:
+            type_bytes = message.type.encode('utf-8')
+            return header + self.TYPE_LENGTH.pack(len(type_bytes)) + type_bytes + data
+        return header + data
+
+    def decode(self, payload) -> Message:
+        try:
+            magic, version, type_code, flags, id_bytes, msg_id_bytes, send_timestamp, receive_timestamp, seq, data_length = \
+                self.HEADER.unpack_from(payload)
+            if magic != self.MAGIC or version != self.VERSION:
+                print(f"Unsupported binary message version: {version}")
+                return None
+
+            offset = self.HEADER.size
+            if type_code == 0:
+                (type_length,) = self.TYPE_LENGTH.unpack_from(payload, offset)
+                offset += self.TYPE_LENGTH.size
+                msg_type = bytes(payload[offset:offset + type_length]).decode('utf-8')
+                offset += type_length
+            else:
+                msg_type = MESSAGE_TYPES[type_code - 1]
+
+            data = json.loads(bytes(payload[offset:offset + data_length]))
+
+            return Message(
+                id=_bytes_to_uuid(id_bytes),
+                type=msg_type,
+                data=data,
+                msg_id=_bytes_to_uuid(msg_id_bytes),
+                send_timestamp=_from_epoch(send_timestamp) if flags & self.FLAG_SEND_TIMESTAMP else None,
+                receive_timestamp=_from_epoch(receive_timestamp) if flags & self.FLAG_RECEIVE_TIMESTAMP else None,
+                seq=seq if flags & self.FLAG_SEQ else None
+            )
+        except (struct.error, IndexError, UnicodeDecodeError, json.JSONDecodeError) as e:
+            print(f"Failed to decode binary Message: {e}")
+            return None
+
+CODECS = {codec.name: codec for codec in (BinaryCodec(), JsonCodec())}
+BINARY_CODEC = CODECS["binary"]
+BINARY_MAGIC = BinaryCodec.MAGIC
+FALLBACK_CODEC = "json"
+
+def negotiate_codec(local_codecs: list, remote_codecs: list) -> str:
+    """
+    Pick the first of our codecs that the remote peer also supports, JSON if there is none.
+    """
+    for name in local_codecs:
+        if name in remote_codecs and name in CODECS:
+            return name
+    return FALLBACK_CODEC
+
+def encode_message(message: Message, codec_name: str = FALLBACK_CODEC) -> bytes:
+    """
+    Encode a message with the given codec, falling back to JSON if the message can't be represented.
+    """
+    codec = CODECS.get(codec_name, CODECS[FALLBACK_CODEC])
+    try:
+        return codec.encode(message)
+    except (ValueError, struct.error):
+        return CODECS[FALLBACK_CODEC].encode(message)
+
+def decode_message(payload) -> Message:
+    """
+    Decode a payload encoded with any of the known codecs, detected from the first byte.
+    Accepts bytes or a memoryview.
+    """
+    if payload and payload[0] == BINARY_MAGIC:
+        return BINARY_CODEC.decode(payload)
+    return Message.from_json(str(payload, 'utf-8'))  # JsonCodec.decode, inlined on the receive path
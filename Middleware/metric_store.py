@@ -0,0 +1,147 @@
+import mmap
+import os
+import struct
+try:
+    import fcntl
+except ImportError:  # Windows, ring files aren't locked
+    fcntl = None
+
+'''
+Binary Metric Store
+    - One pre-allocated ring file per metric (logs/<name>.ring) holding fixed-size records,
+      written through a memory map: appending a record is a struct.pack_into, no syscall
+    - The header describes the record layout, so readers map the records straight into
+      NumPy structured arrays (plot_scripts/metric_store.py) without parsing text
+    - The file is append-only: write_count counts every record ever written, the record of write n
+      is in slot n % capacity. It is updated after the record, so readers never see a half written record
+      unless the writer laps them. Once full, the oldest records are overwritten
+    - Field types: "float" (float64), "int" (int64) and "name" (utf-8, truncated to 16 bytes). Every field
+      is fixed-width, so the ring files and the CSV export carry the same columns
+    - Little-endian throughout, matching the NumPy dtypes stored in the header
+    - A ring file has a single writer, it holds an exclusive lock on the file. Further LoggingServices
+      writing to the same directory (several peers on one machine) use <name>1.ring, <name>2.ring, ...
+
+Layout
+    header: magic (4s), version (H), field count (H), header size (I), record size (I),
+            capacity (Q), write count (Q), then per field: name (24s), NumPy dtype (8s)
+    records: capacity * record size bytes, starting at header size
+'''
+
+MAGIC = b"PMRB"
+VERSION = 1
+HEADER_FORMAT = "<4sHHIIQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+WRITE_COUNT_OFFSET = HEADER_SIZE - 8
+FIELD_FORMAT = "<24s8s"
+FIELD_SIZE = struct.calcsize(FIELD_FORMAT)
+HEADER_ALIGNMENT = 64
+
+# Field type -> (struct code, NumPy dtype)
+FIELD_TYPES = {
+    "float": ("d", "<f8"),
+    "int": ("q", "<i8"),
+    "name": ("16s", "S16"),
+}
+
+def header_size(field_count: int) -> int:
+    size = HEADER_SIZE + field_count * FIELD_SIZE
+    return (size + HEADER_ALIGNMENT - 1) // HEADER_ALIGNMENT * HEADER_ALIGNMENT
+
+class MetricRing:
+    def __init__(self, path: str, fields: list, capacity: int):
+        """
+        Open or create the ring file of a metric.
+
+        :param path: Path of the ring file.
+        :param fields: (name, field type, CSV format) of the row fields.
+        :param capacity: Records kept before the oldest are overwritten.
+        """
+        for name, field_type, _ in fields:
+            if field_type not in FIELD_TYPES:
+                raise ValueError(f"Unknown type '{field_type}' of metric field '{name}'")
+        self.fields = [(name, field_type) for name, field_type, _ in fields]
+        self.record_format = "<" + "".join(FIELD_TYPES[field_type][0] for _, field_type in self.fields)
+        self.record_size = struct.calcsize(self.record_format)
+        self.capacity = capacity
+        self.data_offset = header_size(len(self.fields))
+        self.header = self.build_header()
+
+        file_size = self.data_offset + capacity * self.record_size
+        # Created without truncating, the file is only sized or reset once we hold its lock
+        self.file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), "r+b")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self.file.close()
+                raise
+        if not self.matches_header(file_size):
+            if os.fstat(self.file.fileno()).st_size:
+                print(f"Metric store '{path}' has a different layout, starting a new one")
+            self.file.truncate(0)
+            self.file.truncate(file_size)  # Sparse until written
+            self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), file_size)
+            self.map[:len(self.header)] = self.header
+        else:
+            self.map = mmap.mmap(self.file.fileno(), file_size)
+        self.write_count = struct.unpack_from("<Q", self.map, WRITE_COUNT_OFFSET)[0]
+
+    def build_header(self) -> bytes:
+        header = bytearray(struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(self.fields), self.data_offset,
+                                       self.record_size, self.capacity, 0))
+        for name, field_type in self.fields:
+            header += struct.pack(FIELD_FORMAT, name.encode("utf-8"), FIELD_TYPES[field_type][1].encode("ascii"))
+        return bytes(header)
+
+    def matches_header(self, file_size: int) -> bool:
+        """
+        Whether the existing file has the same layout, its records are kept and appended to.
+        """
+        if os.fstat(self.file.fileno()).st_size != file_size:
+            return False
+        self.file.seek(0)
+        existing = self.file.read(len(self.header))
+        # Everything but the write count has to match
+        return (existing[:WRITE_COUNT_OFFSET] == self.header[:WRITE_COUNT_OFFSET]
+                and existing[HEADER_SIZE:] == self.header[HEADER_SIZE:])
+
+    def append(self, record: tuple):
+        """
+        Write one record, values in field order (names already encoded, see record_values).
+        """
+        slot = self.write_count % self.capacity
+        struct.pack_into(self.record_format, self.map, self.data_offset + slot * self.record_size, *record)
+        self.write_count += 1
+        struct.pack_into("<Q", self.map, WRITE_COUNT_OFFSET, self.write_count)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+def open_metric_ring(directory: str, name: str, fields: list, capacity: int) -> MetricRing:
+    """
+    Open the ring file of a metric, numbering it if another writer has <name>.ring open.
+    """
+    number = 0
+    while True:
+        try:
+            return MetricRing(os.path.join(directory, f"{name}{number or ''}.ring"), fields, capacity)
+        except BlockingIOError:
+            number += 1
+
+def record_values(fields: list, row: tuple) -> tuple:
+    """
+    Return the values of a row as they go into the ring file, names encoded.
+    """
+    values = []
+    for (_, field_type, _), value in zip(fields, row):
+        if field_type == "name":
+            values.append(str(value).encode("utf-8")[:16])
+        else:
+            values.append(value)
+    return tuple(values)
+
+def csv_line(fields: list, row: tuple) -> str:
+    return ",".join(csv_format.format(value) for (_, _, csv_format), value in zip(fields, row)) + "\n"
@@ -0,0 +1,208 @@
+import threading
+
+'''
+Lock-Free Metric Counters
+    - ShardedCounter: every thread increments its own shard, only creating a shard takes a lock
+    - The reporter thread sums the shards and subtracts the total it collected last time,
+      so shards are never reset from another thread and no increment is lost
+    - Shards of threads that have exited are folded into a retired total when collecting,
+      short-lived timer threads don't make the shard list grow
+    - ShardedHistogram: HDR-style log-bucketed histogram with the same per-thread sharding.
+      Every power of two range is split into HISTOGRAM_SUB_BUCKETS linear buckets, so any recorded
+      value is known within 1 / HISTOGRAM_SUB_BUCKETS of its value with a few hundred buckets at most
+    - SequenceTracker: gaps, duplicates and late arrivals of one sender's sequence numbers,
+      counted with a fixed-size bitmap window
+'''
+
+HISTOGRAM_SUB_BUCKETS = 16
+_SUB_BITS = HISTOGRAM_SUB_BUCKETS.bit_length()  # Values below 2 ** _SUB_BITS get a bucket each
+_LINEAR_BUCKETS = 1 << _SUB_BITS
+
+class ShardedCounter:
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []  # [count, owning thread]
+        self.shards_lock = threading.Lock()
+        self.retired = 0    # Counts of shards whose thread has exited
+        self.collected = 0  # Total returned by the previous collect
+
+    def increment(self, amount: int = 1):
+        try:
+            self.local.shard[0] += amount
+        except AttributeError:
+            self.new_shard()[0] += amount
+
+    def new_shard(self) -> list:
+        shard = [0, threading.current_thread()]
+        with self.shards_lock:
+            self.shards.append(shard)
+        self.local.shard = shard
+        return shard
+
+    def value(self) -> int:
+        """
+        Return the total of all increments so far.
+        """
+        with self.shards_lock:
+            live_shards = []
+            for shard in self.shards:
+                if shard[1].is_alive():
+                    live_shards.append(shard)
+                else:
+                    self.retired += shard[0]
+            self.shards = live_shards
+            return self.retired + sum(shard[0] for shard in live_shards)
+
+    def collect(self) -> int:
+        """
+        Return the increments since the previous collect. Meant to be called by a single reporter thread.
+        """
+        total = self.value()
+        interval = total - self.collected
+        self.collected = total
+        return interval
+
+def bucket_index(value: int) -> int:
+    """
+    Return the histogram bucket of a non-negative integer value.
+    """
+    if value < _LINEAR_BUCKETS:
+        return value
+    shift = value.bit_length() - _SUB_BITS
+    return _LINEAR_BUCKETS + (shift - 1) * HISTOGRAM_SUB_BUCKETS + (value >> shift) - HISTOGRAM_SUB_BUCKETS
+
+def bucket_lower_bound(index: int) -> int:
+    """
+    Return the smallest value of a histogram bucket.
+    """
+    if index < _LINEAR_BUCKETS:
+        return index
+    shift, sub_bucket = divmod(index - _LINEAR_BUCKETS, HISTOGRAM_SUB_BUCKETS)
+    return (HISTOGRAM_SUB_BUCKETS + sub_bucket) << (shift + 1)
+
+def bucket_upper_bound(index: int) -> int:
+    """
+    Return the largest value of a histogram bucket.
+    """
+    return bucket_lower_bound(index + 1) - 1
+
+def histogram_percentile(counts: dict, fraction: float) -> int:
+    """
+    Return the value at a percentile (0..1) of a histogram, as the upper bound of its bucket.
+
+    :param counts: bucket index -> count.
+    """
+    total = sum(counts.values())
+    if not total:
+        return 0
+    rank = max(1, int(fraction * total + 0.5))
+    seen = 0
+    for index in sorted(counts):
+        seen += counts[index]
+        if seen >= rank:
+            return bucket_upper_bound(index)
+    return bucket_upper_bound(max(counts))
+
+class ShardedHistogram:
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []  # [{bucket index: count}, owning thread]
+        self.shards_lock = threading.Lock()
+        self.retired = {}    # Counts of shards whose thread has exited
+        self.collected = {}  # Totals returned by the previous collect
+
+    def record(self, value: int):
+        try:
+            counts = self.local.counts
+        except AttributeError:
+            counts = self.new_shard()
+        index = bucket_index(value)
+        counts[index] = counts.get(index, 0) + 1
+
+    def new_shard(self) -> dict:
+        counts = {}
+        with self.shards_lock:
+            self.shards.append([counts, threading.current_thread()])
+        self.local.counts = counts
+        return counts
+
+    def totals(self) -> dict:
+        """
+        Return the bucket counts of all values recorded so far.
+        """
+        with self.shards_lock:
+            totals = dict(self.retired)
+            live_shards = []
+            for shard in self.shards:
+                counts = shard[0].copy()  # A single C call, safe while the owning thread records
+                for index, count in counts.items():
+                    totals[index] = totals.get(index, 0) + count
+                if shard[1].is_alive():
+                    live_shards.append(shard)
+                else:
+                    for index, count in counts.items():
+                        self.retired[index] = self.retired.get(index, 0) + count
+            self.shards = live_shards
+            return totals
+
+    def collect(self) -> dict:
+        """
+        Return the bucket counts of the values recorded since the previous collect.
+        """
+        totals = self.totals()
+        interval = {index: count - self.collected.get(index, 0)
+                    for index, count in totals.items() if count != self.collected.get(index, 0)}
+        self.collected = totals
+        return interval
+
+class SequenceTracker:
+    """
+    Receive side of one sender's sequence-numbered stream. A bitmap of the last `window` sequence
+    numbers (bit i = highest - i was received) tells duplicates from late arrivals without storing ids.
+    Sequence numbers skipped when a newer one arrives count as missing until they arrive late,
+    so missing is the net loss; numbers older than the window are counted as late without a duplicate check.
+    Updated by the thread delivering the stream, read by the reporter thread.
+    """
+    def __init__(self, window: int):
+        self.window = window
+        self.mask = (1 << window) - 1
+        self.first = None  # Numbers before the first one received were never counted missing
+        self.highest = None
+        self.bitmap = 0
+        self.received = 0
+        self.missing = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.collected = (0, 0, 0, 0)  # Totals returned by the previous collect
+
+    def record(self, sequence: int):
+        if self.highest is None:
+            self.first = self.highest = sequence
+            self.bitmap = 1
+            self.received += 1
+            return
+        offset = self.highest - sequence
+        if offset < 0:
+            # Newer than everything so far, the numbers skipped over are missing for now
+            self.missing += -offset - 1
+            self.bitmap = ((self.bitmap << -offset) | 1) & self.mask
+            self.highest = sequence
+            self.received += 1
+        elif offset < self.window and self.bitmap >> offset & 1:
+            self.duplicates += 1
+        else:
+            if offset < self.window:
+                self.bitmap |= 1 << offset
+            self.received += 1
+            self.reordered += 1
+            if sequence > self.first:
+                self.missing -= 1
+
+    def collect(self) -> tuple:
+        """
+        Return (received, missing, duplicates, reordered) since the previous collect.
+        """
+        totals = (self.received, self.missing, self.duplicates, self.reordered)
+        interval = tuple(total - collected for total, collected in zip(totals, self.collected))
+        self.collected = totals
+        return interval
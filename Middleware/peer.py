@@ -1,48 +1,136 @@
 import zmq
+import zmq.asyncio
 import threading
-import json
 import random
 import uuid
-from properties import POLL_RATE
+import itertools
+import concurrent.futures
+from properties import POLL_RATE, WIRE_CODECS, CONFLATED_TOPICS, PEER_RUNTIME, TOPOLOGY, RELIABLE_CONTROL
 from Middleware.utils import get_ipv4
-from Middleware.message import Message
-from dataclasses import asdict
+from Middleware.message import Message, encode_message, decode_message, negotiate_codec, FALLBACK_CODEC
+from Middleware.dispatcher import MessageDispatcher, INLINE
+from Middleware.runtime import create_runtime
+from Middleware.peer_table import PeerTable
 import time
 import queue
 
+def recv_topic_frames(socket: zmq.Socket):
+    """
+    Receive a topic framed message: the topic in frame 0, the encoded message in frame 1.
+    Only the topic is received as a zmq.Frame, so its "more" flag can be checked without a getsockopt call.
+    The payload is received straight into bytes: for our small payloads that is cheaper than a Frame
+    or a memoryview (see benchmarks/receive_benchmark.py). Its "more" flag isn't checked, an unexpected
+    trailing frame is received as the topic of a message without payload and reported as malformed.
+
+    :return: Tuple of (topic, payload), payload is None if the message has no payload frame.
+    """
+    topic_frame = socket.recv(copy=False)
+    if not topic_frame.more:
+        return topic_frame.bytes, None
+    return topic_frame.bytes, socket.recv()
+
+async def recv_topic_frames_async(socket: zmq.asyncio.Socket):
+    """
+    Same as recv_topic_frames for a zmq.asyncio socket.
+    """
+    topic_frame = await socket.recv(copy=False)
+    if not topic_frame.more:
+        return topic_frame.bytes, None
+    return topic_frame.bytes, await socket.recv()
+
 class Peer:
     def __init__(self, 
                  ip: str = None, 
                  port: int = None, 
-                 on_message_received: callable = lambda: print("Message received")):
-        
-        self.id = uuid.uuid4()
+                 on_message_received: callable = lambda message: print("Message received"),
+                 runtime=PEER_RUNTIME,
+                 logging_service=None,
+                 discovery: callable = None,
+                 peer_id: uuid.UUID = None,
+                 topology: str = TOPOLOGY,
+                 reliable_control: bool = RELIABLE_CONTROL):
+        """
+        Initialize the Peer.
+
+        :param runtime: "thread", "asyncio" or a runtime instance, see Middleware/runtime.py.
+                        All asyncio peers of a process share one event loop.
+        :param logging_service: LoggingService to report to, peers in one process can share one.
+        :param discovery: Called with the peer to create its discovery service, defaults to UDP broadcast discovery.
+        :param peer_id: Fixed peer ID, e.g. for a roster shared between processes. Random by default.
+        :param topology: "mesh" or "star" (state is relayed by the leader), see Middleware/topology.py.
+        :param reliable_control: Acknowledge and retransmit control messages, see Middleware/reliable_channel.py.
+        """
+        self.id = peer_id if peer_id else uuid.uuid4()
         self.bind_port = port if port else random.randint(5000, 6000)
         self.ip = ip if ip else get_ipv4()
         self.on_message_received = on_message_received
-        self.peers = set()  # Set of tuples: (peer_address, peer_id)
+        self.peers = PeerTable()  # Connected peers by ID and address, see Middleware/peer_table.py
+        self.last_seen = {}  # peer_id -> time anything was last received from the peer
         self.is_leader = False
-        self.leader_id = None  # UUID of the current leader
+        self.leader_id = None  # ID of the current leader as str, also when this peer leads
+        self.supported_codecs = list(WIRE_CODECS)  # Advertised in presence messages, in order of preference
+        self.peer_codecs = {}  # peer_id -> codec negotiated with that peer
+
+        # Topics whose messages are conflated: only the newest payload per full topic (e.g. state:<peer_id>) is kept
+        self.conflated_topics = {topic.encode('utf-8') for topic in CONFLATED_TOPICS}
+        self.latest_payloads = {}  # full topic -> newest undelivered payload
+        self.latest_lock = threading.Lock()
+
+        # Endpoints of removed peers, disconnected by the receiver between two messages. Disconnecting a pipe
+        # while a multipart message is half received from it trips an assertion in libzmq's fair queue
+        self.stale_endpoints = queue.SimpleQueue()
+
+        self.sequences = {}  # stream -> counter of the sequence numbers we send on it
+
+        self.runtime = create_runtime(runtime)
+
+        # Messages are routed by type to registered handlers, the rest goes to on_message_received
+        self.dispatcher = MessageDispatcher(fallback=lambda message: self.on_message_received(message),
+                                            runtime=self.runtime)
+
+        if logging_service is None:
+            from Middleware.logging_service import LoggingService
+            logging_service = LoggingService()
+        self.logging_service = logging_service
+        self.logging_service.track_handler_stats(self.dispatcher.collect_stats)
 
         self.setup_zmq()
 
-        from Middleware.logging_service import LoggingService
-        self.logging_service = LoggingService()
+        # Initialize TopologyService, deciding how state messages travel
+        from Middleware.topology import TopologyService
+        self.topology = TopologyService(self, topology)
+
+        # Initialize ReliableChannel, used for election and side messages
+        from Middleware.reliable_channel import ReliableChannel
+        self.control = ReliableChannel(self, reliable_control)
 
         # Initialize DiscoveryService
-        from Middleware.discovery_service import DiscoveryService
-        self.discovery_service = DiscoveryService(self)
+        if discovery is None:
+            from Middleware.discovery_service import DiscoveryService
+            discovery = DiscoveryService
+        self.discovery_service = discovery(self)
 
         # Initialize LeaderSelectionService
         from Middleware.leader_election_service import LeaderSelectionService
         self.leader_service = LeaderSelectionService(self)
 
-    def get_peers(self):
-        return self.peers
+        # Initialize ClockSyncService, messages are stamped with the leader's clock
+        from Middleware.clock_sync import ClockSyncService
+        self.clock_sync = ClockSyncService(self)
+        self.logging_service.attach_clock(self.clock_sync.clock)
+
+    def get_peers(self) -> tuple:
+        """
+        Return a snapshot of the connected peers (PeerEntry), safe to iterate while peers come and go.
+        """
+        return self.peers.snapshot()
 
     def setup_zmq(self):
-        # ZeroMQ context
-        self.context = zmq.Context()
+        # ZeroMQ context, asyncio peers share the process wide asyncio context
+        if self.runtime.is_async:
+            self.context = zmq.asyncio.Context.instance()
+        else:
+            self.context = zmq.Context()
 
         # --- Setup PUB socket for sending messages ---
         self.publisher = self.context.socket(zmq.PUB)
@@ -55,91 +143,324 @@ class Peer:
         # Subscribe to private messages addressed to this peer
         private_topic = f"private:{self.id}"
         self.subscriber.setsockopt_string(zmq.SUBSCRIBE, private_topic)
+        # Subscribe to the high-rate state streams of all peers
+        self.subscriber.setsockopt_string(zmq.SUBSCRIBE, "state")
+        # Subscribe to the world snapshots relayed by the leader in the star topology
+        self.subscriber.setsockopt_string(zmq.SUBSCRIBE, "world")
         self.subscriber.setsockopt(zmq.RCVTIMEO, 10000)
-        
-        # Start the receiver thread
-        receiver_thread = threading.Thread(target=self.receive_message, daemon=True)
-        receiver_thread.start()     
 
-    def add_peer(self, ip: str, port: int, peer_id: str):
+        self.receiving = True  # Cleared by kill, the receiver stops before its socket is closed
+        if self.runtime.is_async:
+            # Start the receiver task on the event loop
+            self.receiver_task = self.runtime.run_coroutine(self.receive_message_async())
+        else:
+            # Start the receiver thread
+            self.receiver_thread = threading.Thread(target=self.receive_message, daemon=True)
+            self.receiver_thread.start()
+
+    def add_peer(self, ip: str, port: int, peer_id: str, codecs: list = None):
         if ip == self.ip and port == self.bind_port: 
             return
 
         peer_address = f"{ip}:{port}"
-        if peer_address not in self.peers:
-            self.subscriber.connect(f"tcp://{ip}:{port}")
-            self.peers.add((peer_address, peer_id))
-            print(f"Node: {str(self.id)[:10]} connected to peer at {ip}:{port} with peer_id {peer_id}")
-        else:
+        known = self.peers.get(peer_id)
+        if known is not None and known.address == peer_address:
             print(f"Node: {str(self.id)[:10]} already connected to peer at {ip}:{port} with peer_id {peer_id}")
+            return
+
+        # A peer restarted on another port, or another peer took over this address
+        for stale in {known, self.peers.get_by_address(peer_address)} - {None}:
+            self.remove_peer(stale.id)
+
+        # Peers that don't advertise codecs only understand JSON
+        self.peer_codecs[peer_id] = negotiate_codec(self.supported_codecs, codecs or [FALLBACK_CODEC])
+
+        if self.peers.add(peer_id, ip, port) is None:
+            return  # Added by another thread in the meantime
+        self.last_seen[peer_id] = time.time()
+        self.runtime.call_soon(self.subscriber.connect, f"tcp://{peer_address}")
+        print(f"Node: {str(self.id)[:10]} connected to peer at {ip}:{port} with peer_id {peer_id}")
+
+    def mark_seen(self, peer_id: str) -> bool:
+        """
+        Record that the peer is alive. Returns False if the peer is unknown, e.g. expired.
+        """
+        if peer_id not in self.last_seen:
+            return False
+        self.last_seen[peer_id] = time.time()
+        return True
+
+    def expired_peers(self, timeout: float) -> list:
+        """
+        Return the IDs of the peers nothing was received from for longer than timeout seconds.
+        """
+        deadline = time.time() - timeout
+        return [peer_id for peer_id, seen in list(self.last_seen.items()) if seen < deadline]
+
+    def remove_peer(self, peer_id: str):
+        """
+        Forget a peer that left: disconnect its PUB endpoint, drop its pending control messages
+        and tell the leader service.
+        """
+        self.last_seen.pop(peer_id, None)
+        self.peer_codecs.pop(peer_id, None)
+        self.control.forget(peer_id)
+        entry = self.peers.remove(peer_id)
+        if entry is None:
+            return
+        self.stale_endpoints.put(f"tcp://{entry.address}")
+        print(f"Node: {str(self.id)[:10]} removed peer {peer_id}")
+        self.leader_service.on_peer_removed(peer_id)
+
+    def disconnect_stale_endpoints(self):
+        """
+        Disconnect the SUB socket from removed peers, called by the receiver between messages.
+        """
+        while not self.stale_endpoints.empty():
+            endpoint = self.stale_endpoints.get()
+            try:
+                self.subscriber.disconnect(endpoint)
+            except zmq.ZMQError as e:
+                print(f"Error disconnecting from {endpoint}: {e}")
+
+    def register_handler(self, msg_type: str, function: callable, executor: str = INLINE, queue_name: str = None):
+        """
+        Register the handler for a message type.
+
+        :param msg_type: Message type to handle.
+        :param function: Called with the Message.
+        :param executor: "inline" (receiver thread), "queue" (dedicated thread per queue_name, in order)
+                         or "pool" (shared thread pool).
+        :param queue_name: Queue shared by handlers that must run in order, defaults to the message type.
+        """
+        self.dispatcher.register(msg_type, function, executor, queue_name)
+
+    def get_public_codec(self) -> str:
+        """
+        Public messages reach every peer, so use our preferred codec only if all peers negotiated it.
+        """
+        codecs = set(self.peer_codecs.values())
+        if len(codecs) == 1:
+            return codecs.pop()
+        return FALLBACK_CODEC if codecs else self.supported_codecs[0]
 
     # Use the publisher socket to send messages to other peers
     def send_public_message(self, message: Message):
-        self.logging_service.on_message_sent(message)
-        serialized_message = message.to_json()
-        topic = "public"
-        full_message = f"{topic} {serialized_message}"
-        self.publisher.send_string(full_message)
+        message.seq = self.next_sequence("public")
+        self.logging_service.stamp_send_time(message)
+        serialized_message = encode_message(message, self.get_public_codec())
+        topic = b"public"
+        self.logging_service.on_message_sent(message, len(topic) + len(serialized_message))
+        self.send_frames([topic, serialized_message])
+
+    # Use the publisher socket to send state snapshots on this peer's own state topic,
+    # so receivers can conflate them per sender without decoding.
+    # In the star topology the snapshot goes to the leader's relay instead
+    def send_state_message(self, message: Message):
+        message.seq = self.next_sequence("state")
+        self.logging_service.stamp_send_time(message)
+        serialized_message = encode_message(message, self.get_public_codec())
+        topic = f"state:{self.id}".encode('utf-8')
+        self.logging_service.on_message_sent(message, len(topic) + len(serialized_message))
+        if not self.topology.send_state(topic, serialized_message):
+            self.send_frames([topic, serialized_message])
+
+    def set_topic_conflation(self, topic: str, enabled: bool = True):
+        """
+        Enable or disable latest-value conflation for a topic (the part before the first ':').
+        Conflated messages are not delivered by the receiver thread, only the newest one per
+        sender is kept until the application calls drain_latest.
+        """
+        topic = topic.encode('utf-8')
+        if enabled:
+            self.conflated_topics.add(topic)
+        else:
+            self.conflated_topics.discard(topic)
+            self.drain_latest()
+
+    def store_latest(self, topic: bytes, payload: bytes):
+        """
+        Keep only the newest payload per full topic, counting the ones replaced before being drained.
+        """
+        with self.latest_lock:
+            replaced_payload = self.latest_payloads.get(topic)
+            self.latest_payloads[topic] = payload
+        if replaced_payload is not None:
+            self.logging_service.on_message_conflated(len(topic) + len(replaced_payload), topic)
+
+    def drain_latest(self):
+        """
+        Decode and deliver the newest message of every conflated stream.
+        Meant to be called from the application loop, e.g. once per game tick.
+        """
+        with self.latest_lock:
+            if not self.latest_payloads:
+                return
+            latest_payloads = self.latest_payloads
+            self.latest_payloads = {}
+
+        for topic, payload in latest_payloads.items():
+            message = decode_message(payload)
+            if message is None:
+                self.logging_service.increment_error_count()
+                continue
+            self.logging_service.on_message_received(message, len(topic) + len(payload), topic)
+            self.dispatcher.dispatch(message)
 
     # Use the publisher socket to send private messages
     def send_private_message(self, peer_id: str, message: Message):
-        self.logging_service.on_message_sent(message)
-        topic = f"private:{peer_id}"
-        serialized_message = message.to_json()
-        full_message = f"{topic} {serialized_message}"
+        message.seq = self.next_sequence(f"private:{peer_id}")
+        self.logging_service.stamp_send_time(message)
+        topic = f"private:{peer_id}".encode('utf-8')
+        serialized_message = encode_message(message, self.peer_codecs.get(peer_id, FALLBACK_CODEC))
+        self.logging_service.on_message_sent(message, len(topic) + len(serialized_message))
         print(f"Node: {str(self.id)[:10]} sending private message to peer_id {peer_id}")
-        self.publisher.send_string(full_message)
+        self.send_frames([topic, serialized_message])
+
+    def next_sequence(self, stream: str) -> int:
+        """
+        Return the next sequence number of a stream, receivers count its gaps and late arrivals.
+        Each receiver sees all of our public and state messages but only its own private ones,
+        so private messages are numbered per receiver.
+        """
+        counter = self.sequences.get(stream)
+        if counter is None:
+            counter = self.sequences.setdefault(stream, itertools.count(1))
+        return next(counter)  # Atomic, messages are sent from several threads
+
+    def send_frames(self, frames: list):
+        """
+        Publish a multipart message. Asyncio sockets are only used from the event loop,
+        so the blocking send API stays a thin wrapper that hands the frames to the loop.
+        """
+        if self.runtime.is_async:
+            self.runtime.call_soon(self.publish_frames_async, frames)
+        else:
+            self.publisher.send_multipart(frames)
+
+    def publish_frames_async(self, frames: list):
+        # Runs on the event loop. A send still waiting when the peer is killed fails once the socket closes
+        if self.publisher.closed:
+            return
+        self.publisher.send_multipart(frames).add_done_callback(self.check_async_send)
+
+    def check_async_send(self, future):
+        if future.cancelled() or self.publisher.closed:
+            return
+        if future.exception() is not None:
+            print(f"Error sending message: {future.exception()}")
+            self.logging_service.increment_error_count()
 
     # Use the subscriber socket to receive messages from other peers
     def receive_message(self):
         poller = zmq.Poller()
         poller.register(self.subscriber, zmq.POLLIN)
         
-        while True:
+        while self.receiving:
             try:
                 socks = dict(poller.poll(POLL_RATE))  # Adjust POLL_RATE as needed
 
                 if self.subscriber in socks and socks[self.subscriber] == zmq.POLLIN:
-                    raw_message = self.subscriber.recv_string()
-                    # Split the message into topic and content
-                    try:
-                        topic, message_json = raw_message.split(' ', 1)
-                    except ValueError:
-                        print(f"Received malformed message: {raw_message}")
-                        self.logging_service.increment_error_count()
-                        continue
-
-                    message = Message.from_json(message_json)
-                    if message is None:
-                        self.logging_service.increment_error_count()
-                        continue
-
-                    self.logging_service.on_message_received(message)
-
-                    # Handle the message based on its type
-                    if message.type in ["election", "answer", "coordinator", "heartbeat"]:
-                        self.leader_service.receive_leader_message_queue.put(message)
-                    else:
-                        self.on_message_received(message)
-                        #print(f"Node: {str(self.id)[:10]} received message: {message}")
+                    # Subscriptions filter on the topic frame, the payload frame goes to the decoder as is
+                    topic, payload = recv_topic_frames(self.subscriber)
+                    self.handle_frames(topic, payload)
+                self.disconnect_stale_endpoints()
 
             except zmq.Again:
                 # Timeout occurred, can perform other tasks or simply continue
                 continue
+            except zmq.ContextTerminated:
+                return
             except Exception as e: 
                 print(f"Error receiving message: {e}")
                 self.logging_service.increment_error_count()
 
+    async def receive_message_async(self):
+        while self.receiving and not self.subscriber.closed:
+            try:
+                topic, payload = await recv_topic_frames_async(self.subscriber)
+                if not self.receiving:
+                    return
+                self.handle_frames(topic, payload)
+                self.disconnect_stale_endpoints()
+            except (zmq.ContextTerminated, zmq.ZMQError) as e:
+                if self.subscriber.closed:
+                    return
+                print(f"Error receiving message: {e}")
+                self.logging_service.increment_error_count()
+            except Exception as e:
+                print(f"Error receiving message: {e}")
+                self.logging_service.increment_error_count()
+
+    def handle_frames(self, topic: bytes, payload: bytes):
+        """
+        Handle a message received on a socket, unpacking world snapshots of the star topology.
+        """
+        if payload is None:
+            print(f"Received malformed message on topic: {topic}")
+            self.logging_service.increment_error_count()
+            return
+
+        if topic == b"world":
+            self.topology.handle_world(payload)
+            return
+
+        self.deliver_frames(topic, payload)
+
+    def deliver_frames(self, topic: bytes, payload: bytes):
+        """
+        Decode and dispatch a received message, or keep it for drain_latest if its topic is conflated.
+        """
+        # High-rate state streams are only decoded when the application drains them
+        prefix, _, sender_id = topic.partition(b':')  # Split once, for the conflation check and the sender
+        if prefix in self.conflated_topics:
+            self.mark_seen(sender_id.decode('utf-8', 'replace'))
+            self.store_latest(topic, payload)
+            return
+
+        message = decode_message(payload)
+        if message is None:
+            self.logging_service.increment_error_count()
+            return
+        self.mark_seen(message.id)
+
+        self.logging_service.on_message_received(message, len(topic) + len(payload), topic)
+
+        # Handle the message based on its type
+        self.dispatcher.dispatch(message)
+
     def get_peer_by_id(self, peer_id: str):
-        for peer in self.peers:
-            if peer[1] == peer_id:
-                return peer
-        return None
+        return self.peers.get(peer_id)
+
+    def stop_receiver(self):
+        """
+        Stop the receiver and wait for it to return, so it is no longer using the subscriber.
+        """
+        self.receiving = False
+        if self.runtime.is_async:
+            # Closing the subscriber on the loop cancels the pending receive, ending the receiver task
+            self.runtime.call_soon(self.subscriber.close)
+            if not self.runtime.in_runtime_thread():
+                concurrent.futures.wait([self.receiver_task], timeout=POLL_RATE / 1000)
+        elif threading.current_thread() is not self.receiver_thread:
+            # The receiver polls with a timeout, it sees the cleared flag within POLL_RATE
+            self.receiver_thread.join()
 
     def kill(self):
-        self.publisher.close()
-        self.subscriber.close()
-        self.context.term()
+        self.leader_service.shutdown()
+        self.clock_sync.shutdown()
+        self.control.shutdown()
+        # Stop receiving first, nothing is dispatched once the dispatcher and the sockets are gone
+        self.stop_receiver()
+        self.topology.close()
+        if self.runtime.is_async:
+            # The asyncio context is shared with the other peers of the process, only close our sockets
+            self.runtime.call_soon(self.publisher.close)
+        else:
+            self.publisher.close()
+            self.subscriber.close()
+            self.context.term()
+        self.dispatcher.shutdown()
         self.discovery_service.stop_discovery()
         self.logging_service.kill()
         print(f"{self.id} shut down successfully.")
@@ -0,0 +1,112 @@
+import bisect
+import threading
+from dataclasses import dataclass
+from typing import Optional
+from Middleware.utils import uuid_to_number
+
+'''
+Peer Table
+    - The peers a Peer is connected to, indexed by peer ID and by address ("ip:port")
+    - Every entry holds the integer of its UUID, compared by the leader election, and a player slot:
+      the smallest slot free when the peer was added, kept until it is removed
+    - The entries are also kept sorted by UUID integer, so the peers above an ID are found with a bisect
+    - Changes are made under a lock, readers iterate over an immutable snapshot that is replaced
+      on every change, so iterating never races with discovery adding or expiring peers
+'''
+
+@dataclass(frozen=True)
+class PeerEntry:
+    id: str
+    ip: str
+    port: int
+    number: int  # uuid_to_number(id), a hash of the ID for IDs that aren't UUIDs
+    slot: int  # Player slot, starting at 1
+
+    @property
+    def address(self) -> str:
+        return f"{self.ip}:{self.port}"
+
+class PeerTable:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_id = {}  # peer_id -> PeerEntry
+        self.by_address = {}  # "ip:port" -> PeerEntry
+        self.entries = ()  # Snapshot of all entries, in the order they were added
+        self.ordered = ((), ())  # Snapshot of (UUID integers, entries), both sorted by UUID integer
+
+    def add(self, peer_id: str, ip: str, port: int) -> Optional[PeerEntry]:
+        """
+        Add a peer. Peers already known by ID or address have to be removed first.
+
+        Returns:
+        - PeerEntry: The new entry, None if the ID or the address is already in the table.
+
+        Raises:
+        - TypeError: If peer_id isn't a str, UUID or int (see uuid_to_number).
+        """
+        address = f"{ip}:{port}"
+        with self.lock:
+            if peer_id in self.by_id or address in self.by_address:
+                return None
+            used_slots = {entry.slot for entry in self.entries}
+            slot = 1
+            while slot in used_slots:
+                slot += 1
+            entry = PeerEntry(id=peer_id, ip=ip, port=int(port), number=uuid_to_number(peer_id), slot=slot)
+            self.by_id[peer_id] = entry
+            self.by_address[address] = entry
+            self.entries = self.entries + (entry,)
+            numbers, ordered = self.ordered
+            index = bisect.bisect_right(numbers, entry.number)
+            self.ordered = (numbers[:index] + (entry.number,) + numbers[index:],
+                            ordered[:index] + (entry,) + ordered[index:])
+        return entry
+
+    def remove(self, peer_id: str) -> Optional[PeerEntry]:
+        """
+        Remove a peer, its slot is free for the next peer added. Returns the removed entry, if any.
+        """
+        with self.lock:
+            entry = self.by_id.pop(peer_id, None)
+            if entry is None:
+                return None
+            self.by_address.pop(entry.address, None)
+            self.entries = tuple(other for other in self.entries if other is not entry)
+            numbers, ordered = self.ordered
+            index = bisect.bisect_left(numbers, entry.number)
+            while ordered[index].id != entry.id:
+                index += 1  # Hashed IDs can share a number with another entry
+            self.ordered = (numbers[:index] + numbers[index + 1:], ordered[:index] + ordered[index + 1:])
+        return entry
+
+    def get(self, peer_id: str) -> Optional[PeerEntry]:
+        return self.by_id.get(peer_id)
+
+    def get_by_address(self, address: str) -> Optional[PeerEntry]:
+        return self.by_address.get(address)
+
+    def higher_than(self, number: int) -> tuple:
+        """
+        Return the entries whose UUID integer is above number, lowest first.
+        """
+        numbers, ordered = self.ordered
+        return ordered[bisect.bisect_right(numbers, number):]
+
+    def highest(self) -> Optional[PeerEntry]:
+        ordered = self.ordered[1]
+        return ordered[-1] if ordered else None
+
+    def snapshot(self) -> tuple:
+        """
+        Return all entries as an immutable tuple, not affected by later changes.
+        """
+        return self.entries
+
+    def __contains__(self, peer_id: str) -> bool:
+        return peer_id in self.by_id
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
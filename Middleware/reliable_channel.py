@@ -0,0 +1,154 @@
+import threading
+import time
+from properties import CONTROL_RETRY_INITIAL, CONTROL_RETRY_MAX, CONTROL_MAX_ATTEMPTS, CONTROL_RETRY_CHECK
+from Middleware.peer import Peer
+from Middleware.message import Message
+
+'''
+Reliable Control Channel
+    - Control messages (election, answer, coordinator, side) are sent as private "control" messages on
+      the PUB socket, wrapping the original message with a sequence number per receiver
+    - The receiver answers every control message with a cumulative "control_ack" of the highest sequence
+      number it delivered in order, and delivers the wrapped messages in order through the peer's dispatcher,
+      dropping duplicates and holding back messages that overtook a lost one
+    - Unacknowledged messages are resent after CONTROL_RETRY_INITIAL seconds, doubling up to CONTROL_RETRY_MAX,
+      at most CONTROL_MAX_ATTEMPTS times. This covers the slow joiner: a PUB socket drops messages for a
+      subscriber whose connection isn't up yet
+    - After the last attempt the message is given up. Every control message carries the oldest sequence number
+      the sender is still trying to deliver, so the receiver skips the given up ones instead of waiting forever
+    - A removed peer is forgotten: its unacknowledged messages are dropped and its receive state reset.
+      Sequence numbers sent to it keep counting, so a peer that only expired on our side and still
+      expects the next number doesn't take new messages for duplicates
+    - With reliable=False (Peer(reliable_control=False)) messages go out once as plain private messages
+'''
+
+class ReliableChannel:
+    def __init__(self, peer: 'Peer', reliable: bool = True):
+        """
+        Initialize the ReliableChannel.
+
+        :param peer: Instance of the Peer class.
+        :param reliable: Acknowledge and retransmit control messages, False to send them once.
+        """
+        self.peer = peer
+        self.reliable = reliable
+        self.lock = threading.Lock()
+        self.next_sequence = {}  # receiver id -> next sequence number to send
+        self.unacked = {}  # receiver id -> {sequence: [control message, attempts, retry delay, next retry time]}
+        self.expected = {}  # sender id -> next sequence number to deliver
+        self.held_back = {}  # sender id -> {sequence: wrapped message} received ahead of a missing one
+
+        self.peer.register_handler("control", self.handle_control_message)
+        self.peer.register_handler("control_ack", self.handle_control_ack)
+        self.retry_timer = self.peer.runtime.call_every(CONTROL_RETRY_CHECK, self.retransmit) if reliable else None
+
+    def send(self, peer_id: str, message: Message):
+        """
+        Send a message to a peer reliably and in order with the other control messages to that peer.
+        """
+        if not self.reliable:
+            self.peer.send_private_message(peer_id, message)
+            return
+        with self.lock:
+            sequence = self.next_sequence.get(peer_id, 1)
+            self.next_sequence[peer_id] = sequence + 1
+            pending = self.unacked.setdefault(peer_id, {})
+            control_message = Message(
+                id=str(self.peer.id),
+                type="control",
+                data={
+                    "seq": sequence,
+                    "message": {"type": message.type, "data": message.data, "msg_id": message.msg_id}
+                }
+            )
+            pending[sequence] = [control_message, 1, CONTROL_RETRY_INITIAL, time.time() + CONTROL_RETRY_INITIAL]
+            control_message.data["first"] = min(pending)
+        self.peer.send_private_message(peer_id, control_message)
+
+    def retransmit(self):
+        """
+        Resend the control messages whose acknowledgement is overdue, called every CONTROL_RETRY_CHECK seconds.
+        """
+        now = time.time()
+        resend = []
+        with self.lock:
+            for peer_id, pending in self.unacked.items():
+                for sequence in sorted(pending):
+                    entry = pending[sequence]
+                    if entry[3] > now:
+                        continue
+                    if entry[1] >= CONTROL_MAX_ATTEMPTS:
+                        print(f"Node: {str(self.peer.id)[:10]} gave up sending {entry[0].data['message']['type']} "
+                              f"to {peer_id} after {entry[1]} attempts")
+                        del pending[sequence]
+                        continue
+                    entry[1] += 1
+                    entry[2] = min(entry[2] * 2, CONTROL_RETRY_MAX)
+                    entry[3] = now + entry[2]
+                    resend.append((peer_id, entry[0]))
+                if pending:
+                    first = min(pending)
+                    for entry in pending.values():
+                        entry[0].data["first"] = first
+        for peer_id, control_message in resend:
+            self.peer.send_private_message(peer_id, control_message)
+
+    def handle_control_message(self, message: Message):
+        sender_id = message.id
+        sequence = message.data.get("seq")
+        wrapped = message.data.get("message")
+        if sequence is None or wrapped is None:
+            return
+
+        deliver = []
+        with self.lock:
+            # Sequence numbers below "first" were given up by the sender
+            expected = max(self.expected.get(sender_id, 1), message.data.get("first", 1))
+            held_back = self.held_back.setdefault(sender_id, {})
+            if sequence >= expected:
+                held_back[sequence] = wrapped
+            for skipped in [held for held in held_back if held < expected]:
+                del held_back[skipped]  # Never delivered, its predecessor was given up
+            while expected in held_back:
+                deliver.append(held_back.pop(expected))
+                expected += 1
+            self.expected[sender_id] = expected
+
+        ack_message = Message(
+            id=str(self.peer.id),
+            type="control_ack",
+            data={"ack": expected - 1}
+        )
+        self.peer.send_private_message(sender_id, ack_message)
+
+        for wrapped in deliver:
+            self.peer.dispatcher.dispatch(Message(
+                id=sender_id,
+                type=wrapped["type"],
+                data=wrapped["data"],
+                msg_id=wrapped.get("msg_id"),
+                send_timestamp=message.send_timestamp,
+                receive_timestamp=message.receive_timestamp
+            ))
+
+    def handle_control_ack(self, message: Message):
+        acknowledged = message.data.get("ack", 0)
+        with self.lock:
+            pending = self.unacked.get(message.id)
+            if not pending:
+                return
+            for sequence in [sequence for sequence in pending if sequence <= acknowledged]:
+                del pending[sequence]
+
+    def forget(self, peer_id: str):
+        """
+        Drop the pending messages and receive state of a peer that was removed.
+        """
+        with self.lock:
+            self.unacked.pop(peer_id, None)
+            self.expected.pop(peer_id, None)
+            self.held_back.pop(peer_id, None)
+
+    def shutdown(self):
+        if self.retry_timer is not None:
+            self.retry_timer.cancel()
@@ -0,0 +1,198 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from typing import Union
+
+'''
+Peer Runtimes
+    - Decide where the periodic and delayed work of a Peer and its services runs
+    - ThreadRuntime: the default, periodic and delayed tasks of all peers in the process run on one
+      TimerScheduler thread, which sleeps until the earliest deadline in a heap of timers.
+      Timer callbacks are short (sends and bookkeeping), handlers that take longer run on the dispatcher
+    - AsyncRuntime: a single asyncio event loop on one background thread, shared by any number
+      of peers in the process. Periodic tasks and timeouts are loop timers instead of sleeping threads,
+      sockets are zmq.asyncio sockets and discovery uses an asyncio datagram endpoint
+'''
+
+THREAD = "thread"
+ASYNCIO = "asyncio"
+
+class ThreadTimer:
+    def __init__(self, scheduler: 'TimerScheduler', interval: float, function: callable, args: tuple, repeat: bool):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.function = function
+        self.args = args
+        self.repeat = repeat
+        self.cancelled = False
+        scheduler.schedule(self, time.monotonic() + interval)
+
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            self.function(*self.args)
+        except Exception as e:
+            print(f"Error in timer {getattr(self.function, '__name__', self.function)}: {e}")
+        if self.repeat and not self.cancelled:
+            self.scheduler.schedule(self, time.monotonic() + self.interval)
+
+    def cancel(self):
+        # Left in the heap, the scheduler skips it when it is due
+        self.cancelled = True
+
+class TimerScheduler:
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.timers = []  # Heap of (deadline, order, timer)
+        self.order = itertools.count()  # Keeps timers with the same deadline in scheduling order
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def shared(cls) -> 'TimerScheduler':
+        """
+        Return the scheduler shared by all thread runtimes of the process.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = TimerScheduler()
+            return cls._shared
+
+    def schedule(self, timer: ThreadTimer, deadline: float):
+        with self.condition:
+            heapq.heappush(self.timers, (deadline, next(self.order), timer))
+            if self.timers[0][2] is timer:
+                self.condition.notify()  # Wake up earlier than planned
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.timers:
+                    self.condition.wait()
+                deadline, _, timer = self.timers[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.timers)
+            timer.run()
+
+class ThreadRuntime:
+    is_async = False
+
+    def __init__(self):
+        self.scheduler = TimerScheduler.shared()
+
+    def call_later(self, delay: float, function: callable, *args) -> ThreadTimer:
+        """
+        Call function once after delay seconds, returns a handle with cancel().
+        """
+        return ThreadTimer(self.scheduler, delay, function, args, repeat=False)
+
+    def call_every(self, interval: float, function: callable, *args) -> ThreadTimer:
+        """
+        Call function every interval seconds (first call after one interval), returns a handle with cancel().
+        """
+        return ThreadTimer(self.scheduler, interval, function, args, repeat=True)
+
+    def call_soon(self, function: callable, *args):
+        # There is no loop to hand the call to, run it on the calling thread
+        function(*args)
+
+    def in_runtime_thread(self) -> bool:
+        return True
+
+class AsyncTimer:
+    def __init__(self, runtime: 'AsyncRuntime', interval: float, function: callable, args: tuple, repeat: bool):
+        self.runtime = runtime
+        self.interval = interval
+        self.function = function
+        self.args = args
+        self.repeat = repeat
+        self.cancelled = False
+        self.handle = None
+        runtime.call_soon(self.schedule)
+
+    def schedule(self):
+        if not self.cancelled:
+            self.handle = self.runtime.loop.call_later(self.interval, self.run)
+
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            self.function(*self.args)
+        except Exception as e:
+            print(f"Error in timer {getattr(self.function, '__name__', self.function)}: {e}")
+        if self.repeat:
+            self.schedule()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.handle is not None:
+            self.runtime.call_soon(self.handle.cancel)
+
+class AsyncRuntime:
+    is_async = True
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def shared(cls) -> 'AsyncRuntime':
+        """
+        Return the event loop runtime shared by all peers of the process.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = AsyncRuntime()
+            return cls._shared
+
+    def call_later(self, delay: float, function: callable, *args) -> AsyncTimer:
+        return AsyncTimer(self, delay, function, args, repeat=False)
+
+    def call_every(self, interval: float, function: callable, *args) -> AsyncTimer:
+        return AsyncTimer(self, interval, function, args, repeat=True)
+
+    def call_soon(self, function: callable, *args):
+        """
+        Run function on the event loop, in call order. Safe to call from any thread.
+        """
+        if self.in_runtime_thread():
+            self.loop.call_soon(function, *args)
+        else:
+            self.loop.call_soon_threadsafe(function, *args)
+
+    def run_coroutine(self, coroutine):
+        """
+        Schedule a coroutine on the event loop, returns a concurrent.futures.Future.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def in_runtime_thread(self) -> bool:
+        return threading.current_thread() is self.thread
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+def create_runtime(runtime) -> Union[ThreadRuntime, AsyncRuntime]:
+    """
+    Return a runtime instance for a runtime name ("thread" or "asyncio") or an existing runtime.
+    """
+    if runtime is None or runtime == THREAD:
+        return ThreadRuntime()
+    if runtime == ASYNCIO:
+        return AsyncRuntime.shared()
+    if isinstance(runtime, (ThreadRuntime, AsyncRuntime)):
+        return runtime
+    raise ValueError(f"Unknown runtime: {runtime}")
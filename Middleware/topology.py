@@ -0,0 +1,253 @@
+import struct
+import threading
+import concurrent.futures
+import zmq
+import zmq.asyncio
+from properties import TOPOLOGY, RELAY_PORT_OFFSET, POLL_RATE
+from Middleware.peer import Peer
+
+'''
+Peer Topologies
+    - mesh: the default, every peer publishes its state on its own PUB socket and every SUB socket
+      is connected to every other peer, so each state message is sent N-1 times and received N-1 times per peer
+    - star: every peer binds a ROUTER relay socket next to its PUB socket. Non-leaders send their state
+      only to the relay of the elected leader through a DEALER socket. Once per tick the leader publishes
+      one world snapshot with the newest state of every peer, including its own
+    - The world snapshot packs the original (topic, payload) pairs, so receivers hand them to the
+      same conflation and decoding path as mesh state messages and keep the original send timestamps
+    - The uplink follows the leader: it is reconnected when the leader service reports a new leader.
+      Without a known leader, state is published on the mesh
+    - Control messages (discovery, election, heartbeats, private messages) always use the mesh
+'''
+
+MESH = "mesh"
+STAR = "star"
+
+WORLD_TOPIC = b"world"
+WORLD_ENTRY = struct.Struct("!HI")  # topic length, payload length
+
+def pack_world(entries: dict) -> bytes:
+    """
+    Pack a world snapshot from a dict of full state topic -> encoded state message.
+    """
+    parts = []
+    for topic, payload in entries.items():
+        parts.append(WORLD_ENTRY.pack(len(topic), len(payload)))
+        parts.append(topic)
+        parts.append(payload)
+    return b"".join(parts)
+
+def unpack_world(world: bytes):
+    """
+    Yield the (topic, payload) pairs of a packed world snapshot.
+    """
+    offset = 0
+    while offset < len(world):
+        topic_length, payload_length = WORLD_ENTRY.unpack_from(world, offset)
+        offset += WORLD_ENTRY.size
+        topic = world[offset:offset + topic_length]
+        offset += topic_length
+        yield topic, world[offset:offset + payload_length]
+        offset += payload_length
+
+class TopologyService:
+    def __init__(self, peer: 'Peer', mode: str = TOPOLOGY):
+        """
+        Initialize the TopologyService.
+
+        :param peer: Instance of the Peer class.
+        :param mode: "mesh" or "star".
+        """
+        if mode not in (MESH, STAR):
+            raise ValueError(f"Unknown topology: {mode}")
+
+        self.peer = peer
+        self.mode = mode
+        self.relay_leader_id = None  # Leader whose relay the uplink is connected to
+        self.relay_address = None
+        self.world_entries = {}  # Leader only: full state topic -> newest state payload since the last world snapshot
+        self.world_lock = threading.Lock()
+        self.uplink_lock = threading.Lock()  # The uplink is used by the game loop and the leader queue
+        self.own_topic = f"state:{self.peer.id}".encode('utf-8')
+
+        if self.mode == STAR:
+            self.setup_relay()
+
+    def setup_relay(self):
+        # --- Setup ROUTER socket receiving the state of the other peers while this peer is the leader ---
+        self.relay = self.peer.context.socket(zmq.ROUTER)
+        self.relay.bind(f"tcp://*:{self.peer.bind_port + RELAY_PORT_OFFSET}")
+
+        # --- Setup DEALER socket sending this peer's state to the leader ---
+        self.uplink = self.peer.context.socket(zmq.DEALER)
+        self.uplink.setsockopt(zmq.LINGER, 0)
+        self.uplink.setsockopt(zmq.SNDHWM, 10)  # State is superseded quickly, don't queue for a dead leader
+
+        self.relaying = True  # Cleared by close, the relay receiver stops before its socket is closed
+        if self.peer.runtime.is_async:
+            self.relay_task = self.peer.runtime.run_coroutine(self.receive_relay_async())
+        else:
+            self.relay_thread = threading.Thread(target=self.receive_relay, daemon=True)
+            self.relay_thread.start()
+
+    def is_star(self) -> bool:
+        return self.mode == STAR
+
+    def on_leader_changed(self, leader_id):
+        """
+        Point the uplink at the relay of the new leader. Called by the leader service.
+
+        :param leader_id: ID of the new leader, as str or UUID.
+        """
+        if self.mode != STAR:
+            return
+        leader_id = str(leader_id)
+        if leader_id == self.relay_leader_id:
+            return
+
+        with self.world_lock:
+            self.world_entries = {}
+
+        relay_address = None
+        if leader_id != str(self.peer.id):
+            peer_info = self.peer.get_peer_by_id(leader_id)
+            if peer_info is None:
+                print(f"Node: {str(self.peer.id)[:10]} doesn't know leader {leader_id} yet, staying on the mesh.")
+                return
+            relay_address = f"tcp://{peer_info.ip}:{peer_info.port + RELAY_PORT_OFFSET}"
+
+        self.peer.runtime.call_soon(self.connect_uplink, relay_address)
+        self.relay_leader_id = leader_id
+        print(f"Node: {str(self.peer.id)[:10]} switched star topology to leader {leader_id}.")
+
+    def connect_uplink(self, relay_address: str):
+        with self.uplink_lock:
+            if self.relay_address is not None:
+                self.uplink.disconnect(self.relay_address)
+            if relay_address is not None:
+                self.uplink.connect(relay_address)
+            self.relay_address = relay_address
+
+    def send_state(self, topic: bytes, payload: bytes) -> bool:
+        """
+        Send an encoded state message along the star topology.
+
+        :return: False if the message has to be published on the mesh instead.
+        """
+        if self.mode != STAR or self.relay_leader_id is None:
+            return False
+
+        if self.relay_leader_id == str(self.peer.id):
+            self.publish_world(topic, payload)
+        elif self.peer.runtime.is_async:
+            self.peer.runtime.call_soon(self.send_uplink, topic, payload)
+        else:
+            self.send_uplink(topic, payload)
+        return True
+
+    def send_uplink(self, topic: bytes, payload: bytes):
+        with self.uplink_lock:
+            if self.relay_address is None:
+                return
+            try:
+                self.uplink.send_multipart([topic, payload], flags=zmq.NOBLOCK)
+            except zmq.Again:
+                pass  # Relay unreachable, the next state supersedes this one anyway
+
+    def publish_world(self, topic: bytes, payload: bytes):
+        """
+        Publish the leader's own state together with the newest state received from every other peer.
+        """
+        with self.world_lock:
+            entries = self.world_entries
+            self.world_entries = {}
+        entries[topic] = payload
+        self.peer.send_frames([WORLD_TOPIC, pack_world(entries)])
+
+    def store_world_entry(self, topic: bytes, payload: bytes):
+        with self.world_lock:
+            replaced_payload = self.world_entries.get(topic)
+            self.world_entries[topic] = payload
+        if replaced_payload is not None:
+            # Superseded before the next world snapshot, the other peers never see it
+            self.peer.logging_service.on_message_conflated(len(replaced_payload))
+
+    def handle_world(self, world: bytes):
+        """
+        Deliver the state messages of a world snapshot, except our own.
+        """
+        try:
+            entries = list(unpack_world(world))
+        except struct.error as e:
+            print(f"Received malformed world snapshot: {e}")
+            self.peer.logging_service.increment_error_count()
+            return
+        for topic, payload in entries:
+            if topic != self.own_topic:
+                self.peer.deliver_frames(topic, payload)
+
+    def handle_relay_frames(self, frames: list):
+        # ROUTER frames: sender identity, topic, payload
+        if len(frames) != 3:
+            print(f"Received malformed relay message with {len(frames)} frames")
+            self.peer.logging_service.increment_error_count()
+            return
+        _, topic, payload = frames
+        if self.relay_leader_id != str(self.peer.id):
+            return  # Sent before the sender learned about the new leader
+        self.store_world_entry(topic, payload)
+        self.peer.handle_frames(topic, payload)
+
+    def receive_relay(self):
+        poller = zmq.Poller()
+        poller.register(self.relay, zmq.POLLIN)
+
+        while self.relaying:
+            try:
+                socks = dict(poller.poll(POLL_RATE))
+                if self.relay in socks and socks[self.relay] == zmq.POLLIN:
+                    self.handle_relay_frames(self.relay.recv_multipart())
+            except zmq.ContextTerminated:
+                return
+            except zmq.ZMQError as e:
+                if self.relay.closed:
+                    return
+                print(f"Error receiving relay message: {e}")
+            except Exception as e:
+                print(f"Error receiving relay message: {e}")
+                self.peer.logging_service.increment_error_count()
+
+    async def receive_relay_async(self):
+        while self.relaying and not self.relay.closed:
+            try:
+                frames = await self.relay.recv_multipart()
+                if not self.relaying:
+                    return
+                self.handle_relay_frames(frames)
+            except (zmq.ContextTerminated, zmq.ZMQError) as e:
+                if self.relay.closed:
+                    return
+                print(f"Error receiving relay message: {e}")
+            except Exception as e:
+                print(f"Error receiving relay message: {e}")
+                self.peer.logging_service.increment_error_count()
+
+    def close(self):
+        """
+        Close the relay sockets, before the context of the peer is terminated.
+        """
+        if self.mode != STAR:
+            return
+        self.relaying = False
+        if self.peer.runtime.is_async:
+            # Closing the relay on the loop cancels the pending receive, ending the relay task
+            self.peer.runtime.call_soon(self.relay.close)
+            self.peer.runtime.call_soon(self.uplink.close)
+            if not self.peer.runtime.in_runtime_thread():
+                concurrent.futures.wait([self.relay_task], timeout=POLL_RATE / 1000)
+        else:
+            if threading.current_thread() is not self.relay_thread:
+                self.relay_thread.join()
+            with self.uplink_lock:
+                self.uplink.close()
+            self.relay.close(linger=0)
@@ -1,7 +1,9 @@
 import socket
+import ipaddress
 import psutil
 import os
 import uuid
+import hashlib
 
 def validate_ip_port(input_str):
     """Checks if the ip port is within the specified range."""
@@ -37,10 +39,33 @@ def get_ipv4():
         return ipaddr
     return None
 
-def get_broadcast_address():
-    local_ip = get_ipv4()
-    subnet = '.'.join(local_ip.split('.')[:3]) + '.255'
-    return subnet
+def get_interface(interface: str = None, ip: str = None):
+    """
+    Find an IPv4 interface by name (e.g. "eth0") or address, or the interface holding ip.
+
+    Returns:
+    tuple: (interface name, IPv4 address, netmask), or None if there is no such interface.
+    """
+    for name, addresses in psutil.net_if_addrs().items():
+        for address in addresses:
+            if address.family != socket.AF_INET:
+                continue
+            if interface is not None and interface in (name, address.address):
+                return name, address.address, address.netmask
+            if interface is None and address.address == ip:
+                return name, address.address, address.netmask
+    return None
+
+def get_broadcast_address(ip: str = None):
+    """
+    Broadcast address of the subnet of ip (default: get_ipv4()), computed from the netmask of its interface.
+    Falls back to the limited broadcast address 255.255.255.255 if the interface isn't found.
+    """
+    local_ip = ip or get_ipv4()
+    interface = get_interface(ip=local_ip)
+    if interface is None or not interface[2]:
+        return '255.255.255.255'
+    return str(ipaddress.IPv4Network(f"{local_ip}/{interface[2]}", strict=False).broadcast_address)
 
 def uuid_to_number(input_val):
     """
@@ -48,9 +73,14 @@ def uuid_to_number(input_val):
     
     Args:
     input_val: The input value to convert. It can be a UUID string, UUID object, or an integer.
+    Other strings are valid peer IDs too, they are mapped to the first 128 bits of their SHA-1 hash,
+    so every peer computes the same number for them.
     
     Returns:
     int: The integer representation of the UUID, or the input itself if it's already an integer.
+
+    Raises:
+    TypeError: If input_val is of another type.
     """
     if isinstance(input_val, int):
         # If the input is already an integer, return it as is
@@ -63,9 +93,8 @@ def uuid_to_number(input_val):
             # Convert the string to a UUID object, then to an integer
             uuid_obj = uuid.UUID(input_val)
             return int(uuid_obj)
-        except ValueError as e:
-            print(f"Invalid UUID string: {input_val}. Error: {e}")
-            return None
+        except ValueError:
+            # Not a UUID, hashed the same way on every peer (hash() is salted per process)
+            return int.from_bytes(hashlib.sha1(input_val.encode('utf-8')).digest()[:16], 'big')
     else:
-        print(f"Unsupported input type: {type(input_val)}. Expected int, uuid.UUID, or str.")
-        return None
\ No newline at end of file
+        raise TypeError(f"Unsupported input type: {type(input_val)}. Expected int, uuid.UUID, or str.")
\ No newline at end of file
@@ -0,0 +1,333 @@
+import argparse
+import contextlib
+import math
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from functools import partial
+import psutil
+from Middleware.peer import Peer
+from Middleware.message import Message, decode_message
+from Middleware.discovery_service import InMemoryRegistry, InMemoryDiscovery
+from Game.snapshot import SnapshotEncoder, SnapshotDecoder
+from properties import HEIGHT, PADDLE_WIDTH, PADDLE_HEIGHT, PADDLE_SPEED, WHITE, WIRE_CODECS
+
+'''
+Simulation Harness
+    - Starts N headless peers on loopback, in this process or split across a process pool
+    - Peers find each other through an in-memory registry instead of UDP broadcasts
+    - Every peer sends scripted paddle movement as delta encoded game_state snapshots at a fixed rate
+      and drains the newest snapshot of every other peer each tick, like Pong.run
+    - Reports aggregate throughput, bytes received per tick, p50/p99 transmission latency and CPU per peer
+      for each peer count, to find where the full-mesh PUB/SUB topology breaks down
+    - Latency is measured from sending until the receiver stores the message, the wait of up to one tick
+      until drain_latest hands it to the game is not included
+    - Compares the mesh and star (leader relayed) topologies with --topology mesh,star
+    - Run from the repository root: python -m Simulation.harness --peers 10,50,100 --duration 20
+'''
+
+LOOPBACK = "127.0.0.1"
+MAX_LATENCY_SAMPLES = 200000  # Per process, to keep memory bounded for large peer counts
+LEADER_TIMEOUT = 20  # Seconds to wait for all peers to agree on a leader before measuring
+
+class HarnessMetrics:
+    """
+    In-memory stand-in for the LoggingService, shared by all peers of a process.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.sent = 0
+            self.received = 0
+            self.conflated = 0
+            self.errors = 0
+            self.received_bytes = 0
+            self.latencies = []
+
+    def attach_clock(self, clock):
+        pass  # Shared by all peers of the process, which read the same host clock
+
+    def get_adjusted_time(self):
+        return datetime.utcnow()
+
+    def stamp_send_time(self, message: Message):
+        message.send_timestamp = self.get_adjusted_time()
+
+    def on_message_sent(self, message: Message, message_size: int):
+        with self.lock:
+            self.sent += 1
+
+    def on_message_received(self, message: Message, message_size: int, topic: bytes = None):
+        if message.receive_timestamp is None:
+            # Conflated messages were already stamped by the receiver, when they arrived
+            message.receive_timestamp = self.get_adjusted_time()
+        with self.lock:
+            self.received += 1
+            if message.send_timestamp and len(self.latencies) < MAX_LATENCY_SAMPLES:
+                self.latencies.append((message.receive_timestamp - message.send_timestamp).total_seconds())
+
+    def on_message_conflated(self, message_size: int, topic: bytes = None):
+        with self.lock:
+            self.received += 1
+            self.conflated += 1
+
+    def on_frames_received(self, size: int):
+        with self.lock:
+            self.received_bytes += size
+
+    def increment_error_count(self):
+        with self.lock:
+            self.errors += 1
+
+    def track_handler_stats(self, collect_stats: callable):
+        pass
+
+    def add_fps_sample(self, fps: float):
+        pass
+
+    def kill(self):
+        pass
+
+class MeteredPeer(Peer):
+    """
+    Peer counting the bytes of every message it receives from a socket, the sum over all peers
+    is the traffic of the whole topology.
+    Conflated messages are stamped when the receiver stores them, not when drain_latest delivers them
+    up to one tick later, so the latency excludes the wait for the next tick.
+    """
+    def __init__(self, *args, **kwargs):
+        self.latest_arrivals = {}  # full topic -> arrival time of the newest undelivered payload
+        super().__init__(*args, **kwargs)
+
+    def handle_frames(self, topic: bytes, payload: bytes):
+        self.logging_service.on_frames_received(len(topic) + (len(payload) if payload else 0))
+        super().handle_frames(topic, payload)
+
+    def store_latest(self, topic: bytes, payload: bytes):
+        arrival = self.logging_service.get_adjusted_time()
+        with self.latest_lock:
+            replaced_payload = self.latest_payloads.get(topic)
+            self.latest_payloads[topic] = payload
+            self.latest_arrivals[topic] = arrival
+        if replaced_payload is not None:
+            self.logging_service.on_message_conflated(len(topic) + len(replaced_payload), topic)
+
+    def drain_latest(self):
+        with self.latest_lock:
+            if not self.latest_payloads:
+                return
+            latest_payloads, latest_arrivals = self.latest_payloads, self.latest_arrivals
+            self.latest_payloads, self.latest_arrivals = {}, {}
+
+        for topic, payload in latest_payloads.items():
+            message = decode_message(payload)
+            if message is None:
+                self.logging_service.increment_error_count()
+                continue
+            message.receive_timestamp = latest_arrivals[topic]
+            self.logging_service.on_message_received(message, len(topic) + len(payload), topic)
+            self.dispatcher.dispatch(message)
+
+class ScriptedPlayer:
+    """
+    A headless peer whose paddle follows a sine wave, standing in for keyboard input.
+    """
+    def __init__(self, peer: Peer, phase: float):
+        self.peer = peer
+        self.phase = phase
+        self.paddle = {
+            'x': 10, 'y': HEIGHT // 2 - PADDLE_HEIGHT // 2,
+            'width': PADDLE_WIDTH, 'height': PADDLE_HEIGHT, 'speed': PADDLE_SPEED, 'color': list(WHITE)
+        }
+        self.encoder = SnapshotEncoder()
+        self.decoder = SnapshotDecoder()
+        self.peer.register_handler("game_state", self.handle_game_state_message)
+
+    def handle_game_state_message(self, message: Message):
+        self.decoder.decode(message.id, message.data)
+
+    def tick(self, now: float):
+        amplitude = (HEIGHT - PADDLE_HEIGHT) / 2
+        self.paddle['y'] = int(amplitude + amplitude * math.sin(now + self.phase))
+        self.peer.send_state_message(Message(
+            id=str(self.peer.id),
+            type="game_state",
+            data=self.encoder.encode({'paddle': dict(self.paddle)})
+        ))
+        self.peer.drain_latest()
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def wait_for_leader(players: list, peer_count: int, timeout: float):
+    """
+    Wait until every local peer knows all peers and follows the same leader, e.g. before measuring the star topology.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        leaders = {str(player.peer.leader_id) for player in players}
+        connected = all(len(player.peer.peers) == peer_count - 1 for player in players)
+        if connected and len(leaders) == 1 and None not in {player.peer.leader_id for player in players}:
+            return
+        time.sleep(0.1)
+    print("Peers didn't agree on a leader in time, measuring anyway")
+
+def run_peers(peer_specs: list, roster: list, duration: float, send_rate: float, warmup: float, verbose: bool,
+              topology: str = "mesh") -> dict:
+    """
+    Run a group of peers in this process.
+
+    :param peer_specs: List of (peer_id, port) to start in this process.
+    :param roster: List of (peer_id, ip, port, codecs) of all peers, including the ones in other processes.
+    :param topology: "mesh" or "star".
+    :return: Metrics of this process.
+    """
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with output:
+        local_ids = {peer_id for peer_id, _ in peer_specs}
+        registry = InMemoryRegistry(roster=[entry for entry in roster if entry[0] not in local_ids])
+        metrics = HarnessMetrics()
+        players = []
+        for index, (peer_id, port) in enumerate(peer_specs):
+            peer = MeteredPeer(
+                ip=LOOPBACK,
+                port=port,
+                runtime="asyncio",
+                logging_service=metrics,
+                discovery=partial(InMemoryDiscovery, registry=registry),
+                peer_id=uuid.UUID(peer_id),
+                topology=topology
+            )
+            players.append(ScriptedPlayer(peer, phase=index))
+
+        # Let connections, subscriptions and the leader election settle
+        if topology == "star":
+            wait_for_leader(players, len(roster), LEADER_TIMEOUT)
+        time.sleep(warmup)
+        metrics.reset()
+
+        process = psutil.Process()
+        cpu_start = process.cpu_times()
+        start = time.perf_counter()
+        next_tick = start
+        while time.perf_counter() - start < duration:
+            now = time.perf_counter()
+            for player in players:
+                player.tick(now)
+            next_tick += 1 / send_rate
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+        elapsed = time.perf_counter() - start
+        cpu_end = process.cpu_times()
+
+        for player in players:
+            player.peer.kill()
+
+    cpu_seconds = (cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system)
+    return {
+        "peers": len(players),
+        "elapsed": elapsed,
+        "cpu_seconds": cpu_seconds,
+        "sent": metrics.sent,
+        "received": metrics.received,
+        "conflated": metrics.conflated,
+        "errors": metrics.errors,
+        "received_bytes": metrics.received_bytes,
+        "latencies": metrics.latencies
+    }
+
+def run_peers_from_args(arguments: tuple) -> dict:
+    return run_peers(*arguments)
+
+def simulate(peer_count: int, processes: int, duration: float, send_rate: float, warmup: float,
+             base_port: int, verbose: bool = False, topology: str = "mesh") -> dict:
+    """
+    Run peer_count peers split across processes and return the aggregated metrics.
+    """
+    peer_ids = [str(uuid.uuid4()) for _ in range(peer_count)]
+    ports = [base_port + index for index in range(peer_count)]
+    roster = [(peer_id, LOOPBACK, port, list(WIRE_CODECS)) for peer_id, port in zip(peer_ids, ports)]
+    specs = list(zip(peer_ids, ports))
+
+    processes = max(1, min(processes, peer_count))
+    groups = [specs[index::processes] for index in range(processes)]
+    arguments = [(group, roster, duration, send_rate, warmup, verbose, topology) for group in groups]
+    if processes == 1:
+        results = [run_peers_from_args(arguments[0])]
+    else:
+        # zmq contexts must not be forked
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            results = pool.map(run_peers_from_args, arguments)
+
+    elapsed = max(result["elapsed"] for result in results)
+    latencies = sorted(latency for result in results for latency in result["latencies"])
+    sent = sum(result["sent"] for result in results)
+    received = sum(result["received"] for result in results)
+    expected = sent * (peer_count - 1)
+    return {
+        "topology": topology,
+        "peers": peer_count,
+        "processes": processes,
+        "sent_per_second": sent / elapsed,
+        "received_per_second": received / elapsed,
+        "delivery_ratio": received / expected if expected else float('nan'),
+        "conflated": sum(result["conflated"] for result in results),
+        "errors": sum(result["errors"] for result in results),
+        "bytes_per_tick": sum(result["received_bytes"] for result in results) / (elapsed * send_rate),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "cpu_percent_per_peer": sum(result["cpu_seconds"] for result in results) / elapsed / peer_count * 100
+    }
+
+def raise_file_limit():
+    # Every peer holds a TCP connection to every other peer
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def print_results(results: list):
+    print("Latency: send until arrival at the receiver, excluding the wait for the next drain_latest tick")
+    print(f"{'topology':>9}{'peers':>6}{'procs':>6}{'sent/s':>10}{'recv/s':>11}{'delivery':>10}"
+          f"{'conflated':>11}{'errors':>8}{'bytes/tick':>12}{'p50 ms':>9}{'p99 ms':>9}{'cpu%/peer':>11}")
+    for r in results:
+        print(f"{r['topology']:>9}{r['peers']:>6}{r['processes']:>6}"
+              f"{r['sent_per_second']:>10.0f}{r['received_per_second']:>11.0f}"
+              f"{r['delivery_ratio']:>10.2%}{r['conflated']:>11}{r['errors']:>8}{r['bytes_per_tick']:>12.0f}"
+              f"{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['cpu_percent_per_peer']:>11.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless multi-peer simulation harness")
+    parser.add_argument('--peers', type=str, default='3,10,50', help='Comma separated peer counts to run (default: 3,10,50)')
+    parser.add_argument('--processes', type=int, default=1, help='Number of processes to split the peers across (default: 1)')
+    parser.add_argument('--duration', type=float, default=10, help='Measured seconds per run (default: 10)')
+    parser.add_argument('--send_rate', type=float, default=30, help='game_state messages per second per peer (default: 30)')
+    parser.add_argument('--warmup', type=float, default=3, help='Seconds to let connections settle before measuring (default: 3)')
+    parser.add_argument('--base_port', type=int, default=20000, help='First port, peers use consecutive ports (default: 20000)')
+    parser.add_argument('--topology', type=str, default='mesh', help='Comma separated topologies to run: mesh, star (default: mesh)')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of the peers')
+    args = parser.parse_args()
+
+    raise_file_limit()
+    results = []
+    base_port = args.base_port
+    for peer_count in (int(count) for count in args.peers.split(',')):
+        for topology in args.topology.split(','):
+            print(f"Running {peer_count} peers ({topology})...")
+            results.append(simulate(peer_count, args.processes, args.duration, args.send_rate,
+                                    args.warmup, base_port, args.verbose, topology))
+            base_port += peer_count  # Don't reuse ports that may still be closing
+    print_results(results)
+
+if __name__ == "__main__":
+    main()
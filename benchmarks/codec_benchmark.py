@@ -0,0 +1,53 @@
+import timeit
+import uuid
+from datetime import datetime
+from typing import Callable
+from Middleware.message import Message, CODECS
+
+'''
+Codec Benchmark
+    - Compares the JSON and binary wire codecs on representative messages
+    - Reports encode / decode time per message and bytes per message
+    - Run from the repository root: python -m benchmarks.codec_benchmark
+'''
+
+def sample_messages() -> dict:
+    """
+    Messages shaped like the ones sent every frame by Pong.run and the leader election service.
+    """
+    peer_id = str(uuid.uuid4())
+    paddle = {'x': 10, 'y': 250, 'width': 11, 'height': 100, 'speed': 5, 'color': [120, 200, 180]}
+    ball = {'x': 390, 'y': 290, 'width': 20, 'height': 20, 'speed_x': 5, 'speed_y': -6, 'color': [255, 255, 255]}
+    return {
+        "heartbeat": Message(id=peer_id, type="heartbeat", data={}, send_timestamp=datetime.utcnow()),
+        "game_state (peer)": Message(
+            id=peer_id,
+            type="game_state",
+            data={"game_state": {"paddle": paddle}},
+            send_timestamp=datetime.utcnow()
+        ),
+        "game_state (leader)": Message(
+            id=peer_id,
+            type="game_state",
+            data={"game_state": {"paddle": paddle, "ball": ball, "score": [3, 2]}},
+            send_timestamp=datetime.utcnow()
+        ),
+    }
+
+def time_per_call(function: Callable, number: int) -> float:
+    """
+    Best of five runs, in microseconds per call.
+    """
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+def run_benchmark(number: int = 20000):
+    print(f"{'message':<22}{'codec':<8}{'bytes':>8}{'encode (us)':>14}{'decode (us)':>14}")
+    for label, message in sample_messages().items():
+        for name, codec in CODECS.items():
+            payload = codec.encode(message)
+            encode_time = time_per_call(lambda: codec.encode(message), number)
+            decode_time = time_per_call(lambda: codec.decode(payload), number)
+            print(f"{label:<22}{name:<8}{len(payload):>8}{encode_time:>14.2f}{decode_time:>14.2f}")
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,120 @@
+import argparse
+import contextlib
+import os
+import random
+import time
+import uuid
+from functools import partial
+from Middleware.peer import Peer
+from Middleware.discovery_service import InMemoryRegistry, InMemoryDiscovery
+from Middleware.utils import uuid_to_number
+from Middleware.message import Message
+from Simulation.harness import HarnessMetrics
+
+'''
+Leader Convergence Benchmark
+    - Starts a group of peers at once on loopback, like a LAN party where everyone joins together,
+      and measures the time until every peer follows the highest peer as the leader and the leader knows it
+    - The leader's heartbeats are public and periodic, so peers converge on them even if election messages
+      are lost. Messages sent only once are not repeated: right after starting, the highest peer also sends every
+      other peer a side message, like Pong.organize_peers, racing the subscriptions (the slow joiner problem)
+    - Optionally a fraction of all published frames is dropped
+    - Runs every case with the reliable control channel and without it (Peer(reliable_control=False))
+    - Run from the repository root: python -m benchmarks.convergence_benchmark [--peers 5,10] [--loss 0,0.2]
+'''
+
+BASE_PORT = 22000  # Below the ephemeral port range, outgoing connections can take ports above
+TIMEOUT = 40  # Seconds before a trial counts as not converged
+
+class LossyPeer(Peer):
+    """
+    Peer dropping a fraction of the frames it publishes.
+    """
+    def __init__(self, *args, loss: float = 0.0, **kwargs):
+        self.loss = loss
+        super().__init__(*args, **kwargs)
+
+    def send_frames(self, frames: list):
+        if self.loss and random.random() < self.loss:
+            return
+        super().send_frames(frames)
+
+def converged(peers: list, leader_id: str) -> bool:
+    for peer in peers:
+        if peer.leader_id is None or str(peer.leader_id) != leader_id:
+            return False
+        if peer.is_leader != (str(peer.id) == leader_id):
+            return False
+    return True
+
+def run_trial(peer_count: int, loss: float, reliable: bool, base_port: int) -> tuple:
+    """
+    Return the seconds until the peers converged (None if they didn't within TIMEOUT)
+    and the number of side messages delivered.
+    """
+    registry = InMemoryRegistry()
+    metrics = HarnessMetrics()
+    peer_ids = [uuid.uuid4() for _ in range(peer_count)]
+    leader_id = str(max(peer_ids, key=uuid_to_number))
+    start = time.time()
+    peers = [
+        LossyPeer(
+            ip="127.0.0.1",
+            port=base_port + index * 2,
+            runtime="asyncio",
+            logging_service=metrics,
+            discovery=partial(InMemoryDiscovery, registry=registry),
+            peer_id=peer_id,
+            reliable_control=reliable,
+            loss=loss
+        )
+        for index, peer_id in enumerate(peer_ids)
+    ]
+    sides = set()
+    for peer in peers:
+        peer.register_handler("side", lambda message, peer_id=str(peer.id): sides.add(peer_id))
+    leader = next(peer for peer in peers if str(peer.id) == leader_id)
+    for peer in peers:
+        if peer is not leader:
+            leader.control.send(str(peer.id), Message(id=leader_id, type="side", data={"side": "left"}))
+
+    elapsed = None
+    while time.time() - start < TIMEOUT:
+        if converged(peers, leader_id):
+            elapsed = time.time() - start
+            break
+        time.sleep(0.05)
+    for peer in peers:
+        peer.kill()
+    return elapsed, len(sides)
+
+def main():
+    parser = argparse.ArgumentParser(description="Leader convergence with and without the reliable control channel")
+    parser.add_argument("--peers", default="5,10", help="Comma separated peer counts (default: 5,10)")
+    parser.add_argument("--loss", default="0,0.2", help="Comma separated fractions of frames dropped (default: 0,0.2)")
+    parser.add_argument("--trials", type=int, default=3, help="Trials per case (default: 3)")
+    args = parser.parse_args()
+
+    print(f"{'peers':>6}{'loss':>6}{'control':>10}{'converged':>11}{'mean s':>9}{'max s':>9}{'sides delivered':>17}")
+    port = BASE_PORT
+    # Kept open: peer threads still printing when stdout is restored would write to a freed file otherwise
+    devnull = open(os.devnull, "w")
+    for peer_count in (int(count) for count in args.peers.split(",")):
+        for loss in (float(fraction) for fraction in args.loss.split(",")):
+            for reliable in (False, True):
+                times, sides = [], 0
+                for _ in range(args.trials):
+                    with contextlib.redirect_stdout(devnull):
+                        elapsed, delivered = run_trial(peer_count, loss, reliable, port)
+                    times.append(elapsed)
+                    sides += delivered
+                    port += peer_count * 2  # Fresh ports, the previous sockets may linger
+                done = [elapsed for elapsed in times if elapsed is not None]
+                side_count = (peer_count - 1) * args.trials
+                mean = f"{sum(done) / len(done):.2f}" if done else "-"
+                worst = f"{max(done):.2f}" if done else "-"
+                print(f"{peer_count:>6}{loss:>6.2f}{'reliable' if reliable else 'plain':>10}"
+                      f"{len(done):>6}/{len(times):<4}{mean:>9}{worst:>9}{sides:>11}/{side_count:<5}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import argparse
+import contextlib
+import os
+import socket
+import threading
+import time
+import timeit
+import uuid
+from typing import Callable
+from Middleware.discovery_service import DiscoveryService, xor_cipher
+from Middleware.message import Message, CODECS
+from properties import KEY
+
+'''
+Discovery Benchmark
+    - Compares the byte by byte XOR cipher with the integer one on presence packets
+    - Compares handling a presence datagram the old way (decrypt and parse every datagram) with the packet cache
+    - Measures the datagrams/sec the listener handles: a sender thread floods a loopback UDP socket with the
+      presence packets of a group of peers while the listener receives and handles them for a few seconds
+    - No peers or ZMQ sockets are started, the discovery services run on a stub peer
+    - Run from the repository root: python -m benchmarks.discovery_benchmark [--peers 10] [--seconds 3]
+'''
+
+class StubPeer:
+    def __init__(self):
+        self.id = uuid.uuid4()
+        self.ip = "127.0.0.1"
+        self.bind_port = 5555
+        self.supported_codecs = list(CODECS)
+        self.last_seen = {}
+
+    def add_peer(self, ip: str, port: int, peer_id: str, codecs: list = None):
+        self.last_seen[peer_id] = time.time()
+
+    def mark_seen(self, peer_id: str) -> bool:
+        if peer_id not in self.last_seen:
+            return False
+        self.last_seen[peer_id] = time.time()
+        return True
+
+    def get_peer_by_id(self, peer_id: str):
+        return peer_id if peer_id in self.last_seen else None
+
+class LegacyDiscovery(DiscoveryService):
+    """
+    Discovery service handling datagrams like before the packet cache, with the byte by byte cipher.
+    """
+    def _xor_cipher(self, data: bytes) -> bytes:
+        return bytes([b ^ KEY[i % len(KEY)] for i, b in enumerate(data)])
+
+    def handle_datagram(self, encrypted_data: bytes):
+        message = Message.from_json(self._xor_cipher(encrypted_data).decode('utf-8'))
+        if message is not None and message.type == "presence" and message.id != str(self.peer.id):
+            self.peer.add_peer(message.data.get("ip"), message.data.get("port"), message.id,
+                               message.data.get("codecs"))
+
+def stub_service(service_class: type) -> DiscoveryService:
+    """
+    A discovery service without sockets or threads, it doesn't broadcast.
+    """
+    service = object.__new__(service_class)
+    service.peer = StubPeer()
+    service.presence_packet = None
+    service.presence_fields = None
+    service.known_packets = {}
+    service.broadcast_lock = threading.Lock()
+    service.discovery_stop_event = threading.Event()
+    service.discovery_stop_event.set()
+    return service
+
+def presence_packets(peer_count: int) -> list:
+    packets = []
+    for index in range(peer_count):
+        service = stub_service(DiscoveryService)
+        service.peer.bind_port = 5555 + index * 2
+        packets.append(service.get_presence_packet())
+    return packets
+
+def time_per_call(function: Callable, number: int) -> float:
+    """
+    Best of five runs, in microseconds per call.
+    """
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+def listener_rate(service: DiscoveryService, packets: list, seconds: float) -> float:
+    """
+    Datagrams per second handled by service while a sender thread floods its loopback socket with packets.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    listener.bind(("127.0.0.1", 0))
+    listener.settimeout(0.2)
+    address = listener.getsockname()
+    stop = threading.Event()
+
+    def flood():
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        index = 0
+        while not stop.is_set():
+            try:
+                sender.sendto(packets[index % len(packets)], address)
+            except OSError:
+                time.sleep(0.0001)  # Send buffer full
+            index += 1
+        sender.close()
+
+    sender_thread = threading.Thread(target=flood, daemon=True)
+    sender_thread.start()
+    handled = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        try:
+            data, _ = listener.recvfrom(4096)
+        except socket.timeout:
+            continue
+        service.handle_datagram(data)
+        handled += 1
+    elapsed = time.perf_counter() - start
+    stop.set()
+    sender_thread.join()
+    listener.close()
+    return handled / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Presence cipher and UDP listener throughput")
+    parser.add_argument("--peers", type=int, default=10, help="Peers broadcasting presence (default: 10)")
+    parser.add_argument("--seconds", type=float, default=3, help="Seconds per listener run (default: 3)")
+    args = parser.parse_args()
+
+    packets = presence_packets(args.peers)
+    packet = packets[0]
+    print(f"Presence packet: {len(packet)} bytes")
+    assert xor_cipher(packet, KEY) == stub_service(LegacyDiscovery)._xor_cipher(packet)
+
+    print(f"{'cipher':<12}{'us/packet':>12}")
+    for name, service_class in (("byte loop", LegacyDiscovery), ("integer", DiscoveryService)):
+        cipher = stub_service(service_class)._xor_cipher
+        print(f"{name:<12}{time_per_call(lambda: cipher(packet), 20000):>12.2f}")
+
+    print(f"\n{'handler':<12}{'us/datagram':>12}{'datagrams/s':>14}")
+    for name, service_class in (("legacy", LegacyDiscovery), ("cached", DiscoveryService)):
+        service = stub_service(service_class)
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            for known in packets:
+                service.handle_datagram(known)  # Every peer found once, like after the first broadcast round
+            per_datagram = time_per_call(lambda: service.handle_datagram(packet), 20000)
+            rate = listener_rate(service, packets, args.seconds)
+        print(f"{name:<12}{per_datagram:>12.2f}{rate:>14.0f}")
+
+if __name__ == "__main__":
+    main()
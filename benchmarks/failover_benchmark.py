@@ -0,0 +1,109 @@
+import argparse
+import contextlib
+import os
+import time
+import uuid
+from functools import partial
+from Middleware.peer import Peer
+from Middleware.discovery_service import InMemoryRegistry, InMemoryDiscovery
+from Middleware.utils import uuid_to_number
+from Simulation.harness import HarnessMetrics
+
+'''
+Leader Failover Benchmark
+    - Starts a group of peers on loopback, waits until they follow the highest peer, kills that leader and
+      measures the time until every survivor follows the next highest peer and it knows it is the leader
+    - "leave": the leader shuts down and the others are told right away, like discovery expiring it
+    - "crash": the leader disappears without notice, the survivors only notice its missing heartbeats
+    - Peers use the asyncio runtime by default (one event loop for all of them), --runtime thread for threads
+    - Run from the repository root: python -m benchmarks.failover_benchmark [--peers 3,10,50] [--mode leave,crash]
+'''
+
+BASE_PORT = 24000  # Below the ephemeral port range, outgoing connections can take ports above
+TIMEOUT = 60  # Seconds before a trial counts as failed
+
+class CrashingDiscovery(InMemoryDiscovery):
+    """
+    In-memory discovery whose peer vanishes from the registry without telling the other peers.
+    """
+    def stop_discovery(self):
+        with self.registry.lock:
+            if self in self.registry.services:
+                self.registry.services.remove(self)
+            self.registry.entries.pop(str(self.peer.id), None)
+
+def follows(peers: list, leader_id: str) -> bool:
+    for peer in peers:
+        if peer.leader_id is None or str(peer.leader_id) != leader_id:
+            return False
+        if peer.is_leader != (str(peer.id) == leader_id):
+            return False
+    return True
+
+def wait_until(condition, timeout: float):
+    start = time.time()
+    while time.time() - start < timeout:
+        if condition():
+            return time.time() - start
+        time.sleep(0.01)
+    return None
+
+def run_trial(peer_count: int, mode: str, runtime: str, base_port: int):
+    """
+    Return the seconds from killing the leader until the survivors follow the new one, None on timeout.
+    """
+    registry = InMemoryRegistry()
+    metrics = HarnessMetrics()
+    discovery = CrashingDiscovery if mode == "crash" else InMemoryDiscovery
+    peer_ids = sorted((uuid.uuid4() for _ in range(peer_count)), key=uuid_to_number)
+    peers = [
+        Peer(
+            ip="127.0.0.1",
+            port=base_port + index * 2,
+            runtime=runtime,
+            logging_service=metrics,
+            discovery=partial(discovery, registry=registry),
+            peer_id=peer_id
+        )
+        for index, peer_id in enumerate(peer_ids)
+    ]
+    leader, survivors = peers[-1], peers[:-1]
+    elapsed = None
+    if wait_until(lambda: follows(peers, str(leader.id)), TIMEOUT) is not None:
+        start = time.time()
+        leader.kill()
+        if wait_until(lambda: follows(survivors, str(survivors[-1].id)), TIMEOUT) is not None:
+            elapsed = time.time() - start
+    else:
+        leader.kill()
+    for peer in survivors:
+        peer.kill()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Time from killing the leader until a new coordinator is followed")
+    parser.add_argument("--peers", default="3,10,50", help="Comma separated peer counts (default: 3,10,50)")
+    parser.add_argument("--mode", default="leave,crash", help="Comma separated: leave, crash (default: both)")
+    parser.add_argument("--trials", type=int, default=3, help="Trials per case (default: 3)")
+    parser.add_argument("--runtime", default="asyncio", help="Peer runtime: asyncio or thread (default: asyncio)")
+    args = parser.parse_args()
+
+    print(f"{'peers':>6}{'mode':>7}{'failed over':>13}{'mean s':>9}{'min s':>9}{'max s':>9}")
+    port = BASE_PORT
+    # Kept open: peer threads still printing when stdout is restored would write to a freed file otherwise
+    devnull = open(os.devnull, "w")
+    for peer_count in (int(count) for count in args.peers.split(",")):
+        for mode in args.mode.split(","):
+            times = []
+            for _ in range(args.trials):
+                with contextlib.redirect_stdout(devnull):
+                    times.append(run_trial(peer_count, mode, args.runtime, port))
+                port += peer_count * 2  # Fresh ports, the previous sockets may linger
+            done = [elapsed for elapsed in times if elapsed is not None]
+            mean = f"{sum(done) / len(done):.2f}" if done else "-"
+            fastest = f"{min(done):.2f}" if done else "-"
+            worst = f"{max(done):.2f}" if done else "-"
+            print(f"{peer_count:>6}{mode:>7}{len(done):>8}/{len(times):<4}{mean:>9}{fastest:>9}{worst:>9}")
+
+if __name__ == "__main__":
+    main()
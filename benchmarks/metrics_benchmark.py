@@ -0,0 +1,94 @@
+import queue
+import threading
+import time
+from collections import deque
+from Middleware.metrics import ShardedCounter
+
+'''
+Metric Counter Benchmark
+    - Measures the bookkeeping LoggingService.on_message_sent / on_message_received do per message,
+      without the message serialization used to measure the size
+    - locked: the previous implementation, one threading.Lock per counter, msg_id lists for the dropout rate
+      and a queue.Queue for transmission times
+    - sharded: ShardedCounter per counter and a deque for transmission times, no lock on the hot path
+    - Each case runs on 1 thread and on several threads at once, like the receiver, game and timer threads
+    - Run from the repository root: python -m benchmarks.metrics_benchmark
+'''
+
+class LockedCounters:
+    def __init__(self):
+        self.sent_messages, self.received_messages, self.dropout_lock = [], [], threading.Lock()
+        self.real_time_violations, self.real_time_lock = 0, threading.Lock()
+        self.throughput_sent, self.throughput_received, self.throughput_lock = 0, 0, threading.Lock()
+        self.bytes_sent, self.bytes_received, self.bandwidth_lock = 0, 0, threading.Lock()
+        self.transmission_times = queue.Queue()
+
+    def on_message_sent(self, msg_id: str, size: int):
+        with self.dropout_lock:
+            self.sent_messages.append(msg_id)
+        with self.throughput_lock:
+            self.throughput_sent += 1
+        with self.bandwidth_lock:
+            self.bytes_sent += size
+
+    def on_message_received(self, msg_id: str, size: int, transmission_time: float):
+        with self.dropout_lock:
+            self.received_messages.append(msg_id)
+        with self.throughput_lock:
+            self.throughput_received += 1
+        self.transmission_times.put(transmission_time)
+        if transmission_time > 0.1:
+            with self.real_time_lock:
+                self.real_time_violations += 1
+        with self.bandwidth_lock:
+            self.bytes_received += size
+
+class ShardedCounters:
+    def __init__(self):
+        self.sent_messages, self.received_messages = ShardedCounter(), ShardedCounter()
+        self.real_time_violations = ShardedCounter()
+        self.throughput_sent, self.throughput_received = ShardedCounter(), ShardedCounter()
+        self.bytes_sent, self.bytes_received = ShardedCounter(), ShardedCounter()
+        self.transmission_times = deque()
+
+    def on_message_sent(self, msg_id: str, size: int):
+        self.sent_messages.increment()
+        self.throughput_sent.increment()
+        self.bytes_sent.increment(size)
+
+    def on_message_received(self, msg_id: str, size: int, transmission_time: float):
+        self.received_messages.increment()
+        self.throughput_received.increment()
+        self.transmission_times.append(transmission_time)
+        if transmission_time > 0.1:
+            self.real_time_violations.increment()
+        self.bytes_received.increment(size)
+
+def hammer(counters, count: int):
+    for index in range(count):
+        counters.on_message_sent("msg", 180)
+        counters.on_message_received("msg", 180, 0.001 * (index % 200))
+
+def run_case(counters_class, threads: int, count: int) -> float:
+    """
+    Time count sent + received messages per thread, returns nanoseconds per message pair.
+    """
+    counters = counters_class()
+    workers = [threading.Thread(target=hammer, args=(counters, count)) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return elapsed / (count * threads) * 1e9
+
+def main():
+    count = 200000
+    print(f"{'counters':<10}{'threads':>8}{'ns/message pair':>18}")
+    for threads in (1, 4):
+        for name, counters_class in (("locked", LockedCounters), ("sharded", ShardedCounters)):
+            print(f"{name:<10}{threads:>8}{run_case(counters_class, threads, count):>18.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import time
+import uuid
+from datetime import datetime
+import zmq
+from Middleware.message import Message, encode_message, decode_message
+from Middleware.peer import recv_topic_frames
+
+'''
+Receive Path Benchmark
+    - Publishes game_state messages over an inproc PUB/SUB pair
+    - Compares the old single string frame ("topic json", recv_string + split + from_json)
+      with topic framed multipart messages (recv_multipart + decode from the payload frame)
+    - "conflated state" is the path of the high-rate state topics: the payload is only kept per sender
+      until the game drains it, no message is decoded on the receiving thread
+    - All messages are queued before the clock starts, so only the receive side is timed
+    - The cases take turns for a few rounds and the best rate of each is reported, one slow round
+      on a busy machine doesn't decide the comparison
+    - Run from the repository root: python -m benchmarks.receive_benchmark
+'''
+
+TOPIC = "public"
+
+def sample_message() -> Message:
+    paddle = {'x': 10, 'y': 250, 'width': 11, 'height': 100, 'speed': 5, 'color': [120, 200, 180]}
+    return Message(
+        id=str(uuid.uuid4()),
+        type="game_state",
+        data={"seq": 1, "base": 1, "game_state": {"paddle": paddle}},
+        send_timestamp=datetime.utcnow()
+    )
+
+def send_string_frames(publisher, message: Message, count: int):
+    full_message = f"{TOPIC} {message.to_json()}"
+    for _ in range(count):
+        publisher.send_string(full_message)
+
+def receive_string_frames(subscriber, count: int):
+    for _ in range(count):
+        raw_message = subscriber.recv_string()
+        topic, message_json = raw_message.split(' ', 1)
+        Message.from_json(message_json)
+
+def send_multipart_frames(codec_name: str):
+    def send(publisher, message: Message, count: int):
+        frames = [TOPIC.encode('utf-8'), encode_message(message, codec_name)]
+        for _ in range(count):
+            publisher.send_multipart(frames)
+    return send
+
+def receive_multipart_frames(subscriber, count: int):
+    for _ in range(count):
+        frames = subscriber.recv_multipart(copy=False)
+        decode_message(frames[1].buffer)
+
+def receive_topic_frames(subscriber, count: int):
+    # The receive path used by Peer.receive_message
+    for _ in range(count):
+        topic, payload = recv_topic_frames(subscriber)
+        decode_message(payload)
+
+def receive_conflated_frames(subscriber, count: int):
+    # The receive path of conflated state topics in Peer.deliver_frames, decoding happens in drain_latest
+    latest_payloads = {}
+    for _ in range(count):
+        topic, payload = recv_topic_frames(subscriber)
+        prefix, _, sender_id = topic.partition(b':')
+        sender_id.decode('utf-8', 'replace')
+        latest_payloads[topic] = payload
+
+def run_case(send, receive, count: int) -> float:
+    """
+    Time the receive side of count messages, returns messages per second.
+    """
+    context = zmq.Context()
+    publisher = context.socket(zmq.PUB)
+    publisher.setsockopt(zmq.SNDHWM, 0)
+    publisher.bind("inproc://receive-benchmark")
+    subscriber = context.socket(zmq.SUB)
+    subscriber.setsockopt(zmq.RCVHWM, 0)
+    subscriber.connect("inproc://receive-benchmark")
+    subscriber.setsockopt_string(zmq.SUBSCRIBE, TOPIC)
+    time.sleep(0.2)  # Let the subscription propagate
+
+    send(publisher, sample_message(), count)
+    subscriber.poll(1000)
+    start = time.perf_counter()
+    receive(subscriber, count)
+    elapsed = time.perf_counter() - start
+
+    publisher.close()
+    subscriber.close()
+    context.term()
+    return count / elapsed
+
+def run_benchmark(count: int = 50000, rounds: int = 9):
+    cases = {
+        "string frame + json": (send_string_frames, receive_string_frames),
+        "recv_multipart memoryview + json": (send_multipart_frames("json"), receive_multipart_frames),
+        "recv_multipart memoryview + binary": (send_multipart_frames("binary"), receive_multipart_frames),
+        "topic frames + json": (send_multipart_frames("json"), receive_topic_frames),
+        "topic frames + binary": (send_multipart_frames("binary"), receive_topic_frames),
+        "topic frames, conflated state": (send_multipart_frames("binary"), receive_conflated_frames),
+    }
+    best = dict.fromkeys(cases, 0.0)
+    for _ in range(rounds):
+        for label, (send, receive) in cases.items():
+            best[label] = max(best[label], run_case(send, receive, count))
+    print(f"{'receive path':<38}{'msgs/s':>12}")
+    for label, rate in best.items():
+        print(f"{label:<38}{rate:>12.0f}")
+
+if __name__ == "__main__":
+    run_benchmark()
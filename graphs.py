@@ -1,22 +1,26 @@
-from plot_scripts.bandwidth import plot_bandwidth
-from plot_scripts.fps import plot_fps
-from plot_scripts.resources import plot_resource_usage
-from plot_scripts.transmission_times import plot_transmission_times
-from plot_scripts.throughput import plot_throughput
-from plot_scripts.drop_rate import plot_drop_rates
+import argparse
+from plot_scripts.analysis import analyze_run, DEFAULT_POINTS
 
-if __name__ == "__main__":
-    #plot_bandwidth(log_file='logs/bandwidth.log',output_image='plots/bandwidth_plot.png',show_plot=True)
-
-    #plot_fps(log_file='logs/fps.log',output_image='plots/fps_plot.png',show_plot=True)
+'''
+Log Analysis
+    - Plots and summarizes all metric logs of a run directory, including sub directories of
+      several runs (e.g. logs/droprate1/*), see plot_scripts/analysis.py
+    - Run from the repository root: python graphs.py [run_dir] [--output plots] [--points 2000] [--workers N]
+    - The single metric plots (plot_scripts/*.py) can still be called directly on CSV exports
+'''
 
-    #plot_resource_usage(log_file='logs/resources.log',output_image='plots/resource_usage_plot.png',show_plot=True)
+def main():
+    parser = argparse.ArgumentParser(description="Plot and summarize the metric logs of a run")
+    parser.add_argument("run_dir", nargs="?", default="logs", help="Directory with the metric logs (default: logs)")
+    parser.add_argument("--output", default="plots", help="Directory for the plots and summary.csv (default: plots)")
+    parser.add_argument("--points", type=int, default=DEFAULT_POINTS,
+                        help=f"Points per plotted line after downsampling (default: {DEFAULT_POINTS})")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args()
 
-    #plot_transmission_times(log_file='logs/transmission_times.log',output_image='plots/transmission_times_plot.png',show_plot=True,log_rate=None)
+    summary = analyze_run(args.run_dir, args.output, args.points, args.workers)
+    if not summary.empty:
+        print(summary.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
 
-    #plot_throughput(log_file='logs/throughput.log',output_image='plots/throughput_plot.png',show_plot=True)
-    log_files = [
-        'logs/droprate2/dropout_rate1.log',
-        'logs/droprate2/dropout_rate2.log'
-    ]
-    plot_drop_rates(log_files)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
+import numpy as np
+import pandas as pd
+from Middleware.logging_service import LoggingService
+from plot_scripts.metric_store import read_ring_header
+
+'''
+Streaming Log Analysis
+    - Finds the metric logs of a run directory and its sub directories (e.g. logs/droprate1/*),
+      binary ring files (<name>.ring) and CSV exports (<name>.log, also numbered like dropout_rate1.log).
+      A ring file is used over the CSV export of the same metric
+    - Logs are read in chunks of CHUNK_ROWS rows, ring files through a memory map, CSV files with pandas,
+      so multi-hour captures never have to fit in memory
+    - Every plotted series is downsampled with Largest-Triangle-Three-Buckets (LTTB), which keeps the
+      visual shape of spikes and drops. Chunks are reduced as they arrive and the points kept are reduced
+      again whenever they exceed a few times the target, the last reduction runs on the whole series
+    - Each log is read, summarized and plotted by its own worker process
+    - The summary table has the rows, duration, mean, min, max and total of every numeric column
+'''
+
+CHUNK_ROWS = 100000
+DEFAULT_POINTS = 2000  # Points per plotted line
+COMPACT_FACTOR = 4  # Points kept per line before reducing them again, in multiples of the target
+
+# metric -> (name, field type, CSV format) of its rows, see LoggingService
+METRIC_FIELDS = {
+    "transmission_histogram": LoggingService.TRANSMISSION_HISTOGRAM_FIELDS,
+    "transmission_buckets": LoggingService.TRANSMISSION_BUCKETS_FIELDS,
+    "transmission_times": LoggingService.TRANSMISSION_TIMES_FIELDS,
+    "dropout_rate": LoggingService.DROPOUT_RATE_FIELDS,
+    "stream_loss": LoggingService.STREAM_LOSS_FIELDS,
+    "real-time_violations": LoggingService.REAL_TIME_VIOLATIONS_FIELDS,
+    "throughput": LoggingService.THROUGHPUT_FIELDS,
+    "bandwidth": LoggingService.BANDWIDTH_FIELDS,
+    "bandwidth_by_type": LoggingService.BANDWIDTH_BY_TYPE_FIELDS,
+    "errors": LoggingService.ERRORS_FIELDS,
+    "resources": LoggingService.RESOURCES_FIELDS,
+    "fps": LoggingService.FPS_FIELDS,
+    "conflation": LoggingService.CONFLATION_FIELDS,
+    "handler_latency": LoggingService.HANDLER_LATENCY_FIELDS,
+    "interpolation": LoggingService.INTERPOLATION_FIELDS,
+}
+
+# Columns plotted per message type for metrics with one row per type, the others plot all numeric columns
+PLOT_COLUMNS = {
+    "transmission_histogram": ["p50", "p99"],
+    "transmission_buckets": ["count"],
+    "stream_loss": ["loss_rate", "reorder_rate"],
+    "bandwidth_by_type": ["sent", "received"],
+    "handler_latency": ["mean_latency_ms", "max_latency_ms"],
+}
+
+def metric_name(stem: str) -> Optional[str]:
+    """
+    Return the metric of a log file name, e.g. 'dropout_rate' for dropout_rate1, None for unknown files.
+    """
+    if stem in METRIC_FIELDS:
+        return stem
+    stripped = re.sub(r'\d+$', '', stem)
+    return stripped if stripped in METRIC_FIELDS else None
+
+def discover_metric_logs(run_dir: str) -> list:
+    """
+    Find the metric logs below run_dir.
+
+    Returns:
+    - list: (label, metric, path) per log, the label is the path relative to run_dir without extension.
+    """
+    logs = {}
+    for directory, _, file_names in os.walk(run_dir):
+        for file_name in sorted(file_names):
+            stem, extension = os.path.splitext(file_name)
+            metric = metric_name(stem)
+            if metric is None or extension not in ('.ring', '.log'):
+                continue
+            label = os.path.relpath(os.path.join(directory, stem), run_dir)
+            if label in logs and extension == '.log':
+                continue  # The ring file has the same rows
+            logs[label] = (label, metric, os.path.join(directory, file_name))
+    return [logs[label] for label in sorted(logs)]
+
+def iter_chunks(path: str, metric: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Yield the rows of a ring file or CSV log in DataFrames of at most chunk_rows rows, oldest first.
+    """
+    fields = METRIC_FIELDS[metric]
+    if path.endswith('.ring'):
+        dtype, data_offset, capacity, write_count = read_ring_header(path)
+        if write_count == 0:
+            return
+        records = np.memmap(path, dtype=dtype, mode='r', offset=data_offset, shape=(capacity,))
+        oldest = write_count % capacity if write_count > capacity else 0
+        for start, end in ((oldest, min(write_count, capacity)), (0, oldest)):
+            for chunk_start in range(start, end, chunk_rows):
+                chunk = pd.DataFrame(records[chunk_start:min(end, chunk_start + chunk_rows)])
+                for name, field_type, _ in fields:
+                    if field_type == 'name':
+                        chunk[name] = chunk[name].str.decode('utf-8')
+                yield chunk
+    else:
+        names = [name for name, _, _ in fields]
+        yield from pd.read_csv(path, header=None, names=names, chunksize=chunk_rows)
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> tuple:
+    """
+    Downsample a series to threshold points with Largest-Triangle-Three-Buckets.
+    The first and last points are kept, from every bucket in between the point spanning the largest
+    triangle with the point kept from the previous bucket and the mean of the next bucket.
+    """
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return x, y
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, length - 1
+    edges = np.linspace(1, length - 1, threshold - 1).astype(np.int64)  # threshold - 2 buckets
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else length
+        mean_x = x[next_start:next_end].mean()
+        mean_y = y[next_start:next_end].mean()
+        areas = np.abs((x[previous] - mean_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (mean_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return x[kept], y[kept]
+
+class StreamingDownsampler:
+    def __init__(self, points: int):
+        self.points = points
+        self.x_parts, self.y_parts = [], []
+        self.kept = 0
+
+    def add(self, x: np.ndarray, y: np.ndarray):
+        x, y = lttb(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), self.points)
+        self.x_parts.append(x)
+        self.y_parts.append(y)
+        self.kept += len(x)
+        if self.kept > COMPACT_FACTOR * self.points:
+            x, y = self.result()
+            self.x_parts, self.y_parts, self.kept = [x], [y], len(x)
+
+    def result(self) -> tuple:
+        if not self.x_parts:
+            return np.zeros(0), np.zeros(0)
+        return lttb(np.concatenate(self.x_parts), np.concatenate(self.y_parts), self.points)
+
+class ColumnStats:
+    def __init__(self):
+        self.count, self.total = 0, 0.0
+        self.minimum, self.maximum = np.inf, -np.inf
+
+    def add(self, values: np.ndarray):
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+
+def analyze_log(label: str, metric: str, path: str, output_dir: str, points: int = DEFAULT_POINTS) -> list:
+    """
+    Stream one log, plot its downsampled series to <output_dir>/<label>.png and summarize its columns.
+    Runs in a worker process.
+
+    Returns:
+    - list: Summary rows (label, column, rows, duration in s, mean, min, max, total).
+    """
+    fields = METRIC_FIELDS[metric]
+    has_timestamp = fields[0][0] == 'timestamp'
+    type_column = next((name for name, field_type, _ in fields if field_type == 'name'), None)
+    numeric = [name for name, field_type, _ in fields if field_type in ('float', 'int') and name != 'timestamp']
+    plotted = PLOT_COLUMNS.get(metric, numeric)
+
+    lines = {}  # (column, message type) -> StreamingDownsampler
+    stats = {}  # (column, message type) -> ColumnStats
+    first_time, last_time, rows = None, None, 0
+    for chunk in iter_chunks(path, metric):
+        x = chunk['timestamp'].to_numpy(dtype=np.float64) if has_timestamp else \
+            np.arange(rows, rows + len(chunk), dtype=np.float64)
+        if has_timestamp and len(x):
+            first_time = x[0] if first_time is None else first_time
+            last_time = x[-1]
+        rows += len(chunk)
+        groups = chunk.groupby(type_column, sort=False).indices.items() if type_column else [(None, slice(None))]
+        for msg_type, index in groups:
+            for column in numeric:
+                values = chunk[column].to_numpy(dtype=np.float64)[index]
+                stats.setdefault((column, msg_type), ColumnStats()).add(values)
+                if column in plotted:
+                    lines.setdefault((column, msg_type), StreamingDownsampler(points)).add(x[index], values)
+
+    if rows == 0:
+        return []
+    duration = (last_time - first_time) if has_timestamp else float('nan')
+    render_lines(label, metric, lines, has_timestamp, os.path.join(output_dir, f"{label.replace(os.sep, '_')}.png"))
+
+    summary = []
+    for (column, msg_type), column_stats in stats.items():
+        if not column_stats.count:
+            continue
+        name = column if msg_type is None else f"{msg_type}:{column}"
+        summary.append((label, name, column_stats.count, duration, column_stats.total / column_stats.count,
+                        column_stats.minimum, column_stats.maximum, column_stats.total))
+    return summary
+
+def render_lines(label: str, metric: str, lines: dict, has_timestamp: bool, output_image: str):
+    import matplotlib
+    matplotlib.use('Agg')  # Worker processes have no display
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+
+    figure = plt.figure(figsize=(14, 7))
+    for (column, msg_type), downsampler in lines.items():
+        x, y = downsampler.result()
+        if has_timestamp:
+            x = pd.to_datetime(x, unit='s')
+        plt.plot(x, y, label=column if msg_type is None else f"{msg_type} {column}", linewidth=1)
+
+    plt.title(label, fontsize=16)
+    plt.xlabel('Time' if has_timestamp else 'Sample', fontsize=14)
+    plt.ylabel(metric, fontsize=14)
+    plt.legend(fontsize=10)
+    plt.grid(True, which='both', linestyle='--', linewidth=0.5)
+    if has_timestamp:
+        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S'))
+        plt.xticks(rotation=45)
+    plt.tight_layout()
+    os.makedirs(os.path.dirname(output_image) or '.', exist_ok=True)
+    plt.savefig(output_image, dpi=150)
+    plt.close(figure)
+    print(f"Plot saved successfully at '{output_image}'.")
+
+def analyze_run(run_dir: str = 'logs', output_dir: str = 'plots', points: int = DEFAULT_POINTS,
+                workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    Plot and summarize every metric log below run_dir, one worker process per log.
+
+    Returns:
+    - pd.DataFrame: The summary table, also written to <output_dir>/summary.csv.
+    """
+    logs = discover_metric_logs(run_dir)
+    if not logs:
+        print(f"Error: No metric logs found in '{run_dir}'.")
+        return pd.DataFrame()
+
+    summary = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(analyze_log, label, metric, path, output_dir, points)
+                   for label, metric, path in logs]
+        for (label, _, path), future in zip(logs, futures):
+            try:
+                summary.extend(future.result())
+            except Exception as e:
+                print(f"Error analyzing '{path}': {e}")
+
+    table = pd.DataFrame(summary, columns=['log', 'column', 'rows', 'duration_s', 'mean', 'min', 'max', 'total'])
+    os.makedirs(output_dir, exist_ok=True)
+    table.to_csv(os.path.join(output_dir, 'summary.csv'), index=False)
+    return table
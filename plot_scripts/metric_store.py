@@ -0,0 +1,64 @@
+import numpy as np
+import os
+import struct
+from typing import Optional
+from Middleware.metric_store import MAGIC, VERSION, HEADER_FORMAT, HEADER_SIZE, FIELD_FORMAT, FIELD_SIZE
+
+def read_ring_header(path: str) -> tuple:
+    """
+    Read the header of a metric ring file.
+
+    Returns:
+    - (dtype, data offset, capacity, write count): the NumPy dtype of a record and where the records start.
+    """
+    with open(path, 'rb') as ring_file:
+        header = ring_file.read(HEADER_SIZE)
+        magic, version, field_count, data_offset, record_size, capacity, write_count = \
+            struct.unpack(HEADER_FORMAT, header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"'{path}' is not a version {VERSION} metric ring file")
+        fields = []
+        for _ in range(field_count):
+            name, dtype = struct.unpack(FIELD_FORMAT, ring_file.read(FIELD_SIZE))
+            fields.append((name.rstrip(b'\0').decode('utf-8'), dtype.rstrip(b'\0').decode('ascii')))
+    dtype = np.dtype(fields)
+    if dtype.itemsize != record_size:
+        raise ValueError(f"'{path}' has records of {record_size} bytes, its fields take {dtype.itemsize}")
+    return dtype, data_offset, capacity, write_count
+
+def read_metric_ring(path: str) -> Optional[np.ndarray]:
+    """
+    Map the records of a metric ring file (logs/<name>.ring) into a NumPy structured array, oldest first.
+    Fields are accessed by name, e.g. records['timestamp']. Names of message types are bytes.
+
+    Parameters:
+    - path (str): Path of the ring file.
+
+    Returns:
+    - np.ndarray: Read-only view of the file while it hasn't wrapped around, a copy in order once it has.
+    - None: If the file doesn't exist or isn't a metric ring file.
+    """
+    if not os.path.exists(path):
+        print(f"Error: The file '{path}' does not exist.")
+        return None
+
+    try:
+        dtype, data_offset, capacity, write_count = read_ring_header(path)
+    except (ValueError, struct.error) as e:
+        print(f"Error reading the metric ring file: {e}")
+        return None
+
+    if write_count == 0:
+        return np.zeros(0, dtype=dtype)
+    records = np.memmap(path, dtype=dtype, mode='r', offset=data_offset, shape=(capacity,))
+    if write_count <= capacity:
+        return records[:write_count]
+    # Wrapped around: the oldest record is in the slot the next write goes to
+    oldest = write_count % capacity
+    return np.concatenate((records[oldest:], records[:oldest]))
+
+def read_metric(name: str, logs_dir: str = 'logs') -> Optional[np.ndarray]:
+    """
+    Read the records of a metric by name, e.g. read_metric('bandwidth').
+    """
+    return read_metric_ring(os.path.join(logs_dir, f'{name}.ring'))
@@ -3,54 +3,82 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import os
 from typing import Optional
+from Middleware.metrics import bucket_index, bucket_upper_bound
+from plot_scripts.metric_store import read_metric_ring
+
+PERCENTILE_COLUMNS = ['p50', 'p90', 'p99', 'p999']
+
+def read_ring_frame(ring_file: str) -> Optional[pd.DataFrame]:
+    """
+    Read the records of a metric ring file into a DataFrame, message types decoded to str.
+    """
+    records = read_metric_ring(ring_file)
+    if records is None:
+        return None
+    data = pd.DataFrame(records)
+    data['type'] = data['type'].str.decode('utf-8')
+    return data
+
+def merged_percentiles(bucket_rows: pd.DataFrame) -> pd.Series:
+    """
+    Merge the histograms of several rows (e.g. all message types of an interval) and return
+    their percentiles and max in ms. Percentiles of the rows can't be averaged, their buckets can be added.
+    """
+    merged = bucket_rows.groupby('lower_bound')['count'].sum().to_dict()
+
+    total = sum(merged.values())
+    result = {'count': total}
+    for column, fraction in zip(PERCENTILE_COLUMNS, (0.5, 0.9, 0.99, 0.999)):
+        rank = max(1, int(fraction * total + 0.5))
+        seen = 0
+        for lower_bound in sorted(merged):
+            seen += merged[lower_bound]
+            if seen >= rank:
+                result[column] = bucket_upper_bound(bucket_index(lower_bound)) / 1000
+                break
+    result['max'] = bucket_upper_bound(bucket_index(max(merged))) / 1000 if merged else 0.0
+    return pd.Series(result)
 
 def plot_transmission_times(
-    log_file: str = 'logs/transmission_times.log',
+    ring_file: str = 'logs/transmission_histogram.ring',
+    bucket_ring_file: str = 'logs/transmission_buckets.ring',
     output_image: str = 'plots/transmission_times_plot.png',
     show_plot: bool = True,
-    log_rate: Optional[float] = None
+    msg_type: Optional[str] = None
 ) -> Optional[plt.Figure]:
     """
-    Reads transmission times from a log file and plots them over time or sequence,
-    including an average transmission time line.
-    
+    Reads the transmission time histograms from their metric ring files and plots the p50, p90, p99, p99.9
+    and max transmission time of every logged interval over time.
+
     Parameters:
-    - log_file (str): Path to the transmission times log file.
+    - ring_file (str): Path to the transmission histogram ring file.
+    - bucket_ring_file (str): Path to the ring file of the histogram buckets, used to merge the message types.
     - output_image (str): Path where the plot image will be saved.
     - show_plot (bool): Whether to display the plot interactively.
-    - log_rate (Optional[float]): Time interval (in seconds) between logged transmission times.
-                                  If provided, timestamps will be inferred based on this rate.
-                                  If None, the x-axis will represent the sequence index.
+    - msg_type (Optional[str]): Message type to plot. If None, the histograms of all types are merged.
 
     Returns:
     - plt.Figure: The matplotlib figure object if plotting is successful.
     - None: If an error occurs during processing.
     """
-    # Check if the log file exists
-    if not os.path.exists(log_file):
-        print(f"Error: The file '{log_file}' does not exist.")
+    # Per type rows come from the histogram ring, merged ones are computed from the buckets
+    source = ring_file if msg_type is not None else bucket_ring_file
+    data = read_ring_frame(source)
+    if data is None:
         return None
-
-    # Read the data into a pandas DataFrame
-    # Assuming the log file has one transmission time per line without header
-    try:
-        data = pd.read_csv(log_file, header=None, names=['transmission_time'])
-    except Exception as e:
-        print(f"Error reading the log file: {e}")
+    if data.empty:
+        print(f"Error: No transmission times in '{source}'.")
         return None
 
-    # Assign timestamps if log_rate is provided
-    if log_rate is not None:
-        # Create a datetime index starting from a base time (e.g., current time minus total duration)
-        num_entries = len(data)
-        total_duration = num_entries * log_rate
-        base_time = pd.Timestamp.now() - pd.Timedelta(seconds=total_duration)
-        data['datetime'] = base_time + pd.to_timedelta(data.index * log_rate, unit='s')
-        data.set_index('datetime', inplace=True)
+    if msg_type is not None:
+        data = data[data['type'] == msg_type].set_index('timestamp')
+        if data.empty:
+            print(f"Error: No transmission times of type '{msg_type}' in '{source}'.")
+            return None
     else:
-        # Use sequence index as x-axis
-        data['index'] = data.index
-        data.set_index('index', inplace=True)
+        data = data.groupby('timestamp')[['lower_bound', 'count']].apply(merged_percentiles)
+
+    data.index = pd.to_datetime(data.index, unit='s')
 
     # Ensure the output directory exists
     plot_dir = os.path.dirname(output_image)
@@ -64,36 +92,32 @@ def plot_transmission_times(
 
     # Plotting
     plt.figure(figsize=(14, 7))
-    plt.plot(
-        data.index,
-        data['transmission_time'],
-        label='Transmission Time (s)',
-        color='purple',
-        marker='o',
-        linestyle='-'
-    )
-
-    # Calculate and plot the average transmission time
-    average_time = data['transmission_time'].mean()
-    plt.axhline(
-        y=average_time,
-        color='red',
-        linestyle='--',
-        linewidth=2,
-        label=f'Average Transmission Time ({average_time:.2f} s)'
-    )
+    for column, label, color in (
+        ('p50', 'p50', 'purple'),
+        ('p90', 'p90', 'blue'),
+        ('p99', 'p99', 'orange'),
+        ('p999', 'p99.9', 'red'),
+        ('max', 'Max', 'gray')
+    ):
+        plt.plot(
+            data.index,
+            data[column],
+            label=label,
+            color=color,
+            linestyle='--' if column == 'max' else '-'
+        )
 
     # Beautify the plot
-    plt.title('Transmission Times Over Time', fontsize=18)
-    plt.xlabel('Time' if log_rate else 'Sequence', fontsize=14)
-    plt.ylabel('Transmission Time (s)', fontsize=14)
+    title = 'Transmission Times Over Time' + (f' ({msg_type})' if msg_type else '')
+    plt.title(title, fontsize=18)
+    plt.xlabel('Time', fontsize=14)
+    plt.ylabel('Transmission Time (ms)', fontsize=14)
+    plt.yscale('log')
     plt.legend(fontsize=12)
     plt.grid(True, which='both', linestyle='--', linewidth=0.5)
 
-    # Improve date formatting on the x-axis if timestamps are used
-    if log_rate is not None:
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S'))
-        plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator())
+    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S'))
+    plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator())
 
     plt.xticks(rotation=45)
     plt.tight_layout()
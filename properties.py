@@ -3,6 +3,10 @@
 #############################
 WIDTH, HEIGHT = 800, 600
 FPS = 30
+TICK_RATE = 60  # Simulation ticks per second, independent of the frame rate
+SEND_RATE = 30  # game_state messages sent per second
+RENDER_FPS = 120  # Frame rate cap of the game window, 0 for uncapped
+MAX_FRAME_TIME = 0.25  # Longest frame the simulation catches up on, longer stalls are dropped
 
 #############################
 # Menu properties
@@ -23,14 +27,23 @@ BACKGROUND_COLOR = (30, 30, 30)
 # Paddle
 #############################
 PADDLE_WIDTH, PADDLE_HEIGHT = 11, 100
-PADDLE_SPEED = 5
+PADDLE_SPEED = 300  # Pixels per second
 
 #############################
 # Ball
 #############################
 BALL_SIZE = 20
-BALL_SPEED_X = 5
-BALL_SPEED_Y = 6
+BALL_SPEED_X = 300  # Pixels per second
+BALL_SPEED_Y = 360
+
+#############################
+# Networking
+#############################
+KEYFRAME_INTERVAL = 60 # Send a full game state every 60 snapshots, deltas in between
+INTERPOLATION_DELAY = 0.1  # Seconds remote paddles and the ball are drawn in the past, to absorb jitter
+MAX_EXTRAPOLATION = 0.1  # Seconds a remote entity keeps moving when its snapshots are late
+SNAPSHOT_BUFFER_SIZE = 32  # Snapshots buffered per remote entity
+INPUT_BUFFER_SIZE = 120  # Unacknowledged paddle inputs kept for reconciliation (2 seconds of ticks)
 
 #############################
 # Middleware 
@@ -39,16 +52,51 @@ BALL_SPEED_Y = 6
 #Logging
 LOGS_DIR = "logs"
 LOG_RATE = 10 # Log every 10 seconds
+LOG_INTERVALS = {  # Seconds between two rows of a metric, metrics not listed use LOG_RATE
+    "transmission_histogram": 1,
+    "transmission_buckets": 1,
+    "transmission_times": 1,
+    "dropout_rate": 1,
+    "stream_loss": 1,
+}
+TRANSMISSION_SAMPLE_RATE = 0.0 # Fraction of transmission times also written raw to the transmission_times metric, 0 to disable
+METRIC_RING_CAPACITY = 65536  # Rows kept per metric in logs/<name>.ring before the oldest are overwritten
+METRIC_CSV_EXPORT = False  # Also write the rows as CSV to logs/<name>.log
+SEQUENCE_WINDOW = 1024  # Sequence numbers per sender stream checked for duplicates and late arrivals
 
 #Peer
 POLL_RATE = 1000 
+WIRE_CODECS = ["binary", "json"]  # Codecs offered to other peers, in order of preference
+CONFLATED_TOPICS = ["state"]  # Topics where only the newest message per sender is delivered
+HANDLER_POOL_SIZE = 4  # Threads shared by message handlers registered with the "pool" executor
+PEER_RUNTIME = "thread"  # "thread" or "asyncio" (one event loop shared by all peers of the process)
+TOPOLOGY = "mesh"  # "mesh" (every peer publishes to every peer) or "star" (the leader relays one world snapshot)
+RELAY_PORT_OFFSET = 1000  # Star topology relay port = PUB port + offset
+RELIABLE_CONTROL = True  # Acknowledge and retransmit election and side messages
+CONTROL_RETRY_INITIAL = 0.1  # Seconds before the first retransmission of an unacknowledged control message
+CONTROL_RETRY_MAX = 2  # Longest wait between retransmissions, the wait doubles up to it
+CONTROL_MAX_ATTEMPTS = 8  # Sends of a control message before it is given up
+CONTROL_RETRY_CHECK = 0.05  # Seconds between checks for overdue acknowledgements
 
 #Discovery
-PRESENCE_BROADCAST_INTERVAL = 1
-UDP_BROADCAST_PORT = 9999
+PRESENCE_BROADCAST_INTERVAL = 0.25  # Seconds between presence broadcasts after joining or finding a new peer
+PRESENCE_BACKOFF = 2  # Factor the interval grows by per broadcast
+PRESENCE_MAX_INTERVAL = 8  # Longest interval between presence broadcasts once the group is stable
+PEER_EXPIRY_TIMEOUT = 20  # Seconds without any message or presence after which a peer is removed
+PEER_EXPIRY_CHECK = 1  # Seconds between checks for expired peers
+UDP_BROADCAST_PORT = 9999  # Port of broadcast and multicast presence
+DISCOVERY_MODE = "broadcast"  # "broadcast" (to the subnet of the peer's ip) or "multicast" (to MULTICAST_GROUP)
+MULTICAST_GROUP = "239.255.42.99"  # Administratively scoped group, stays within the organization
+MULTICAST_TTL = 1  # Router hops presence travels, 1 keeps it on the local segment
+MULTICAST_INTERFACE = None  # Interface name or IPv4 address, None for the one holding the peer's ip
 KEY = b'abcd'
 
 #Leader selection
 ELECTION_TIMEOUT = 5  
 HEARTBEAT_INTERVAL = 1 
-ELECTION_TIMEOUT_CHECK = 3 
\ No newline at end of file
+ELECTION_ANSWER_TIMEOUT = 1  # Seconds to wait for an ANSWER from a higher peer before declaring leadership
+COORDINATOR_TIMEOUT = 3  # Seconds to wait for the COORDINATOR of a higher peer that answered 
+#Clock synchronization
+CLOCK_SYNC_INTERVAL = 1  # Seconds between clock pings to the leader
+CLOCK_SYNC_SAMPLES = 8  # Ping/pong exchanges the minimum round trip is picked from
+CLOCK_SYNC_SMOOTHING = 0.25  # Fraction of the difference to the best sample applied per exchange
@@ -1,6 +0,0 @@
-import requests
-from datetime import datetime
-
-
-if current_time:
-    print("Synchronized UTC Time:", current_time)